@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import backends
+import batch
+import batching
+import metrics
+import utils
+
+####################################################################
+# Micro-batching benchmark
+#
+# Extracts the same receipts with single requests and with the
+# batching scheduler at several batch sizes against the fake backend.
+# The fake latency model is a fixed cost per request (--latency) plus
+# a cost per image (--image-latency), and at most --max-inflight
+# requests run at once, like the concurrency a rate limit allows.
+# Images are preprocessed and encoded once up front; only the
+# extraction is measured.
+####################################################################
+
+class LimitedBackend(backends.ModelBackend):
+    """
+    Backend wrapper allowing a fixed number of requests in flight.
+    """
+
+    def __init__(self, backend, max_inflight):
+        self.backend = backend
+        self.model_name = backend.model_name
+        self.slots = threading.BoundedSemaphore(max_inflight)
+
+    @property
+    def calls(self):
+        return self.backend.calls
+
+    def generate(self, contents):
+        with self.slots:
+            return self.backend.generate(contents)
+
+def extract_receipts(backend, payloads, receipts, concurrency, scheduler=None):
+    """
+    Extract `receipts` receipts with `concurrency` callers.
+
+    Returns:
+        dict: throughput, latency percentiles, number of model calls and failed receipts
+    """
+    latencies = []
+    batch_waits = []
+    errors = []
+
+    def extract_one(n):
+        payload = payloads[n % len(payloads)]
+        timer = metrics.StageTimer()
+        start = time.perf_counter()
+        try:
+            receipt_data = scheduler.extract(payload, timer=timer, announced=True) if scheduler is not None else None
+            if receipt_data is None:
+                utils.extract_receipt_data(backend, payload, timer=timer)
+        except backends.BackendError:
+            errors.append(n)
+            return
+        latencies.append(time.perf_counter() - start)
+        batch_waits.append(timer.stages.get("batch_wait", 0.0))
+
+    calls_before = backend.calls
+    if scheduler is not None:
+        # Every receipt of the run is on its way from the start
+        for _ in range(receipts):
+            scheduler.announce()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(extract_one, range(receipts)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "elapsed": elapsed,
+        "throughput": receipts / elapsed,
+        "p50": batch.percentile(latencies, 50),
+        "p95": batch.percentile(latencies, 95),
+        "batch_wait_p50": batch.percentile(batch_waits, 50),
+        "model_calls": backend.calls - calls_before,
+        "errors": len(errors),
+    }
+
+def run(image_paths, batch_sizes, max_wait, receipts, concurrency, max_inflight, latency, latency_sigma,
+        image_latency, error_rate, seed):
+    upload = {"max_side": 1600, "image_format": "webp1"}
+    payloads = [utils.encode_for_upload(utils.preprocess_image(path), **upload) for path in image_paths]
+
+    rows = []
+    for batch_size in [1] + batch_sizes:
+        backend = LimitedBackend(backends.FakeBackend(latency=latency, latency_sigma=latency_sigma,
+                                                      image_latency=image_latency, error_rate=error_rate,
+                                                      seed=seed), max_inflight)
+        if batch_size == 1:
+            row = extract_receipts(backend, payloads, receipts, concurrency)
+            row["fallbacks"] = 0
+        else:
+            with batching.BatchingScheduler(backend, max_batch_size=batch_size, max_wait=max_wait,
+                                            max_concurrent_batches=concurrency) as scheduler:
+                row = extract_receipts(backend, payloads, receipts, concurrency, scheduler)
+                row["fallbacks"] = scheduler.stats()["fallbacks"]
+        row["batch_size"] = batch_size
+        rows.append(row)
+    return rows
+
+def print_summary(rows):
+    print(f"{'batch':>5} {'receipts/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'wait p50 ms':>11} "
+          f"{'model calls':>11} {'fallbacks':>9} {'errors':>6}")
+    for row in rows:
+        print(f"{row['batch_size'] if row['batch_size'] > 1 else 'off':>5} "
+              f"{row['throughput']:>10.2f} {row['p50'] * 1000:>8.0f} {row['p95'] * 1000:>8.0f} "
+              f"{row['batch_wait_p50'] * 1000:>11.0f} {row['model_calls']:>11} {row['fallbacks']:>9} {row['errors']:>6}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark micro-batched against single-receipt model requests.")
+    parser.add_argument("inputs", nargs="*", default=["test-images"], help="images, directories or glob patterns")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--max-wait", type=float, default=0.05, help="seconds a batch waits to fill")
+    parser.add_argument("--receipts", type=int, default=64, help="receipts extracted per configuration")
+    parser.add_argument("--concurrency", type=int, default=8, help="receipts in flight at the same time")
+    parser.add_argument("--max-inflight", type=int, default=2, help="model requests allowed at the same time")
+    parser.add_argument("--latency", type=float, default=1.0, help="fake latency per request in seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.0, help="lognormal spread of the fake latency")
+    parser.add_argument("--image-latency", type=float, default=0.1, help="fake latency per image in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of failing model requests")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the rows to this JSON file")
+    args = parser.parse_args()
+
+    image_paths = batch.collect_images(args.inputs)
+    if not image_paths:
+        parser.error("no images found")
+
+    rows = run(image_paths, args.batch_sizes, args.max_wait, args.receipts, args.concurrency, args.max_inflight,
+               args.latency, args.latency_sigma, args.image_latency, args.error_rate, args.seed)
+    print_summary(rows)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+if __name__ == "__main__":
+    main()
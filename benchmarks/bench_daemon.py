@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+import batch
+import client
+
+####################################################################
+# Worker daemon benchmark
+#
+# Wall time per receipt of one process per receipt, as run by
+# ingestion scripts: cold (python test_app.py <image>, importing cv2,
+# numpy and the model client every time) against warm (python
+# client.py <image> forwarding to a running service.py --unix-socket).
+# Also reports a bare interpreter start and the daemon round trip
+# without any process start. Uses the fake backend with caches and
+# stores disabled, so every run does the full pipeline.
+####################################################################
+
+def percentiles_ms(values):
+    values = np.array(values) * 1000
+    return {"p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95)),
+            "mean": float(values.mean())}
+
+def time_commands(commands, env):
+    times = []
+    for command in commands:
+        start = time.perf_counter()
+        subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+def wait_for_daemon(socket_path, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            status, _, _ = client.request(socket_path, "GET", "/healthz")
+            if status == 200:
+                return
+        except (client.DaemonUnavailable, OSError):
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"Daemon did not start on {socket_path}")
+
+def run(image_paths, runs, latency):
+    env = dict(os.environ, MODEL_BACKEND="fake", FAKE_LATENCY=str(latency), RESULT_CACHE_PATH="",
+               RESULTS_STORE_PATH="", DUPLICATE_INDEX_PATH="", METRICS_FILE="")
+    images = [image_paths[i % len(image_paths)] for i in range(runs)]
+    python = sys.executable
+    report = {"runs": runs, "fake_latency": latency}
+
+    report["interpreter"] = percentiles_ms(time_commands([[python, "-c", "pass"]] * runs, env))
+    report["cold"] = percentiles_ms(time_commands(
+        [[python, os.path.join(SRC, "test_app.py"), image, "--store", ""] for image in images], env))
+
+    with tempfile.TemporaryDirectory() as directory:
+        socket_path = os.path.join(directory, "receipts.sock")
+        start = time.perf_counter()
+        daemon = subprocess.Popen([python, os.path.join(SRC, "service.py"), "--unix-socket", socket_path,
+                                   "--workers", "1"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_daemon(socket_path)
+            report["daemon_start_ms"] = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            client.extract_file(images[0], socket_path)
+            report["first_request_ms"] = (time.perf_counter() - start) * 1000
+
+            report["warm"] = percentiles_ms(time_commands(
+                [[python, os.path.join(SRC, "client.py"), image, "--socket", socket_path] for image in images], env))
+            times = []
+            for image in images:
+                start = time.perf_counter()
+                client.extract_file(image, socket_path)
+                times.append(time.perf_counter() - start)
+            report["round_trip"] = percentiles_ms(times)
+        finally:
+            daemon.send_signal(signal.SIGTERM)
+            daemon.wait(timeout=30)
+
+    report["speedup"] = report["cold"]["p50"] / report["warm"]["p50"]
+    return report
+
+def print_summary(report):
+    print(f"{report['runs']} runs per mode, fake model latency {report['fake_latency']:.2f}s")
+    print(f"{'per receipt':>34} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8}")
+    rows = (
+        ("interpreter start (python -c pass)", "interpreter"),
+        ("cold: test_app.py <image>", "cold"),
+        ("warm: client.py <image>", "warm"),
+        ("warm: daemon round trip only", "round_trip"),
+    )
+    for label, key in rows:
+        row = report[key]
+        print(f"{label:>34} {row['p50']:>8.0f} {row['p95']:>8.0f} {row['mean']:>8.0f}")
+    print(f"Daemon start {report['daemon_start_ms']:.0f} ms, first request {report['first_request_ms']:.0f} ms, "
+          f"warm speedup {report['speedup']:.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold CLI invocations against the warm worker daemon.")
+    parser.add_argument("inputs", nargs="*", default=["test-images"], help="images, directories or glob patterns")
+    parser.add_argument("--runs", type=int, default=20, help="invocations per mode")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake model latency in seconds")
+    parser.add_argument("--json", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    image_paths = batch.collect_images(args.inputs)
+    if not image_paths:
+        raise SystemExit("No images found")
+    report = run(image_paths, args.runs, args.latency)
+    print_summary(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
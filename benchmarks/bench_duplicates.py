@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import batch
+import duplicate_index
+import utils
+
+####################################################################
+# Near-duplicate index benchmark
+#
+# Index: bulk-loads --entries random hashes into a temporary index
+# and measures lookup latency for misses and for near-duplicates with
+# k flipped bits, against a brute-force scan of all hashes.
+#
+# Threshold: hashes edited copies of the test images (recompression,
+# brightness, crops, small rotations) and reports their distance to
+# the original next to the distance between different receipts, to
+# choose DUPLICATE_MAX_DISTANCE.
+####################################################################
+
+def percentiles_ms(values):
+    values = np.array(values) * 1000
+    return {"p50": float(np.percentile(values, 50)), "p99": float(np.percentile(values, 99))}
+
+def bench_index(entries, queries, max_distance, flips, seed):
+    rng = np.random.default_rng(seed)
+    hashes = rng.integers(0, 2 ** 64, size=entries, dtype=np.uint64)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "duplicates.db")
+        index = duplicate_index.DuplicateIndex(path, "bench", max_distance=max_distance, merge_threshold=entries + 1)
+        start = time.perf_counter()
+        index.add_many((int(h), {}) for h in hashes)
+        insert_time = time.perf_counter() - start
+        index.close()
+
+        start = time.perf_counter()
+        index = duplicate_index.DuplicateIndex(path, "bench", max_distance=max_distance)
+        open_time = time.perf_counter() - start
+
+        report = {
+            "entries": entries,
+            "max_distance": max_distance,
+            "insert_s": insert_time,
+            "open_s": open_time,
+        }
+
+        times = []
+        for query in rng.integers(0, 2 ** 64, size=queries, dtype=np.uint64):
+            start = time.perf_counter()
+            index.nearest(int(query))
+            times.append(time.perf_counter() - start)
+        report["miss"] = percentiles_ms(times)
+
+        times = []
+        for query in rng.integers(0, 2 ** 64, size=min(queries, 20), dtype=np.uint64):
+            start = time.perf_counter()
+            int(np.bitwise_count(hashes ^ query).min())
+            times.append(time.perf_counter() - start)
+        report["brute_force"] = percentiles_ms(times)
+
+        report["near"] = {}
+        for k in flips:
+            times, found = [], 0
+            for position in rng.integers(0, entries, size=queries):
+                bits = rng.choice(64, size=k, replace=False)
+                query = int(hashes[position]) ^ sum(1 << int(bit) for bit in bits)
+                start = time.perf_counter()
+                match = index.nearest(query)
+                times.append(time.perf_counter() - start)
+                found += match is not None and match[1] <= k
+            report["near"][k] = dict(percentiles_ms(times), recall=found / queries)
+        index.close()
+    return report
+
+def image_variants(img):
+    """
+    Edited copies of a BGR image a user might upload for the same receipt.
+    """
+    h, w = img.shape[:2]
+    rotation = cv2.getRotationMatrix2D((w / 2, h / 2), 3, 1.0)
+    _, recompressed = cv2.imencode(".jpg", cv2.resize(img, (w // 2, h // 2), interpolation=cv2.INTER_AREA),
+                                   [cv2.IMWRITE_JPEG_QUALITY, 60])
+    return {
+        "jpeg q60, half size": cv2.imdecode(recompressed, cv2.IMREAD_COLOR),
+        "brightness +30": cv2.convertScaleAbs(img, alpha=1.0, beta=30),
+        "crop 5% border": img[int(h * 0.05):int(h * 0.95), int(w * 0.05):int(w * 0.95)],
+        "crop 10% top": img[int(h * 0.1):, :],
+        "rotate 3 deg": cv2.warpAffine(img, rotation, (w, h), borderMode=cv2.BORDER_REPLICATE),
+    }
+
+def phash_of(img):
+    return utils.perceptual_hash(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+
+def distance(a, b):
+    return bin(a ^ b).count("1")
+
+def bench_threshold(image_paths):
+    originals = {}
+    variants = {}
+    hash_times = []
+    for image_path in image_paths:
+        img = cv2.imread(image_path)
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        utils.perceptual_hash(gray)
+        start = time.perf_counter()
+        originals[image_path] = utils.perceptual_hash(gray)
+        hash_times.append(time.perf_counter() - start)
+        for name, variant in image_variants(img).items():
+            variants.setdefault(name, []).append(distance(originals[image_path], phash_of(variant)))
+
+    paths = list(originals)
+    different = [distance(originals[a], originals[b]) for i, a in enumerate(paths) for b in paths[i + 1:]]
+    return {
+        "images": len(paths),
+        "hash_ms": percentiles_ms(hash_times),
+        "variants": {name: {"min": min(d), "max": max(d)} for name, d in variants.items()},
+        "different_receipts": {"min": min(different), "max": max(different)} if different else None,
+    }
+
+def print_summary(index_report, threshold_report):
+    print(f"Index: {index_report['entries']} entries, max distance {index_report['max_distance']}, "
+          f"insert {index_report['insert_s']:.1f}s, open {index_report['open_s']:.2f}s")
+    print(f"{'query':>16} {'p50 ms':>8} {'p99 ms':>8} {'recall':>7}")
+    print(f"{'miss':>16} {index_report['miss']['p50']:>8.3f} {index_report['miss']['p99']:>8.3f} {'':>7}")
+    for k, row in index_report["near"].items():
+        print(f"{f'{k} bits flipped':>16} {row['p50']:>8.3f} {row['p99']:>8.3f} {row['recall']:>7.0%}")
+    print(f"{'brute force':>16} {index_report['brute_force']['p50']:>8.3f} {index_report['brute_force']['p99']:>8.3f}")
+
+    if threshold_report is None:
+        return
+    print()
+    print(f"Perceptual hash: {threshold_report['images']} images, p50 {threshold_report['hash_ms']['p50']:.1f} ms")
+    print(f"{'variant':>20} {'distance':>9}")
+    for name, row in threshold_report["variants"].items():
+        print(f"{name:>20} {row['min']:>4}-{row['max']:<4}")
+    if threshold_report["different_receipts"]:
+        row = threshold_report["different_receipts"]
+        print(f"{'different receipts':>20} {row['min']:>4}-{row['max']:<4}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the near-duplicate receipt index.")
+    parser.add_argument("inputs", nargs="*", default=["test-images"], help="images, directories or glob patterns")
+    parser.add_argument("--entries", type=int, default=1_000_000, help="random hashes loaded into the index")
+    parser.add_argument("--queries", type=int, default=1000, help="lookups per query kind")
+    parser.add_argument("--max-distance", type=int, default=10, help="near-duplicate threshold in bits")
+    parser.add_argument("--flips", type=int, nargs="+", default=[0, 4, 8, 10], help="bits flipped in near-duplicate queries")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    index_report = bench_index(args.entries, args.queries, args.max_distance, args.flips, args.seed)
+    image_paths = batch.collect_images(args.inputs)
+    threshold_report = bench_threshold(image_paths) if image_paths else None
+    print_summary(index_report, threshold_report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"index": index_report, "threshold": threshold_report}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,530 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import backends
+import batch
+import pipeline
+import result_cache
+import tiling
+import utils
+
+####################################################################
+# Golden-output regression benchmark
+#
+# Runs the full pipeline (pipeline.process_receipt() with the
+# configured crop, preprocessing, upload and tiling settings, without
+# result cache) over every image of one or more corpus directories and
+# replays recorded model responses, so it runs offline and compares
+# preprocessing, prompt or parsing changes on the same answers.
+#
+# A corpus directory holds the images and a golden/ directory with
+#
+#   <image stem>.json    expected receipt data (same schema as the output)
+#   recordings.jsonl     model responses per source image and prompt
+#
+# Responses are looked up by the SHA-256 of the source image, the kind
+# of request (one_shot, type, extract:<TYPE>, reask:<TYPE>,
+# tile_summary, tile_items:<part>/<count>) and the digest of the prompt.
+# When the prompt changed since recording, the response of the same
+# kind is replayed and counted as stale; re-record them with --record
+# (which calls the configured MODEL_BACKEND and appends its responses).
+# Records marked "synthetic" were written by hand rather than returned
+# by the model; accuracy over them measures parsing and scoring only.
+#
+# Reports per-stage latency percentiles, throughput, peak RSS (Linux),
+# input/payload bytes and field-level accuracy against the golden files:
+# amounts and VAT are compared as numbers, dates by their digits, plates
+# without spaces, names by similarity and items by matching (name,
+# price) pairs. It exits with status 1 when a receipt fails or a
+# response is missing or stale (unless --allow-failures/--allow-stale),
+# when the accuracy falls below --min-accuracy and, with --baseline (an
+# earlier --json report), when latency, payload, memory or accuracy
+# regress past the --max-* thresholds. tests/test_golden.py runs it
+# over test-images/ under pytest.
+####################################################################
+
+GOLDEN_DIR = "golden"
+RECORDINGS_FILE = "recordings.jsonl"
+FIELDS = ("type", "business_name", "date", "license_plate", "total_amount", "vat_percentage")
+NAME_SIMILARITY = 0.8
+MB = 1024 * 1024
+
+###################################################################
+# Recorded Responses
+###################################################################
+
+def prompt_kind(prompt):
+    """
+    Kind of a model request, stable across edits of the prompt wording.
+    """
+    if prompt == utils.ONE_SHOT_PROMPT:
+        return "one_shot"
+    if prompt == utils.TYPE_DETERMINATION_PROMPT:
+        return "type"
+    if prompt == utils.TILE_SUMMARY_PROMPT:
+        return "tile_summary"
+    for receipt_type in utils.PROMPTS:
+        if prompt == utils.build_extraction_prompt(receipt_type):
+            return f"extract:{receipt_type}"
+        if prompt == utils.build_tile_summary_prompt(receipt_type):
+            return "tile_summary"
+        if prompt.startswith(f"Some fields of the receipt ({receipt_type})"):
+            return f"reask:{receipt_type}"
+    match = re.search(r"part (\d+) of (\d+)", prompt)
+    if match:
+        return f"tile_items:{match.group(1)}/{match.group(2)}"
+    return "other"
+
+def prompt_digest(prompt):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+def load_recordings(path):
+    """
+    Load a recordings file into {(image digest, kind): {prompt digest: record}};
+    later lines replace earlier recordings of the same request.
+    """
+    recordings = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    recordings.setdefault((record["image"], record["kind"]), {})[record["prompt"]] = record
+    return recordings
+
+class ReplayBackend(backends.ModelBackend):
+    """
+    Backend answering the requests of one receipt from its recorded responses.
+
+    Args:
+        recordings (dict): loaded by load_recordings()
+        image_digest (str): SHA-256 of the source image
+        latency (float): seconds every call sleeps, standing in for the model
+    """
+
+    name = "replay"
+    model_name = "replay"
+
+    def __init__(self, recordings, image_digest, latency=0.0):
+        self.recordings = recordings
+        self.image_digest = image_digest
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.counts = {"exact": 0, "stale": 0, "missing": 0, "synthetic": 0}
+
+    def generate(self, contents):
+        prompt = backends.prompt_of(contents)
+        kind = prompt_kind(prompt)
+        responses = self.recordings.get((self.image_digest, kind), {})
+        record = responses.get(prompt_digest(prompt))
+        outcome = "exact"
+        if record is None and responses:
+            record, outcome = list(responses.values())[-1], "stale"
+        elif record is None:
+            outcome = "missing"
+        with self.lock:
+            self.counts[outcome] += 1
+            self.counts["synthetic"] += bool(record and record.get("synthetic"))
+        if record is None:
+            raise LookupError(f"No recorded response for {kind} request, re-record with --record")
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return record["text"]
+
+class RecorderBackend(backends.ModelBackend):
+    """
+    Wrapper appending the responses of another backend for one receipt to a recordings file.
+
+    Args:
+        backend (backends.ModelBackend): backend to record
+        path (str): recordings file
+        image_digest (str): SHA-256 of the source image
+        lock (threading.Lock): lock shared by the recorders writing the file
+    """
+
+    name = "recorder"
+
+    def __init__(self, backend, path, image_digest, lock):
+        self.backend = backend
+        self.model_name = backend.model_name
+        self.path = path
+        self.image_digest = image_digest
+        self.lock = lock
+        self.counts = {"recorded": 0}
+
+    def generate(self, contents):
+        text = self.backend.generate(contents)
+        prompt = backends.prompt_of(contents)
+        record = {"image": self.image_digest, "kind": prompt_kind(prompt), "prompt": prompt_digest(prompt),
+                  "text": text}
+        with self.lock:
+            self.counts["recorded"] += 1
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return text
+
+###################################################################
+# Field Accuracy
+###################################################################
+
+def normalize_field(field, value):
+    """
+    Comparable form of a receipt field, None when it is missing or unreadable.
+    """
+    if value is None or str(value).strip() == "":
+        return None
+    if field in ("total_amount", "vat_percentage"):
+        values, valid = utils.normalize_monetary_values([value])
+        return round(float(values[0]), 2) if valid[0] else None
+    if field == "date":
+        return re.sub(r"\D", "", str(value))
+    if field in ("license_plate", "type"):
+        return re.sub(r"\s+", "", str(value)).upper()
+    return re.sub(r"\s+", " ", str(value)).strip().casefold()
+
+def field_matches(field, extracted, expected):
+    value, target = normalize_field(field, extracted), normalize_field(field, expected)
+    if value is None or target is None:
+        return value == target
+    if field == "business_name":
+        return tiling.same_item({"name": value, "price": None}, {"name": target, "price": None}, NAME_SIMILARITY)
+    return value == target
+
+def match_items(extracted, expected):
+    """
+    Number of expected items found among the extracted ones, each extracted
+    item matching at most once (equal price and similar name, see tiling.same_item()).
+    """
+    unmatched = list(extracted)
+    matched = 0
+    for item in expected:
+        for index, candidate in enumerate(unmatched):
+            if isinstance(candidate, dict) and tiling.same_item(candidate, item, NAME_SIMILARITY):
+                del unmatched[index]
+                matched += 1
+                break
+    return matched
+
+def score_receipt(data, golden):
+    """
+    Compare an extracted receipt with its golden file.
+
+    Returns:
+        dict: "fields" (field -> matched) for the fields of the golden file and
+        "items" with the expected, extracted and matched counts for item lists
+    """
+    data = data or {}
+    score = {"fields": {field: field_matches(field, data.get(field), golden[field])
+                        for field in FIELDS if field in golden}}
+    if "items" in golden:
+        extracted = data.get("items") or []
+        score["items"] = {"expected": len(golden["items"]), "extracted": len(extracted),
+                          "matched": match_items(extracted, golden["items"])}
+    return score
+
+def accuracy_summary(scores):
+    """
+    Per-field accuracy, item recall/precision/F1 and the overall accuracy,
+    where every field counts once and an item list counts with its F1.
+    """
+    fields = {}
+    for score in scores:
+        for field, matched in score["fields"].items():
+            counts = fields.setdefault(field, {"correct": 0, "total": 0})
+            counts["correct"] += matched
+            counts["total"] += 1
+    for counts in fields.values():
+        counts["accuracy"] = counts["correct"] / counts["total"]
+
+    item_scores = [score["items"] for score in scores if "items" in score]
+    expected = sum(items["expected"] for items in item_scores)
+    extracted = sum(items["extracted"] for items in item_scores)
+    matched = sum(items["matched"] for items in item_scores)
+    recall = matched / expected if expected else None
+    precision = matched / extracted if extracted else (None if not item_scores else 0.0)
+    f1s = [2 * items["matched"] / (items["expected"] + items["extracted"])
+           if items["expected"] + items["extracted"] else 1.0 for items in item_scores]
+
+    correct = sum(counts["correct"] for counts in fields.values()) + sum(f1s)
+    total = sum(counts["total"] for counts in fields.values()) + len(f1s)
+    return {
+        "overall": correct / total if total else None,
+        "fields": fields,
+        "items": {"recall": recall, "precision": precision,
+                  "f1": 2 * matched / (expected + extracted) if expected + extracted else None},
+        "scored_receipts": len(scores),
+    }
+
+###################################################################
+# Benchmark Run
+###################################################################
+
+def read_status(field):
+    with open("/proc/self/status", encoding="ascii") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError(f"{field} missing from /proc/self/status")
+
+def reset_peak_rss():
+    """
+    Reset the peak RSS (VmHWM) to the current RSS and return it, None where /proc is unavailable.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as f:
+            f.write("5")
+        return read_status("VmRSS")
+    except OSError:
+        return None
+
+def load_corpus(corpora):
+    """
+    Collect the images of the corpus directories with their golden data and recordings.
+
+    Returns:
+        list: (image path, golden dict or None, recordings path) per image
+    """
+    entries = []
+    for corpus in corpora:
+        golden_dir = os.path.join(corpus, GOLDEN_DIR)
+        recordings_path = os.path.join(golden_dir, RECORDINGS_FILE)
+        for path in batch.collect_images([corpus]):
+            golden_path = os.path.join(golden_dir, os.path.splitext(os.path.basename(path))[0] + ".json")
+            golden = None
+            if os.path.exists(golden_path):
+                with open(golden_path, encoding="utf-8") as f:
+                    golden = json.load(f)
+            entries.append((path, golden, recordings_path))
+    return entries
+
+def write_golden(path, data):
+    golden_dir = os.path.join(os.path.dirname(path), GOLDEN_DIR)
+    os.makedirs(golden_dir, exist_ok=True)
+    golden_path = os.path.join(golden_dir, os.path.splitext(os.path.basename(path))[0] + ".json")
+    with open(golden_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    return golden_path
+
+def run(entries, args):
+    recordings = {path: load_recordings(path) for path in {entry[2] for entry in entries}}
+    live_backend = backends.create_backend() if args.record else None
+    record_lock = threading.Lock()
+    if args.record:
+        for recordings_path in recordings:
+            os.makedirs(os.path.dirname(recordings_path), exist_ok=True)
+
+    def process(entry):
+        path, _, recordings_path = entry
+        with open(path, "rb") as f:
+            digest = result_cache.image_digest(f.read())
+        if live_backend is not None:
+            backend = RecorderBackend(live_backend, recordings_path, digest, record_lock)
+        else:
+            backend = ReplayBackend(recordings[recordings_path], digest, args.latency)
+        return pipeline.process_receipt(path, backend, mode=args.mode), backend.counts
+
+    # Warm up imports, lazy initializations and allocator pools before measuring
+    if not args.record:
+        process(entries[0])
+
+    results = []
+    baseline_rss = reset_peak_rss()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for _ in range(args.repeat if not args.record else 1):
+            results.extend(zip(entries, executor.map(process, entries)))
+    elapsed = time.perf_counter() - start
+    peak_mb = (read_status("VmHWM") - baseline_rss) / MB if baseline_rss is not None else None
+    return results, elapsed, peak_mb
+
+def build_report(results, elapsed, peak_mb, args):
+    latencies, stages, payloads, inputs, scores, receipts = [], {}, [], [], [], []
+    replay = {}
+    for (path, golden, _), (result, counts) in results:
+        latencies.append(result["processing_time"])
+        for name, seconds in result.get("stages", {}).items():
+            stages.setdefault(name, []).append(seconds)
+        for outcome, count in counts.items():
+            replay[outcome] = replay.get(outcome, 0) + count
+        payload = result.get("payload_bytes")
+        if payload is not None:
+            payloads.append(payload + result.get("tiling", {}).get("payload_bytes", 0))
+        if result.get("input_bytes") is not None:
+            inputs.append(result["input_bytes"])
+        row = {"file": path, "success": result["success"], "error": result.get("error"),
+               "seconds": round(result["processing_time"], 6), "payload_bytes": payload}
+        if golden is not None:
+            row["score"] = score_receipt(result.get("data") if result["success"] else None, golden)
+            scores.append(row["score"])
+        receipts.append(row)
+
+    return {
+        "corpus": args.corpus,
+        "mode": args.mode,
+        "receipts": len(results),
+        "repeat": args.repeat,
+        "workers": args.workers,
+        "failed": sum(not row["success"] for row in receipts),
+        "elapsed": elapsed,
+        "throughput": len(results) / elapsed if elapsed > 0 else 0.0,
+        "latency": {"p50": batch.percentile(latencies, 50), "p95": batch.percentile(latencies, 95),
+                    "max": max(latencies, default=0.0)},
+        "stages": {name: {"p50": batch.percentile(values, 50), "p95": batch.percentile(values, 95)}
+                   for name, values in stages.items()},
+        "peak_mb": peak_mb,
+        "input_bytes": {"mean": float(np.mean(inputs)) if inputs else None},
+        "payload_bytes": {"mean": float(np.mean(payloads)) if payloads else None,
+                          "max": max(payloads, default=None)},
+        "accuracy": accuracy_summary(scores),
+        "replay": replay,
+        "per_receipt": receipts,
+    }
+
+###################################################################
+# Regression Checks
+###################################################################
+
+def check_regressions(report, baseline, args):
+    """
+    Compare a report against the thresholds and an optional baseline report.
+
+    Returns:
+        list: description of every crossed threshold
+    """
+    failures = []
+    if report["failed"] and not args.allow_failures:
+        failures.append(f"{report['failed']} of {report['receipts']} receipts failed")
+    for outcome in ("missing", "stale"):
+        if report["replay"].get(outcome) and not (outcome == "stale" and args.allow_stale):
+            failures.append(f"{report['replay'][outcome]} {outcome} recorded responses, re-record with --record")
+    accuracy = report["accuracy"]["overall"]
+    if args.min_accuracy is not None and accuracy is not None and accuracy < args.min_accuracy:
+        failures.append(f"accuracy {accuracy:.1%} below the minimum of {args.min_accuracy:.1%}")
+    if baseline is None:
+        return failures
+
+    def compare(name, current, previous, max_increase):
+        if current is not None and previous and current > previous * (1 + max_increase):
+            failures.append(f"{name} {current:.4g} is {current / previous - 1:.0%} above the baseline "
+                            f"{previous:.4g} (max +{max_increase:.0%})")
+
+    for percentile in ("p50", "p95"):
+        compare(f"latency {percentile}", report["latency"][percentile], baseline["latency"][percentile],
+                args.max_latency_regression)
+    compare("mean payload bytes", report["payload_bytes"]["mean"], baseline["payload_bytes"]["mean"],
+            args.max_payload_regression)
+    compare("peak MB", report["peak_mb"], baseline.get("peak_mb"), args.max_memory_regression)
+
+    previous = baseline["accuracy"]["overall"]
+    if accuracy is not None and previous is not None and previous - accuracy > args.max_accuracy_drop:
+        failures.append(f"accuracy {accuracy:.1%} dropped from {previous:.1%} (max -{args.max_accuracy_drop:.1%})")
+    for field, counts in report["accuracy"]["fields"].items():
+        before = baseline["accuracy"]["fields"].get(field)
+        if before and before["accuracy"] - counts["accuracy"] > args.max_accuracy_drop:
+            failures.append(f"{field} accuracy {counts['accuracy']:.1%} dropped from {before['accuracy']:.1%}")
+    return failures
+
+def print_summary(report):
+    print(f"{report['receipts']} receipts ({report['repeat']} passes, {report['workers']} workers), "
+          f"{report['failed']} failed, {report['throughput']:.2f} receipts/s")
+    print(f"latency p50 {report['latency']['p50'] * 1000:.1f} ms, p95 {report['latency']['p95'] * 1000:.1f} ms")
+    for name, values in report["stages"].items():
+        print(f"  {name:<16} p50 {values['p50'] * 1000:>8.2f} ms   p95 {values['p95'] * 1000:>8.2f} ms")
+    if report["peak_mb"] is not None:
+        print(f"peak memory {report['peak_mb']:.0f} MB above the warm process")
+    if report["payload_bytes"]["mean"] is not None:
+        print(f"payload {report['payload_bytes']['mean'] / 1024:.1f} KiB mean "
+              f"(input {report['input_bytes']['mean'] / 1024:.1f} KiB)")
+
+    accuracy = report["accuracy"]
+    if accuracy["overall"] is None:
+        print("no golden files, accuracy not measured")
+    else:
+        print(f"accuracy {accuracy['overall']:.1%} over {accuracy['scored_receipts']} scored receipts")
+        for field, counts in accuracy["fields"].items():
+            print(f"  {field:<16} {counts['correct']:>4}/{counts['total']:<4} {counts['accuracy']:.1%}")
+        items = accuracy["items"]
+        if items["recall"] is not None:
+            print(f"  {'items':<16} recall {items['recall']:.1%}, precision {items['precision']:.1%}, "
+                  f"F1 {items['f1']:.1%}")
+    if report["replay"]:
+        print("model responses: " + ", ".join(f"{count} {outcome}" for outcome, count in report["replay"].items()))
+    if report["replay"].get("synthetic"):
+        print("note: synthetic responses measure parsing and scoring, not the model; record real ones with --record")
+    for row in report["per_receipt"]:
+        if not row["success"]:
+            print(f"  failed {row['file']}: {row['error']}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the pipeline over golden receipts with recorded model responses.")
+    parser.add_argument("corpus", nargs="*", default=[os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                   "..", "test-images")],
+                        help="corpus directories with a golden/ subdirectory (default test-images/)")
+    parser.add_argument("--mode", choices=utils.EXTRACTION_MODES, default=utils.EXTRACTION_MODE_ONE_SHOT)
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the corpus")
+    parser.add_argument("--workers", type=int, default=1, help="receipts processed at the same time")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every replayed model call takes")
+    parser.add_argument("--record", action="store_true",
+                        help="call MODEL_BACKEND instead of replaying and append its responses to the recordings")
+    parser.add_argument("--write-golden", action="store_true",
+                        help="write the extractions of images without a golden file as their golden file")
+    parser.add_argument("--json", help="write the report to this JSON file")
+    parser.add_argument("--baseline", help="earlier --json report to check for regressions against")
+    parser.add_argument("--max-latency-regression", type=float, default=0.5,
+                        help="allowed relative increase of the p50/p95 latency (default 0.5)")
+    parser.add_argument("--max-payload-regression", type=float, default=0.05,
+                        help="allowed relative increase of the mean payload bytes (default 0.05)")
+    parser.add_argument("--max-memory-regression", type=float, default=0.25,
+                        help="allowed relative increase of the peak memory (default 0.25)")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.0,
+                        help="allowed absolute drop of the overall and per-field accuracy (default 0)")
+    parser.add_argument("--min-accuracy", type=float, help="lowest accepted overall accuracy")
+    parser.add_argument("--allow-failures", action="store_true", help="do not fail the run on failed receipts")
+    parser.add_argument("--allow-stale", action="store_true",
+                        help="do not fail the run on responses recorded for an earlier prompt")
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args()
+    entries = load_corpus(args.corpus)
+    if not entries:
+        raise SystemExit("No images found")
+    results, elapsed, peak_mb = run(entries, args)
+    report = build_report(results, elapsed, peak_mb, args)
+
+    if args.write_golden:
+        written = {}
+        for (path, golden, _), (result, _) in results:
+            if golden is None and result["success"] and path not in written:
+                written[path] = write_golden(path, result["data"])
+        for golden_path in written.values():
+            print(f"wrote {golden_path}")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    report["regressions"] = check_regressions(report, baseline, args)
+
+    print_summary(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    for failure in report["regressions"]:
+        print(f"REGRESSION: {failure}")
+    if report["regressions"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
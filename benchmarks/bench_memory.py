@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+import backends
+import batch
+import memory_budget
+import pipeline
+import utils
+
+####################################################################
+# Image memory benchmark
+#
+# Peak resident memory of the pipeline on large camera photos (12, 24
+# and 48 megapixel JPEGs made by upscaling a test receipt and adding
+# sensor-like noise). Every measurement runs in a fresh child process
+# that resets its peak RSS after imports and a warm-up receipt and
+# reports the peak (VmHWM) above the RSS at that point, so it counts
+# what the receipt itself allocates (Linux only, uses /proc):
+#
+#   full:   DECODE_MAX_SIDE=0, the whole photo is decoded
+#   draft:  default decode, JPEG DCT scaling to DECODE_MAX_SIDE
+#
+# A concurrent scenario processes --concurrency 48MP photos at once
+# with full decode, without and with a memory budget (--budget MB).
+# Uses the fake backend; caches and duplicate detection are off.
+####################################################################
+
+SIZES = {"12MP": (3000, 4000), "24MP": (4000, 6000), "48MP": (6000, 8000)}
+MB = 1024 * 1024
+
+def read_status(field):
+    with open("/proc/self/status", encoding="ascii") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError(f"{field} missing from /proc/self/status")
+
+def reset_peak_rss():
+    # ru_maxrss cannot be reset and even survives exec (it would report the
+    # parent's peak); writing 5 to clear_refs resets VmHWM to the current RSS
+    with open("/proc/self/clear_refs", "w", encoding="ascii") as f:
+        f.write("5")
+    return read_status("VmRSS")
+
+def make_photo(source, size, path, seed=0):
+    gray = utils.load_grayscale(source, max_side=None)
+    photo = cv2.resize(gray, size, interpolation=cv2.INTER_CUBIC)
+    photo = cv2.cvtColor(photo, cv2.COLOR_GRAY2BGR)
+    noise = np.random.default_rng(seed).normal(0, 4, photo.shape)
+    photo = np.clip(photo + noise, 0, 255).astype(np.uint8)
+    cv2.imwrite(path, photo, [cv2.IMWRITE_JPEG_QUALITY, 90])
+
+def run_child(args):
+    """
+    Process --concurrency copies of one photo in this process and print the measurement as JSON.
+    """
+    backend = backends.FakeBackend(latency=args.latency, seed=0)
+    with open(args.warmup, "rb") as f:
+        pipeline.process_receipt(f.read(), backend)
+    with open(args.child, "rb") as f:
+        image_bytes = f.read()
+    memory = memory_budget.MemoryBudget(args.budget * MB) if args.budget else None
+
+    baseline = reset_peak_rss()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(lambda _: pipeline.process_receipt(image_bytes, backend, memory=memory),
+                                    range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "peak_mb": (read_status("VmHWM") - baseline) / MB,
+        "seconds": elapsed,
+        "decode_ms": float(np.mean([r["stages"].get("decode", 0.0) for r in results])) * 1000,
+        "memory_wait_ms": float(np.mean([r["stages"].get("memory_wait", 0.0) for r in results])) * 1000,
+        "succeeded": sum(r["success"] for r in results),
+    }))
+
+def measure(photo, warmup, decode_max_side, concurrency=1, budget=0, latency=0.0):
+    env = dict(os.environ, MODEL_BACKEND="fake", RESULT_CACHE_PATH="", DECODE_MAX_SIDE=str(decode_max_side))
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", photo, "--warmup", warmup,
+         "--concurrency", str(concurrency), "--budget", str(budget), "--latency", str(latency)],
+        env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def run(source, args):
+    report = {"decode_max_side": utils.DECODE_MAX_SIDE, "per_image": [], "concurrent": []}
+    with tempfile.TemporaryDirectory() as directory:
+        photos = {}
+        for name in args.sizes:
+            photos[name] = os.path.join(directory, f"{name}.jpg")
+            make_photo(source, SIZES[name], photos[name])
+
+        for name in args.sizes:
+            row = {"size": name, "megapixels": SIZES[name][0] * SIZES[name][1] / 1e6,
+                   "file_mb": os.path.getsize(photos[name]) / MB}
+            row["full"] = measure(photos[name], source, 0)
+            row["draft"] = measure(photos[name], source, utils.DECODE_MAX_SIDE)
+            report["per_image"].append(row)
+
+        largest = photos[args.sizes[-1]]
+        for budget in (0, args.budget):
+            report["concurrent"].append({
+                "size": args.sizes[-1], "concurrency": args.concurrency, "budget_mb": budget,
+                **measure(largest, source, 0, args.concurrency, budget, args.latency),
+            })
+    return report
+
+def print_summary(report):
+    print(f"{'photo':>6} {'file MB':>8} {'full peak MB':>13} {'full ms':>8} {'draft peak MB':>14} {'draft ms':>9}")
+    for row in report["per_image"]:
+        print(f"{row['size']:>6} {row['file_mb']:>8.1f} {row['full']['peak_mb']:>13.0f} "
+              f"{row['full']['seconds'] * 1000:>8.0f} {row['draft']['peak_mb']:>14.0f} "
+              f"{row['draft']['seconds'] * 1000:>9.0f}")
+    for row in report["concurrent"]:
+        budget = f"{row['budget_mb']} MB budget" if row["budget_mb"] else "no budget"
+        print(f"{row['concurrency']} x {row['size']} full decode, {budget}: peak {row['peak_mb']:.0f} MB, "
+              f"{row['seconds']:.2f}s, mean memory wait {row['memory_wait_ms']:.0f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark peak memory of the pipeline on large photos.")
+    parser.add_argument("--source", default=os.path.join(SRC, "..", "test-images"),
+                        help="receipt image (or directory, its first image) the photos are made from")
+    parser.add_argument("--sizes", nargs="+", choices=tuple(SIZES), default=list(SIZES))
+    parser.add_argument("--concurrency", type=int, default=4, help="photos processed at once (concurrent scenario)")
+    parser.add_argument("--budget", type=int, default=256, help="memory budget in MB (concurrent scenario)")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake model latency in seconds")
+    parser.add_argument("--json", help="write the report to this JSON file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--warmup", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    sources = batch.collect_images([args.source])
+    if not sources:
+        raise SystemExit("No images found")
+    report = run(sources[0], args)
+    print_summary(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
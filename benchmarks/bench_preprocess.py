@@ -0,0 +1,152 @@
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import batch
+import utils
+
+####################################################################
+# Preprocessing and upload payload benchmark
+#
+# For every image the unoptimized payload is the full resolution
+# preprocessed image as the Gemini SDK would upload it (lossless WebP),
+# compared against each max_side/format combination. With receipt
+# localization enabled (default) the payloads and the preprocessing
+# time are measured on the cropped image and the localization cost is
+# reported next to the preprocessing time saved on the smaller image.
+# The preprocessing profile is chosen per image from its measured
+# quality (--profile auto) or forced; the full profile on the uncropped
+# photo is the reference time.
+####################################################################
+
+def sdk_default_bytes(img):
+    buffer = io.BytesIO()
+    img.convert('RGB').save(buffer, format="webp", lossless=True)
+    return len(buffer.getvalue())
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    value = func(*args, **kwargs)
+    return value, time.perf_counter() - start
+
+def run(image_paths, max_sides, formats, repeat, crop=True, profile="auto"):
+    rows = []
+    for image_path in image_paths:
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+        gray = utils.load_grayscale(image_bytes)
+
+        crop_times = []
+        crop_info = {"cropped": False, "area": None}
+        cropped = gray
+        if crop:
+            for _ in range(repeat):
+                (cropped, crop_info), elapsed = timed(utils.crop_to_receipt, gray)
+                crop_times.append(elapsed)
+
+        assess_times = []
+        chosen = profile
+        if profile == "auto":
+            for _ in range(repeat):
+                quality, elapsed = timed(utils.assess_quality, cropped)
+                assess_times.append(elapsed)
+            chosen = utils.choose_profile(quality)
+
+        full_preprocess_times = []
+        preprocess_times = []
+        for _ in range(repeat):
+            full_img, elapsed = timed(utils.preprocess_image, gray)
+            full_preprocess_times.append(elapsed)
+            img, elapsed = timed(utils.preprocess_image, cropped, chosen)
+            preprocess_times.append(elapsed)
+        baseline, baseline_time = timed(sdk_default_bytes, full_img)
+
+        for max_side in max_sides:
+            for image_format in formats:
+                encode_times = []
+                for _ in range(repeat):
+                    payload, elapsed = timed(utils.encode_for_upload, img, max_side=max_side, image_format=image_format)
+                    encode_times.append(elapsed)
+                rows.append({
+                    "image": os.path.basename(image_path),
+                    "size": list(full_img.size),
+                    "cropped_size": list(img.size),
+                    "cropped": crop_info["cropped"],
+                    "crop_area": crop_info["area"],
+                    "profile": chosen,
+                    "max_side": max_side,
+                    "format": image_format,
+                    "input_bytes": len(image_bytes),
+                    "baseline_bytes": baseline,
+                    "payload_bytes": len(payload["data"]),
+                    "reduction": 1 - len(payload["data"]) / baseline,
+                    "crop_ms": statistics.median(crop_times) * 1000 if crop_times else 0.0,
+                    "assess_ms": statistics.median(assess_times) * 1000 if assess_times else 0.0,
+                    "full_preprocess_ms": statistics.median(full_preprocess_times) * 1000,
+                    "preprocess_ms": statistics.median(preprocess_times) * 1000,
+                    "encode_ms": statistics.median(encode_times) * 1000,
+                    "baseline_encode_ms": baseline_time * 1000,
+                })
+    return rows
+
+def print_images(rows):
+    print(f"{'image':>16} {'cropped':>7} {'area':>5} {'size':>11} {'crop ms':>8} {'profile':>7} {'assess ms':>9} "
+          f"{'preprocess ms reference -> chosen':>34}")
+    seen = set()
+    for row in rows:
+        if row["image"] in seen:
+            continue
+        seen.add(row["image"])
+        area = f"{row['crop_area']:.0%}" if row["crop_area"] is not None else "-"
+        size = "x".join(str(side) for side in row["cropped_size"])
+        print(f"{row['image']:>16} {'yes' if row['cropped'] else 'no':>7} {area:>5} {size:>11} {row['crop_ms']:>8.1f} "
+              f"{row['profile']:>7} {row['assess_ms']:>9.1f} {row['full_preprocess_ms']:>24.1f} -> {row['preprocess_ms']:>6.1f}")
+    print(f"Median preprocessing: reference {statistics.median(r['full_preprocess_ms'] for r in rows):.1f} ms, "
+          f"chosen {statistics.median(r['preprocess_ms'] for r in rows):.1f} ms "
+          f"(+ {statistics.median(r['crop_ms'] + r['assess_ms'] for r in rows):.1f} ms localization and assessment)")
+
+def print_summary(rows):
+    print(f"{'max_side':>8} {'format':>6} {'payload KB':>11} {'baseline KB':>12} {'reduction':>9} {'preprocess ms':>14} {'encode ms':>10} {'baseline encode ms':>19}")
+    combinations = sorted({(row["max_side"], row["format"]) for row in rows}, key=lambda c: (-c[0], c[1]))
+    for max_side, image_format in combinations:
+        group = [row for row in rows if row["max_side"] == max_side and row["format"] == image_format]
+        print(f"{max_side:>8} {image_format:>6} "
+              f"{statistics.mean(r['payload_bytes'] for r in group) / 1024:>11.1f} "
+              f"{statistics.mean(r['baseline_bytes'] for r in group) / 1024:>12.1f} "
+              f"{statistics.mean(r['reduction'] for r in group):>9.0%} "
+              f"{statistics.median(r['preprocess_ms'] for r in group):>14.1f} "
+              f"{statistics.median(r['encode_ms'] for r in group):>10.1f} "
+              f"{statistics.median(r['baseline_encode_ms'] for r in group):>19.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark preprocessing and upload payload sizes.")
+    parser.add_argument("inputs", nargs="*", default=["test-images"], help="images, directories or glob patterns")
+    parser.add_argument("--max-sides", default="2048,1600,1280,1024", help="comma separated longest side caps")
+    parser.add_argument("--formats", default=",".join(utils.UPLOAD_FORMATS), help="comma separated upload formats")
+    parser.add_argument("--repeat", type=int, default=3, help="timing repetitions per image")
+    parser.add_argument("--no-crop", action="store_true", help="measure the full photo without receipt localization")
+    parser.add_argument("--profile", choices=("auto",) + utils.PREPROCESS_PROFILES, default="auto",
+                        help="preprocessing profile, auto chooses it from the measured image quality")
+    parser.add_argument("--json", help="write the per-image rows to this JSON file")
+    args = parser.parse_args()
+
+    image_paths = batch.collect_images(args.inputs)
+    rows = run(image_paths, [int(s) for s in args.max_sides.split(",")], args.formats.split(","), args.repeat,
+               crop=not args.no_crop, profile=args.profile)
+    print(f"{len(image_paths)} images")
+    print_images(rows)
+    print()
+    print_summary(rows)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+if __name__ == "__main__":
+    main()
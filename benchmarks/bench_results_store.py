@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import results_store
+
+####################################################################
+# Results store benchmark
+#
+# Bulk-loads --receipts synthetic receipts (fuel receipts spread over
+# --plates plates, market receipts with items, restaurant receipts)
+# into a temporary store and times the aggregate queries served from
+# the rollup tables against the same aggregates computed by scanning
+# the receipts table, plus an indexed receipt lookup.
+####################################################################
+
+def turkish_amount(value):
+    whole, cents = divmod(round(value * 100), 100)
+    return f"{whole:,}".replace(",", ".") + f",{cents:02d}"
+
+def synthetic_receipts(count, plates, businesses, seed):
+    rng = random.Random(seed)
+    plate_names = [f"34 {rng.choice('ABCDEFGHKLMNPRSTUVYZ')}{rng.choice('ABCDEFGHKLMNPRSTUVYZ')} {rng.randint(100, 9999)}"
+                   for _ in range(plates)]
+    for n in range(count):
+        receipt_type = rng.choices(("FUEL", "MARKET", "RESTAURANT"), weights=(4, 3, 3))[0]
+        data = {
+            "type": receipt_type,
+            "business_name": f"{receipt_type.title()} {rng.randrange(businesses)}",
+            "date": f"{rng.randint(1, 28):02d}.{rng.randint(1, 12):02d}.{rng.randint(2022, 2025)}",
+            "total_amount": turkish_amount(rng.uniform(50, 5000)),
+        }
+        if receipt_type == "FUEL":
+            data["license_plate"] = rng.choice(plate_names)
+            data["vat_percentage"] = "%20"
+        elif receipt_type == "RESTAURANT":
+            data["vat_percentage"] = rng.choice(("%10", "%20"))
+        else:
+            data["items"] = [{"name": f"Item {rng.randrange(5000)}", "price": turkish_amount(rng.uniform(5, 500))}
+                             for _ in range(rng.randint(1, 8))]
+        yield {"data": data, "source": f"receipt-{n}.jpg", "image_digest": f"{seed}-{n}"}
+
+def timed_ms(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000, len(rows)
+
+def run(receipts, plates, businesses, chunk_size, repeat, seed):
+    with tempfile.TemporaryDirectory() as directory:
+        store = results_store.ResultsStore(os.path.join(directory, "receipts.sqlite3"))
+
+        start = time.perf_counter()
+        chunk = []
+        for record in synthetic_receipts(receipts, plates, businesses, seed):
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                store.add_many(chunk)
+                chunk = []
+        if chunk:
+            store.add_many(chunk)
+        insert_time = time.perf_counter() - start
+        counts = store.stats()
+
+        def scan(sql):
+            return lambda: store.conn.execute(sql).fetchall()
+
+        plate = store.spend_per_plate()[0]["license_plate"]
+
+        queries = {
+            "spend per plate per month": (
+                lambda: store.spend_per_plate(),
+                scan("SELECT license_plate, month, COUNT(*), SUM(total_amount), SUM(vat_amount) FROM receipts "
+                     "WHERE receipt_type = 'FUEL' AND license_plate IS NOT NULL GROUP BY license_plate, month"),
+            ),
+            "one plate, 2024": (
+                lambda: store.spend_per_plate("2024-01", "2024-12", license_plate=plate),
+                None,
+            ),
+            "VAT per type": (
+                lambda: store.vat_per_type(),
+                scan("SELECT receipt_type, COUNT(*), SUM(total_amount), SUM(vat_amount) FROM receipts "
+                     "GROUP BY receipt_type"),
+            ),
+            "spend per month": (
+                lambda: store.aggregate(("month",)),
+                scan("SELECT month, COUNT(*), SUM(total_amount), SUM(vat_amount) FROM receipts GROUP BY month"),
+            ),
+            "business per month, 2025-03": (
+                lambda: store.aggregate(("business_name",), month_from="2025-03", month_to="2025-03"),
+                scan("SELECT business_name, COUNT(*), SUM(total_amount) FROM receipts "
+                     "WHERE month = '2025-03' GROUP BY business_name"),
+            ),
+            "receipts of a plate, one month": (
+                lambda: store.find(license_plate=plate, date_from="2024-06-01", date_to="2024-06-30"),
+                None,
+            ),
+        }
+
+        rows = []
+        for name, (query, scan_query) in queries.items():
+            query_ms, result_rows = timed_ms(query, repeat)
+            scan_ms = timed_ms(scan_query, 1)[0] if scan_query is not None else None
+            rows.append({"query": name, "rows": result_rows, "ms": query_ms, "scan_ms": scan_ms})
+        store.close()
+        size = os.path.getsize(os.path.join(directory, "receipts.sqlite3"))
+
+    return {
+        "receipts": counts["receipts"],
+        "items": counts["items"],
+        "insert_s": insert_time,
+        "insert_per_s": receipts / insert_time,
+        "db_bytes": size,
+        "queries": rows,
+    }
+
+def print_summary(report):
+    print(f"{report['receipts']} receipts, {report['items']} items, "
+          f"{report['db_bytes'] / 1024 / 1024:.0f} MB, bulk insert {report['insert_s']:.1f}s "
+          f"({report['insert_per_s']:.0f} receipts/s)")
+    print(f"{'query':>32} {'rows':>6} {'ms':>8} {'table scan ms':>14}")
+    for row in report["queries"]:
+        scan = f"{row['scan_ms']:.1f}" if row["scan_ms"] is not None else "-"
+        print(f"{row['query']:>32} {row['rows']:>6} {row['ms']:>8.2f} {scan:>14}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bulk inserts and aggregate queries of the results store.")
+    parser.add_argument("--receipts", type=int, default=1_000_000)
+    parser.add_argument("--plates", type=int, default=200)
+    parser.add_argument("--businesses", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=10_000, help="receipts per bulk insert")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repetitions per query")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    report = run(args.receipts, args.plates, args.businesses, args.chunk_size, args.repeat, args.seed)
+    print_summary(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
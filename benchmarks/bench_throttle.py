@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import backends
+import throttle
+import utils
+
+####################################################################
+# Model call scheduler benchmark
+#
+# Sends --calls extraction requests from --clients threads to a fake
+# backend that injects faults like a loaded API, once directly and
+# once through throttle.ThrottledBackend:
+#
+#   overload: the fake rejects calls beyond --capacity in flight with 429
+#   quota:    the fake accepts --rpm calls per minute (rpm / 60 per second)
+#   outage:   every call fails with 503 between 1 s and 1 + --outage s,
+#             calls arrive at --arrival-rate per second instead of
+#             back to back
+#
+# Reports completed and failed calls, calls that reached the fake, its
+# 429 rejections, throughput and latency next to the scheduler state.
+####################################################################
+
+SCENARIOS = ("overload", "quota", "outage")
+
+def make_fake(scenario, args):
+    backend = backends.FakeBackend(latency=args.latency, latency_sigma=0.3, seed=args.seed,
+                                   error_kinds={"unavailable": 1.0})
+    if scenario == "overload":
+        backend.max_concurrency = args.capacity
+    elif scenario == "quota":
+        backend.rpm = args.rpm
+    return backend
+
+def make_throttled(scenario, fake, args):
+    return throttle.ThrottledBackend(
+        fake,
+        rpm=args.rpm * 0.9 if scenario == "quota" else 0,
+        concurrency=throttle.AdaptiveConcurrency(initial=args.clients, maximum=args.clients),
+        breaker=throttle.CircuitBreaker(failure_threshold=5, cooldown=0.5),
+        deadline=args.deadline,
+        seed=args.seed,
+    )
+
+def inject_outage(fake, duration, stop):
+    if stop.wait(1.0):
+        return
+    fake.error_rate = 1.0
+    stop.wait(duration)
+    fake.error_rate = 0.0
+
+def run_scenario(scenario, throttled, args):
+    fake = make_fake(scenario, args)
+    backend = make_throttled(scenario, fake, args) if throttled else fake
+    contents = [{"mime_type": "image/webp", "data": b"receipt"}, utils.ONE_SHOT_PROMPT]
+
+    paced = scenario == "outage"
+
+    def call(index):
+        if paced:
+            time.sleep(max(0.0, started + index / args.arrival_rate - time.perf_counter()))
+        start = time.perf_counter()
+        try:
+            backend.generate(contents)
+            return True, time.perf_counter() - start
+        except backends.BackendError:
+            return False, time.perf_counter() - start
+
+    stop = threading.Event()
+    outage = None
+    if scenario == "outage":
+        outage = threading.Thread(target=inject_outage, args=(fake, args.outage, stop), daemon=True)
+        outage.start()
+
+    started = start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        outcomes = list(executor.map(call, range(args.calls)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    if outage is not None:
+        outage.join()
+
+    latencies = np.array([latency for ok, latency in outcomes if ok]) * 1000
+    succeeded = len(latencies)
+    report = {
+        "scenario": scenario,
+        "throttled": throttled,
+        "succeeded": succeeded,
+        "failed": len(outcomes) - succeeded,
+        "server_calls": fake.calls,
+        "server_rejected": fake.rejected,
+        "elapsed_s": elapsed,
+        "throughput": succeeded / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)) if succeeded else None,
+        "p99_ms": float(np.percentile(latencies, 99)) if succeeded else None,
+    }
+    if throttled:
+        report["scheduler"] = backend.stats()
+    return report
+
+def print_summary(reports):
+    print(f"{'scenario':>9} {'client':>10} {'ok':>5} {'failed':>6} {'sent':>5} {'429s':>5} {'rps':>6} "
+          f"{'p50 ms':>7} {'p99 ms':>7} {'limit':>6} {'retries':>7} {'opens':>5} {'fast-fail':>9}")
+    for r in reports:
+        scheduler = r.get("scheduler")
+        extra = (f"{scheduler['limit']:>6.1f} {scheduler['retries']:>7} {scheduler['circuit_opens']:>5} "
+                 f"{scheduler['circuit_rejected']:>9}") if scheduler else f"{'-':>6} {'-':>7} {'-':>5} {'-':>9}"
+        p50 = f"{r['p50_ms']:.0f}" if r["p50_ms"] is not None else "-"
+        p99 = f"{r['p99_ms']:.0f}" if r["p99_ms"] is not None else "-"
+        print(f"{r['scenario']:>9} {'throttled' if r['throttled'] else 'direct':>10} {r['succeeded']:>5} "
+              f"{r['failed']:>6} {r['server_calls']:>5} {r['server_rejected']:>5} {r['throughput']:>6.1f} "
+              f"{p50:>7} {p99:>7} {extra}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the model call scheduler against injected faults.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--calls", type=int, default=400, help="model calls per run")
+    parser.add_argument("--clients", type=int, default=32, help="threads calling the backend")
+    parser.add_argument("--latency", type=float, default=0.2, help="median fake call latency in seconds")
+    parser.add_argument("--capacity", type=int, default=8, help="calls in flight the fake accepts (overload)")
+    parser.add_argument("--rpm", type=float, default=1800, help="calls per minute the fake accepts (quota)")
+    parser.add_argument("--outage", type=float, default=2.0, help="seconds of 503 responses (outage)")
+    parser.add_argument("--arrival-rate", type=float, default=50, help="calls started per second (outage)")
+    parser.add_argument("--deadline", type=float, default=30.0, help="deadline per call in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    reports = []
+    for scenario in args.scenarios:
+        for throttled in (False, True):
+            reports.append(run_scenario(scenario, throttled, args))
+    print_summary(reports)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import argparse
+import collections
+import io
+import json
+import os
+import re
+import sys
+import time
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import backends
+import pipeline
+import utils
+
+####################################################################
+# Tiled extraction benchmark
+#
+# Renders synthetic long grocery receipts (--items lines each, a few
+# weighed items spanning two lines and some items printed twice in a
+# row) and extracts them once with a single request and once from
+# overlapping bands (pipeline.process_receipt(tile=True)).
+#
+# A scripted backend stands in for the model: it finds where a band
+# lies in the rendered receipt and answers with exactly the items
+# fully visible in it, so the seams, the deduplication and the total
+# reconciliation are exercised like with a real model. Its latency
+# grows with the length of the response (--latency + --token-latency
+# per output token) and --max-output-tokens cuts long responses off.
+#
+# Reports latency, item recall/precision against the rendered items,
+# receipts whose items add up to the printed total and model calls.
+####################################################################
+
+WIDTH = 576
+LINE_PITCH = 24
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+PRODUCTS = ("SUT", "EKMEK", "YUMURTA", "PEYNIR", "ZEYTIN", "DOMATES", "SALATALIK", "MAKARNA", "PIRINC",
+            "SEKER", "CAY", "KAHVE", "DETERJAN", "SABUN", "SAMPUAN", "YOGURT", "TEREYAG", "MUZ", "ELMA", "PORTAKAL")
+
+def render_receipt(item_count, rng):
+    """
+    Render a long market receipt.
+
+    Returns:
+        tuple: (PNG bytes, receipt dict, list of (top, bottom, item) rows of every item)
+    """
+    lines, items = [], []
+    lines += [("MIGROS TICARET A.S.", None), ("ATASEHIR / ISTANBUL", None), ("TARIH: 14.03.2025  SAAT: 18:42", None), ("", None)]
+    while len(items) < item_count:
+        name = f"{rng.choice(PRODUCTS)} {rng.integers(1, 999)}"
+        price = rng.integers(100, 25000) / 100
+        repeat = 2 if rng.random() < 0.05 else 1
+        for _ in range(min(repeat, item_count - len(items))):
+            item = {"name": name, "price": amount_text(price)}
+            if rng.random() < 0.1:
+                weight = rng.integers(200, 3000) / 1000
+                item["name"] = f"{weight:.3f} KG X {amount_text(price / weight)} TL {name}".replace(".", ",", 1)
+                lines.append((f"{weight:.3f} KG X {amount_text(price / weight)} TL".replace(".", ",", 1), None))
+            lines.append((name, item))
+            items.append(item)
+    total = sum(float(item["price"].replace(",", ".")) for item in items)
+    lines += [("", None), ("------------------------------------", None), (f"TOPLAM *{amount_text(total)}", None)]
+
+    height = (len(lines) + 2) * LINE_PITCH
+    image = np.full((height, WIDTH), 255, np.uint8)
+    rows = []
+    pending_top = None
+    for index, (text, item) in enumerate(lines, 1):
+        baseline = index * LINE_PITCH
+        cv2.putText(image, text, (16, baseline), FONT, 0.55, 0, 1, cv2.LINE_AA)
+        if item is None:
+            pending_top = baseline - LINE_PITCH + 6 if text and "KG X" in text else None
+            continue
+        price = f"*{item['price']}"
+        (price_width, _), _ = cv2.getTextSize(price, FONT, 0.55, 1)
+        cv2.putText(image, price, (WIDTH - 16 - price_width, baseline), FONT, 0.55, 0, 1, cv2.LINE_AA)
+        top = pending_top if pending_top is not None else baseline - LINE_PITCH + 6
+        rows.append((top, baseline + 6, item))
+        pending_top = None
+
+    receipt = {"type": "MARKET", "business_name": "MIGROS TICARET A.S.", "date": "14.03.2025",
+               "total_amount": amount_text(total), "items": items}
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format="PNG")
+    return buffer.getvalue(), receipt, rows
+
+def amount_text(value):
+    return f"{value:.2f}".replace(".", ",")
+
+class ScriptedBackend(backends.ModelBackend):
+    """
+    Model stand-in answering from the rendered receipt set in self.current.
+    """
+
+    name = "scripted"
+    model_name = "scripted"
+
+    def __init__(self, latency, token_latency, max_output_tokens):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.max_output_tokens = max_output_tokens
+        self.current = None
+        self.calls = 0
+
+    def generate(self, contents):
+        self.calls += 1
+        image, prompt = contents[0], contents[-1]
+        receipt, profile, rows = self.current
+        if re.search(r"The image is part \d+ of \d+", prompt):
+            band = np.asarray(Image.open(io.BytesIO(image["data"])).convert("L"))
+            top = locate_band(band, profile)
+            bottom = top + band.shape[0]
+            answer = {"items": [item for item_top, item_bottom, item in rows
+                                if item_top >= top and item_bottom <= bottom]}
+        elif "Do not list the purchased items" in prompt:
+            answer = {key: value for key, value in receipt.items() if key != "items"}
+        else:
+            answer = receipt
+        text = f"```json\n{json.dumps(answer, ensure_ascii=False, indent=2)}\n```"
+        tokens = len(text) / 4
+        if self.max_output_tokens and tokens > self.max_output_tokens:
+            text = text[:self.max_output_tokens * 4]
+            tokens = self.max_output_tokens
+        time.sleep(self.latency + self.token_latency * tokens)
+        return text
+
+def locate_band(band, profile):
+    """
+    Row offset of a band in the preprocessed receipt, by matching row ink profiles.
+    """
+    band_profile = (band < 128).mean(axis=1)
+    windows = np.lib.stride_tricks.sliding_window_view(profile, len(band_profile))
+    return int(np.argmin(np.abs(windows - band_profile).sum(axis=1)))
+
+def item_accuracy(extracted, truth):
+    """
+    Recall and precision of (name, price) pairs, counting repeated items.
+    """
+    expected = collections.Counter((item["name"], item["price"]) for item in truth)
+    found = collections.Counter((item.get("name"), item.get("price")) for item in extracted)
+    matched = sum((expected & found).values())
+    return matched / max(sum(expected.values()), 1), matched / max(sum(found.values()), 1)
+
+def run(args):
+    rng = np.random.default_rng(args.seed)
+    backend = ScriptedBackend(args.latency, args.token_latency, args.max_output_tokens)
+    rows = []
+    for item_count in args.items:
+        for _ in range(args.receipts):
+            image_bytes, receipt, item_rows = render_receipt(item_count, rng)
+            processed = np.asarray(utils.preprocess_image(utils.load_grayscale(image_bytes), "light"))
+            backend.current = (receipt, (processed < 128).mean(axis=1), item_rows)
+            for tiled in (False, True):
+                calls = backend.calls
+                result = pipeline.process_receipt(image_bytes, backend, crop=False, profile="light", tile=tiled)
+                items = result["data"].get("items", []) if result["success"] else []
+                recall, precision = item_accuracy(items, receipt["items"])
+                total_ok = False
+                if result["success"]:
+                    values, valid = utils.normalize_monetary_values([item.get("price") for item in items])
+                    total_ok = abs(values[valid].sum() - float(receipt["total_amount"].replace(",", "."))) <= 0.01
+                rows.append({
+                    "items": item_count, "tiled": tiled, "success": result["success"],
+                    "seconds": result["processing_time"], "recall": recall, "precision": precision,
+                    "total_matches_items": bool(total_ok), "calls": backend.calls - calls,
+                    "bands": result.get("tiling", {}).get("bands", 1),
+                    "duplicates_dropped": result.get("tiling", {}).get("duplicates", 0),
+                    "restored": result.get("tiling", {}).get("reconciliation", {}).get("restored", 0),
+                })
+    return rows
+
+def summarize(rows):
+    summary = []
+    for item_count in sorted({row["items"] for row in rows}):
+        for tiled in (False, True):
+            group = [row for row in rows if row["items"] == item_count and row["tiled"] == tiled]
+            summary.append({
+                "items": item_count, "tiled": tiled, "receipts": len(group),
+                "p50_seconds": float(np.median([row["seconds"] for row in group])),
+                "recall": float(np.mean([row["recall"] for row in group])),
+                "precision": float(np.mean([row["precision"] for row in group])),
+                "totals_matched": sum(row["total_matches_items"] for row in group),
+                "bands": float(np.mean([row["bands"] for row in group])),
+                "calls": float(np.mean([row["calls"] for row in group])),
+                "duplicates_dropped": sum(row["duplicates_dropped"] for row in group),
+                "restored": sum(row["restored"] for row in group),
+            })
+    return summary
+
+def print_summary(summary):
+    print(f"{'items':>5} {'mode':>7} {'p50 s':>6} {'recall':>7} {'precision':>9} {'totals ok':>9} "
+          f"{'bands':>5} {'calls':>5} {'deduped':>7} {'restored':>8}")
+    for row in summary:
+        print(f"{row['items']:>5} {'tiled' if row['tiled'] else 'single':>7} {row['p50_seconds']:>6.2f} "
+              f"{row['recall']:>7.1%} {row['precision']:>9.1%} {row['totals_matched']:>5}/{row['receipts']:<3} "
+              f"{row['bands']:>5.1f} {row['calls']:>5.1f} {row['duplicates_dropped']:>7} {row['restored']:>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tiled against single-request extraction of long receipts.")
+    parser.add_argument("--items", type=int, nargs="+", default=[40, 80, 120, 160], help="items per receipt")
+    parser.add_argument("--receipts", type=int, default=2, help="receipts per item count")
+    parser.add_argument("--latency", type=float, default=0.8, help="model latency per call in seconds")
+    parser.add_argument("--token-latency", type=float, default=0.004, help="model latency per output token")
+    parser.add_argument("--max-output-tokens", type=int, default=0, help="cut responses off after this many tokens")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the per-receipt rows and the summary to this JSON file")
+    args = parser.parse_args()
+
+    rows = run(args)
+    summary = summarize(rows)
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "receipts": rows}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import batch
+
+####################################################################
+# Load generator for the HTTP extraction service (src/service.py)
+#
+# Closed loop (default): --concurrency clients send requests back to
+# back over keep-alive connections. Open loop (--rate): requests start
+# at a fixed rate whether or not earlier ones finished, which shows
+# the 429 backpressure once the service is saturated.
+####################################################################
+
+class Connection:
+    """
+    Minimal keep-alive HTTP/1.1 client connection.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=b""):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                f"Content-Type: application/octet-stream\r\nContent-Length: {len(body)}\r\n\r\n")
+        self.writer.write(head.encode("latin-1") + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            self.close()
+            raise ConnectionError("Connection closed by the service")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        payload = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, payload
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+async def send_receipt(connection, endpoint, body, poll_interval):
+    """
+    Send one receipt and wait for its result.
+
+    Returns:
+        int: final HTTP status (200 for a finished job)
+    """
+    if endpoint == "extract":
+        status, _ = await connection.request("POST", "/extract", body)
+        return status
+
+    status, payload = await connection.request("POST", "/jobs", body)
+    if status != 202:
+        return status
+    job_id = json.loads(payload)["id"]
+    while True:
+        await asyncio.sleep(poll_interval)
+        status, payload = await connection.request("GET", f"/jobs/{job_id}")
+        if status != 200:
+            return status
+        job = json.loads(payload)
+        if job["status"] == "done":
+            return 200
+        if job["status"] == "failed":
+            return 422
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+
+    def record(self, status, latency):
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status == 200:
+            self.latencies.append(latency)
+
+async def timed_send(host, port, pool, endpoint, body, poll_interval, stats):
+    connection = pool.pop() if pool else Connection(host, port)
+    start = time.perf_counter()
+    try:
+        status = await send_receipt(connection, endpoint, body, poll_interval)
+        stats.record(status, time.perf_counter() - start)
+        pool.append(connection)
+        return status
+    except (ConnectionError, asyncio.IncompleteReadError, OSError):
+        stats.errors += 1
+        connection.close()
+        return None
+
+async def run_load(url, bodies, endpoint, concurrency, rate, duration, poll_interval, unique):
+    target = urlsplit(url)
+    host, port = target.hostname, target.port or 80
+    stats = LoadStats()
+    pool = []
+    counter = itertools.count()
+
+    def next_body():
+        n = next(counter)
+        body = bodies[n % len(bodies)]
+        # Trailing bytes after the image end marker change the cache key but not the decoded image
+        return body + f"#{n}#{time.time()}".encode() if unique else body
+
+    start = time.perf_counter()
+    deadline = start + duration
+    if rate:
+        tasks = []
+        for n in itertools.count():
+            send_at = start + n / rate
+            if send_at >= deadline:
+                break
+            await asyncio.sleep(max(0.0, send_at - time.perf_counter()))
+            tasks.append(asyncio.create_task(timed_send(host, port, pool, endpoint, next_body(), poll_interval, stats)))
+        await asyncio.gather(*tasks)
+    else:
+        async def client():
+            while time.perf_counter() < deadline:
+                status = await timed_send(host, port, pool, endpoint, next_body(), poll_interval, stats)
+                if status in (None, 429, 503):
+                    # Back off briefly instead of hammering a saturated or stopped service
+                    await asyncio.sleep(0.1)
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+
+    elapsed = time.perf_counter() - start
+    for connection in pool:
+        connection.close()
+
+    completed = stats.statuses.get(200, 0)
+    return {
+        "endpoint": endpoint,
+        "concurrency": None if rate else concurrency,
+        "rate": rate,
+        "elapsed": elapsed,
+        "requests": sum(stats.statuses.values()) + stats.errors,
+        "statuses": {str(status): count for status, count in sorted(stats.statuses.items())},
+        "connection_errors": stats.errors,
+        "sustained_rps": completed / elapsed if elapsed > 0 else 0.0,
+        "p50": batch.percentile(stats.latencies, 50),
+        "p95": batch.percentile(stats.latencies, 95),
+        "p99": batch.percentile(stats.latencies, 99),
+        "max": max(stats.latencies, default=0.0),
+    }
+
+def print_summary(report):
+    load = f"rate {report['rate']}/s" if report["rate"] else f"concurrency {report['concurrency']}"
+    print(f"POST /{report['endpoint']}, {load}, {report['elapsed']:.1f}s")
+    print(f"Requests: {report['requests']}  statuses: {report['statuses']}  connection errors: {report['connection_errors']}")
+    print(f"Sustained throughput: {report['sustained_rps']:.2f} receipts/sec")
+    print(f"Latency p50: {report['p50'] * 1000:.0f} ms  p95: {report['p95'] * 1000:.0f} ms  "
+          f"p99: {report['p99'] * 1000:.0f} ms  max: {report['max'] * 1000:.0f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the HTTP extraction service.")
+    parser.add_argument("inputs", nargs="*", default=["test-images"], help="images, directories or glob patterns")
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="service base URL")
+    parser.add_argument("--endpoint", choices=("extract", "jobs"), default="extract",
+                        help="synchronous /extract or submit and poll /jobs")
+    parser.add_argument("--concurrency", type=int, default=8, help="closed-loop clients")
+    parser.add_argument("--rate", type=float, default=None, help="open-loop request rate per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to generate load")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="seconds between job polls")
+    parser.add_argument("--unique", action="store_true", help="make every request a result cache miss")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    bodies = []
+    for image_path in batch.collect_images(args.inputs):
+        with open(image_path, "rb") as f:
+            bodies.append(f.read())
+    if not bodies:
+        parser.error("no images found")
+
+    report = asyncio.run(run_load(args.url, bodies, args.endpoint, args.concurrency, args.rate,
+                                  args.duration, args.poll_interval, args.unique))
+    print_summary(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
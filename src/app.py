@@ -1,11 +1,21 @@
 import streamlit as st
-import google.generativeai as genai
-import PIL.Image
+import hashlib
 import json
-import time
 import os
+import queue
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 from dotenv import load_dotenv
+import backends
+import classifier
+import duplicate_index
+import memory_budget
+import metrics
+import pipeline
+import preprocess_pool
+import result_cache
+import results_store
+import throttle
 import utils
 
 # Load environment variables
@@ -139,88 +149,200 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-def initialize_gemini():
-    """Initialize Gemini API client"""
+# Stages every analyzed receipt goes through, used to drive the progress bar
+PROGRESS_STAGES = ("decode", "preprocess", "encode", "extract_call", "parse")
+
+@st.cache_resource
+def get_backend():
+    """Model backend shared by all sessions and reruns, throttled and retried (MODEL_* settings)"""
+    return throttle.create_throttled_backend(backends.create_backend())
+
+@st.cache_resource
+def get_result_cache():
+    """Result cache shared by all sessions (RESULT_CACHE_PATH), None when disabled"""
+    return result_cache.create_cache()
+
+def initialize_backend():
+    """Initialize the model backend selected by MODEL_BACKEND (Gemini by default)"""
     try:
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
+        if os.getenv("MODEL_BACKEND", "gemini") == "gemini" and not os.getenv("GEMINI_API_KEY"):
             st.error("🔑 GEMINI_API_KEY not found in environment variables!")
             st.stop()
         
-        genai.configure(api_key=api_key)
-        return genai.GenerativeModel('gemini-2.5-flash')
+        return get_backend()
     except Exception as e:
-        st.error(f"❌ Failed to initialize Gemini: {str(e)}")
+        st.error(f"❌ Failed to initialize model backend: {str(e)}")
         st.stop()
 
-def analyze_receipt(uploaded_file, model):
+@st.cache_resource
+def get_preprocess_executor():
+    """Process pool shared by all sessions (PREPROCESS_WORKERS > 0), None to preprocess inline"""
+    return preprocess_pool.create_executor()
+
+@st.cache_resource
+def get_classifier():
+    """Local receipt-type classifier (CLASSIFIER_MODEL), None to always ask the model"""
+    return classifier.create_classifier()
+
+@st.cache_resource
+def get_results_store():
+    """Results store shared by all sessions (RESULTS_STORE_PATH), None when disabled"""
+    return results_store.create_store()
+
+@st.cache_resource
+def get_duplicate_index():
+    """Near-duplicate index shared by all sessions (DUPLICATE_INDEX_PATH), None when disabled"""
+    return duplicate_index.create_index(get_backend().model_name)
+
+@st.cache_resource
+def get_memory_budget():
+    """Decoded image memory shared by all sessions (IMAGE_MEMORY_BUDGET), None when unlimited"""
+    return memory_budget.create_budget()
+
+def create_live_renderer(container):
+    """Render streamed fields and items in the container while the response arrives"""
+    labels = {
+        "type": "Receipt Type",
+        "business_name": "Business Name",
+        "date": "Date",
+        "total_amount": "Total Amount",
+        "vat_percentage": "VAT Percentage",
+        "license_plate": "License Plate",
+    }
+    
+    with container:
+        st.markdown("### 📡 Live Results")
+        fields_placeholder = st.empty()
+        items_header = st.empty()
+        items_container = st.container()
+    
+    fields = {}
+    
+    def on_event(event):
+        kind, key, value = event
+        if kind == "field":
+            fields[key] = value
+            fields_placeholder.markdown("\n\n".join(
+                f"**{labels.get(name, name)}:** {field_value}" for name, field_value in fields.items()
+            ))
+        else:
+            if key == 0:
+                items_header.markdown("#### 🛍️ Purchased Items")
+            with items_container:
+                st.markdown(f"{key + 1}. {value.get('name', 'N/A')} — 💰 {value.get('price', 'N/A')} TL")
+    
+    return on_event
+
+def file_digest(uploaded_file):
+    """SHA-256 of the uploaded file content, used to memoize results across reruns"""
+    return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
+@st.cache_data(max_entries=64)
+def get_preview(digest, _uploaded_file, max_side):
+    """Small JPEG of an upload for display, decoded once per file instead of at full resolution on every rerun"""
+    return utils.preview_image(_uploaded_file.getvalue(), max_side)
+
+def analyze_receipts(files, backend, mode, cache, progress_bar, status_text, live_container=None):
     """
-    Analyze uploaded receipt image using the existing workflow
+    Analyze uploaded receipt images concurrently (APP_WORKERS threads) using the shared pipeline.
+    The progress bar advances with the completed pipeline stages of every receipt. With a live
+    container the extraction of a single receipt is streamed and rendered as it arrives.
+    
+    Worker threads cannot draw Streamlit elements, so stage and streaming events are passed to
+    the script thread through a queue.
+    
+    Returns:
+        dict: file digest -> pipeline result
     """
-    try:
-        # Process start time
-        process_start_time = time.time()
-        
-        # Create temporary file from uploaded image
-        temp_path = f"temp_{uploaded_file.name}"
-        
-        # Save uploaded file temporarily
-        with open(temp_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        
-        # Preprocess image using existing utils function
-        with st.spinner("🔧 Preprocessing image..."):
-            processed_img = utils.preprocess_image(temp_path)
-        
-        # Detect receipt type
-        with st.spinner("🏷️ Detecting receipt type..."):
-            type_contents = [processed_img, utils.TYPE_DETERMINATION_PROMPT]
-            type_response = model.generate_content(type_contents)
-            receipt_type = type_response.text.strip().upper()
-        
-        # Extract information based on detected type
-        with st.spinner(f"🧠 Extracting {receipt_type.lower()} receipt information..."):
-            contents = [
-                processed_img,
-                f"""Extract the receipt information based on the determined type ({receipt_type}) 
-                and return ONLY a valid JSON object with the following structure:
-                {utils.PROMPTS[receipt_type]}
-                Return ONLY the JSON object with no additional text or formatting.""",
-            ]
-            
-            response = model.generate_content(contents)
-            
-            if not response.text:
-                raise ValueError("Empty API response!")
+    executor = get_preprocess_executor()
+    preprocess = executor.preprocess if executor is not None else utils.preprocess_image
+    type_classifier = get_classifier()
+    duplicates = get_duplicate_index()
+    store = get_results_store()
+    memory = get_memory_budget()
+    render_event = create_live_renderer(live_container) if live_container is not None else None
+    updates = queue.Queue()
+    
+    def analyze(digest, uploaded_file):
+        on_event = (lambda event: updates.put(("event", digest, event))) if render_event else None
+        result = pipeline.process_receipt(
+            uploaded_file.getvalue(), backend, mode, cache, preprocess=preprocess, on_event=on_event,
+            classifier=type_classifier, on_stage=lambda name: updates.put(("stage", digest, name)),
+            duplicate_index=duplicates, memory=memory
+        )
+        if result["success"] and store is not None:
+            store.add(result["data"], source=uploaded_file.name, image_digest=result["image_digest"],
+                      model_name=backend.model_name)
+        return result
+    
+    completed_stages = {digest: 0 for digest in files}
+    current_stage = {}
+    results = {}
+    
+    def drain_updates():
+        while True:
+            try:
+                kind, digest, value = updates.get_nowait()
+            except queue.Empty:
+                return
+            if kind == "event":
+                render_event(value)
+            else:
+                current_stage[digest] = value
+                if value in PROGRESS_STAGES:
+                    completed_stages[digest] += 1
+    
+    workers = max(1, min(len(files), int(os.getenv("APP_WORKERS", "4"))))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(analyze, digest, uploaded_file): digest for digest, uploaded_file in files.items()}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.1)
+            drain_updates()
+            for future in done:
+                digest = futures[future]
+                results[digest] = future.result()
             
-            # Clean and parse JSON response
-            json_string = response.text
-            cleaned_json = utils.clean_json_string(json_string)
-            receipt_data = json.loads(cleaned_json)
-        
-        # Calculate processing time
-        process_end_time = time.time()
-        process_duration = process_end_time - process_start_time
-        
-        # Clean up temporary file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        
-        return {
-            "success": True,
-            "data": receipt_data,
-            "processing_time": process_duration,
-            "processed_image": processed_img
-        }
+            progress = sum(
+                1.0 if digest in results else min(completed_stages[digest] / len(PROGRESS_STAGES), 0.95)
+                for digest in files
+            ) / len(files)
+            progress_bar.progress(progress)
+            running = [f"{files[d].name}: {current_stage[d]}" for d in files if d not in results and d in current_stage]
+            status_text.text(f"🧠 {len(results)}/{len(files)} analyzed" + (f" — {', '.join(running[:3])}" if running else ""))
+    
+    status_text.text("✅ Analysis complete!")
+    
+    # Export the stage histograms for Prometheus (textfile collector) when configured
+    if os.getenv("METRICS_FILE"):
+        metrics.REGISTRY.write_prometheus(os.getenv("METRICS_FILE"))
+    
+    return results
+
+def display_result_status(result, file_name, key):
+    """Show the success or error message of one analysis and its JSON download button"""
+    if result["success"]:
+        st.markdown("""
+        <div class="success-message">
+            ✅ <strong>Analysis Successful!</strong> Receipt information extracted successfully.
+        </div>
+        """, unsafe_allow_html=True)
         
-    except json.JSONDecodeError as e:
-        return {"success": False, "error": f"JSON parsing error: {str(e)}"}
-    except Exception as e:
-        return {"success": False, "error": f"Analysis error: {str(e)}"}
-    finally:
-        # Ensure cleanup
-        if 'temp_path' in locals() and os.path.exists(temp_path):
-            os.remove(temp_path)
+        # Download results as JSON
+        json_string = json.dumps(result["data"], indent=2, ensure_ascii=False)
+        st.download_button(
+            label="📥 Download Results (JSON)",
+            data=json_string,
+            file_name=f"receipt_analysis_{os.path.splitext(file_name)[0]}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+            mime="application/json",
+            key=f"download_{key}"
+        )
+    else:
+        st.markdown(f"""
+        <div class="error-message">
+            ❌ <strong>Analysis Failed:</strong> {result.get('error', 'Unknown error')}
+        </div>
+        """, unsafe_allow_html=True)
 
 def display_receipt_results(result_data, container):
     """Display analysis results in the specified container"""
@@ -236,9 +358,46 @@ def display_receipt_results(result_data, container):
         st.metric(
             label="⚡ Processing Time",
             value=f"{processing_time:.2f}s",
-            delta=f"{'Fast' if processing_time < 3 else 'Normal'}"
+            delta=("Cached" if result_data.get("cached") else "Duplicate" if result_data.get("duplicate")
+                   else "Fast" if processing_time < 3 else "Normal")
         )
         
+        # Upload size metric
+        if result_data.get("payload_bytes"):
+            st.metric(
+                label="📦 Upload Size",
+                value=f"{result_data['payload_bytes'] / 1024:.1f} KB",
+                delta=f"{result_data['payload_bytes'] / result_data['input_bytes'] - 1:.0%} vs original",
+                delta_color="inverse"
+            )
+        
+        # Local classifier decision
+        classification = result_data.get("classification")
+        if classification:
+            source = "local classifier" if classification["accepted"] else "model"
+            st.caption(f"🔎 Local classifier: {classification['type']} "
+                       f"({classification['confidence']:.0%} confidence), type from {source}")
+        
+        # Result reused from an earlier photo of the same receipt
+        duplicate = result_data.get("duplicate")
+        if duplicate:
+            st.caption(f"♻️ Reused the result of a near-duplicate receipt (#{duplicate['id']}, "
+                       f"{duplicate['distance']} of 64 hash bits differ)")
+
+        # Long receipt read from overlapping bands
+        tiled = result_data.get("tiling")
+        if tiled:
+            reconciliation = tiled["reconciliation"]
+            if reconciliation["total_source"] == "items":
+                check = "total taken from the items"
+            elif reconciliation["consistent"]:
+                check = "items add up to the total"
+            elif reconciliation["consistent"] is None:
+                check = "no total to check"
+            else:
+                check = f"items differ from the total by {reconciliation['difference']:.2f} TL"
+            st.caption(f"🧩 Read in {tiled['bands']} bands, {tiled['duplicates']} repeated items merged, {check}")
+
         # Combined receipt information card
         receipt_info_content = f"""
         <div class="receipt-info">
@@ -260,6 +419,16 @@ def display_receipt_results(result_data, container):
         
         st.markdown(receipt_info_content, unsafe_allow_html=True)
         
+        # Per-stage timing breakdown
+        stages = result_data.get("stages", {})
+        if stages:
+            with st.expander("⏱️ Stage Breakdown", expanded=False):
+                for name in metrics.STAGES:
+                    if name in stages:
+                        share = stages[name] / processing_time if processing_time else 0
+                        st.markdown(f"**{name}** — {stages[name] * 1000:.1f} ms ({share:.0%})")
+                        st.progress(min(share, 1.0))
+        
         # Market items section
         if receipt_type == "MARKET" and 'items' in data:
             st.markdown("#### 🛍️ Purchased Items")
@@ -286,13 +455,42 @@ def main():
     </div>
     """, unsafe_allow_html=True)
     
-    # Initialize Gemini
-    model = initialize_gemini()
+    # Model backend and result cache are created once and shared across reruns
+    backend = initialize_backend()
+    cache = get_result_cache()
     
     # Sidebar
     with st.sidebar:
         st.markdown("### 🔧 Settings")
         
+        extraction_modes = {
+            "⚡ One-shot (single request)": utils.EXTRACTION_MODE_ONE_SHOT,
+            "🏷️ Two-step (type detection + extraction)": utils.EXTRACTION_MODE_TWO_STEP,
+        }
+        default_mode = os.getenv("EXTRACTION_MODE", utils.EXTRACTION_MODE_ONE_SHOT)
+        if default_mode not in utils.EXTRACTION_MODES:
+            default_mode = utils.EXTRACTION_MODE_ONE_SHOT
+        selected_mode_label = st.radio(
+            "Extraction Mode",
+            list(extraction_modes),
+            index=list(extraction_modes.values()).index(default_mode),
+            help="One-shot detects the type and extracts the fields in a single API call"
+        )
+        extraction_mode = extraction_modes[selected_mode_label]
+        
+        stream_results = st.toggle(
+            "📡 Stream results",
+            value=True,
+            help="Show fields and items while the model response is still arriving"
+        )
+
+        if isinstance(backend, throttle.ThrottledBackend):
+            model = backend.stats()
+            st.caption(f"🚦 Model calls: {model['in_flight']} in flight of {model['limit']:.0f}, "
+                       f"{model['retries']} retried, circuit {model['circuit'].replace('_', '-')}")
+
+        st.markdown("---")
+        
         st.markdown("""
         **Supported Receipt Types:**
         - 🏪 Market/Grocery receipts  
@@ -313,7 +511,7 @@ def main():
         st.markdown("### 🎯 How it Works")
         
         st.markdown("""
-        1. **📤 Upload** your receipt image
+        1. **📤 Upload** one or more receipt images
         2. **🔧 Preprocessing** enhances image quality  
         3. **🏷️ Type Detection** identifies receipt category
         4. **🧠 AI Analysis** extracts structured information
@@ -323,64 +521,84 @@ def main():
     # Main content area
     col1, col2 = st.columns([1, 1])
     
+    # Results memoized per (file content, extraction mode) of the current uploads, so reruns never redo an analysis
+    results = st.session_state.setdefault("results", {})
+    
     with col1:
-        st.markdown("### 📤 Upload Receipt Image")
+        st.markdown("### 📤 Upload Receipt Images")
         
-        uploaded_file = st.file_uploader(
-            "Choose a receipt image",
+        uploaded_files = st.file_uploader(
+            "Choose receipt images",
             type=['png', 'jpg', 'jpeg'],
-            help="Upload a clear image of your receipt for analysis"
+            accept_multiple_files=True,
+            help="Upload clear images of your receipts for analysis"
         )
         
-        if uploaded_file is not None:
+        # Identical uploads are analyzed once
+        files = {file_digest(uploaded_file): uploaded_file for uploaded_file in uploaded_files or []}
+        # Forget the results of removed uploads, a long session would otherwise keep every receipt it saw
+        for key in [key for key in results if key[0] not in files]:
+            del results[key]
+        pending = {digest: uploaded_file for digest, uploaded_file in files.items()
+                   if (digest, extraction_mode) not in results}
+        
+        if len(files) == 1:
             # Display uploaded image
-            image = PIL.Image.open(uploaded_file)
-            st.image(image, caption="Uploaded Receipt", use_container_width=True)
-            
-            # Analysis button
-            if st.button("🚀 Analyze Receipt", key="analyze_btn"):
-                with st.container():
-                    # Analysis progress
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    
-                    # Update progress
-                    for i in range(100):
-                        progress_bar.progress(i + 1)
-                        time.sleep(0.01)
-                    
-                    status_text.text("✅ Analysis complete!")
-                    
-                    # Perform analysis
-                    result = analyze_receipt(uploaded_file, model)
-                    
-                    if result["success"]:
-                        st.markdown("""
-                        <div class="success-message">
-                            ✅ <strong>Analysis Successful!</strong> Receipt information extracted successfully.
-                        </div>
-                        """, unsafe_allow_html=True)
-                        
-                        # Display results in the right column
-                        display_receipt_results(result, col2)
-                        
-                        # Download results as JSON
-                        json_string = json.dumps(result["data"], indent=2, ensure_ascii=False)
-                        st.download_button(
-                            label="📥 Download Results (JSON)",
-                            data=json_string,
-                            file_name=f"receipt_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-                            mime="application/json"
-                        )
-                        
-                    else:
-                        st.markdown(f"""
-                        <div class="error-message">
-                            ❌ <strong>Analysis Failed:</strong> {result.get('error', 'Unknown error')}
-                        </div>
-                        """, unsafe_allow_html=True)
+            digest, uploaded_file = next(iter(files.items()))
+            st.image(get_preview(digest, uploaded_file, 1200), caption="Uploaded Receipt", use_container_width=True)
+        elif files:
+            with st.expander(f"🖼️ Uploaded Receipts ({len(files)})", expanded=False):
+                st.image([get_preview(digest, f, 320) for digest, f in files.items()],
+                         caption=[f.name for f in files.values()], width=160)
+        
+        # Analysis button
+        if pending:
+            label = "🚀 Analyze Receipt" if len(pending) == 1 else f"🚀 Analyze {len(pending)} Receipts"
+            if st.button(label, key="analyze_btn"):
+                # Analysis progress
+                progress_bar = st.progress(0.0)
+                status_text = st.empty()
+                
+                live_placeholder = col2.empty()
+                live_container = live_placeholder.container() if stream_results and len(pending) == 1 else None
+                new_results = analyze_receipts(pending, backend, extraction_mode, cache,
+                                               progress_bar, status_text, live_container)
+                live_placeholder.empty()
+                
+                for digest, result in new_results.items():
+                    results[(digest, extraction_mode)] = result
+        
+        analyzed = [(digest, uploaded_file, results[(digest, extraction_mode)])
+                    for digest, uploaded_file in files.items() if (digest, extraction_mode) in results]
+        
+        if len(analyzed) == 1:
+            digest, uploaded_file, result = analyzed[0]
+            display_result_status(result, uploaded_file.name, digest)
+        elif analyzed:
+            succeeded = {uploaded_file.name: result["data"] for _, uploaded_file, result in analyzed if result["success"]}
+            st.markdown(f"**{len(succeeded)}/{len(analyzed)}** receipts extracted successfully.")
+            if succeeded:
+                st.download_button(
+                    label="📥 Download All Results (JSON)",
+                    data=json.dumps(succeeded, indent=2, ensure_ascii=False),
+                    file_name=f"receipt_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                    mime="application/json",
+                    key="download_all"
+                )
     
-    # Col2 is now used for displaying results when analysis is performed
+    # Results are displayed in the right column, one tab per receipt when several were analyzed
+    if len(analyzed) == 1:
+        result = analyzed[0][2]
+        if result["success"]:
+            display_receipt_results(result, col2)
+    elif analyzed:
+        with col2:
+            tabs = st.tabs([uploaded_file.name for _, uploaded_file, _ in analyzed])
+        for tab, (digest, uploaded_file, result) in zip(tabs, analyzed):
+            with tab:
+                display_result_status(result, uploaded_file.name, digest)
+            if result["success"]:
+                display_receipt_results(result, tab)
 
 if __name__ == "__main__":
     main()
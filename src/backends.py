@@ -0,0 +1,446 @@
+import hashlib
+import collections
+import json
+import os
+import random
+import re
+import threading
+import time
+import utils
+
+###################################################################
+# Backend Interface
+###################################################################
+
+DEFAULT_GEMINI_MODEL = "gemini-2.5-flash"
+
+class BackendError(Exception):
+    """
+    Error raised by a model backend.
+
+    Args:
+        message (str): error description
+        status_code (int): HTTP-like status code (429 for rate limits, 5xx for server errors)
+    """
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def retryable(self):
+        return self.status_code == 429 or self.status_code >= 500
+
+class ModelBackend:
+    """
+    Base class of the model backends used by the extraction pipeline.
+
+    A backend receives the same contents list that is sent to Gemini
+    (images and prompt strings) and returns the response text.
+    """
+
+    name = "base"
+    model_name = None
+
+    def generate(self, contents):
+        """
+        Generate a response for the given contents.
+
+        Args:
+            contents (list): images and prompt strings
+
+        Returns:
+            str: response text
+        """
+        raise NotImplementedError
+
+    def generate_stream(self, contents):
+        """
+        Generate a response and yield its text as it arrives. Backends
+        without native streaming yield the whole response at once.
+
+        Args:
+            contents (list): images and prompt strings
+
+        Yields:
+            str: response text chunks
+        """
+        yield self.generate(contents)
+
+###################################################################
+# Gemini Backend
+###################################################################
+
+class GeminiBackend(ModelBackend):
+    """
+    Backend calling the Google Gemini API.
+
+    Args:
+        api_key (str): Gemini API key
+        model_name (str): Gemini model name
+    """
+
+    name = "gemini"
+
+    def __init__(self, api_key, model_name=DEFAULT_GEMINI_MODEL):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, contents):
+        from google.api_core import exceptions as api_exceptions
+
+        try:
+            response = self.model.generate_content(contents)
+        except api_exceptions.GoogleAPICallError as e:
+            raise BackendError(str(e), status_code=e.code or 500) from e
+
+        return response_text(response)
+
+    def generate_stream(self, contents):
+        from google.api_core import exceptions as api_exceptions
+
+        try:
+            for chunk in self.model.generate_content(contents, stream=True):
+                # The closing chunk may carry only the finish reason and no text part
+                # (a chunk without candidates is a blocked prompt, reported by response_text())
+                if not chunk.candidates or chunk.parts:
+                    yield response_text(chunk)
+        except api_exceptions.GoogleAPICallError as e:
+            raise BackendError(str(e), status_code=e.code or 500) from e
+
+def response_text(response):
+    """
+    Text of a Gemini response. A blocked prompt or answer has no text
+    (response.text raises ValueError) and is reported as a client error,
+    so it is neither retried nor counted as a server failure.
+    """
+    try:
+        return response.text
+    except ValueError as e:
+        raise BackendError(f"Response blocked or empty: {e}", status_code=422) from e
+
+###################################################################
+# Fake Backend
+###################################################################
+
+FAKE_ERRORS = {
+    "rate_limit": (429, "Resource has been exhausted (fake)"),
+    "server": (500, "Internal server error (fake)"),
+    "unavailable": (503, "Service unavailable (fake)"),
+}
+
+class FakeBackend(ModelBackend):
+    """
+    Offline backend returning recorded or synthetic responses.
+
+    Recorded responses are looked up by the digest of the image and the prompt
+    (see RecordingBackend). Requests without a recording get a deterministic
+    synthetic receipt that follows the schema asked for in the prompt.
+
+    Args:
+        recordings_path (str): JSONL file written by RecordingBackend
+        latency (float): median latency of a call in seconds
+        latency_sigma (float): shape of the lognormal latency distribution, 0 for a fixed latency
+        image_latency (float): extra latency per image in the request, in seconds
+        stream_chunk_size (int): characters per chunk yielded by generate_stream()
+        error_rate (float): probability of a call failing
+        error_kinds (dict): relative weights of the FAKE_ERRORS kinds
+        seed (int): random seed for reproducible runs
+        max_concurrency (int): calls arriving while this many are running fail with a 429, 0 for no limit
+        rpm (float): calls per minute accepted (checked over the last second, rpm / 60 calls), 0 for no limit
+    """
+
+    name = "fake"
+    model_name = "fake"
+
+    def __init__(self, recordings_path=None, latency=0.0, latency_sigma=0.0, image_latency=0.0,
+                 stream_chunk_size=32, error_rate=0.0, error_kinds=None, seed=None, max_concurrency=0, rpm=0):
+        self.recordings = load_recordings(recordings_path) if recordings_path else {}
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.image_latency = image_latency
+        self.stream_chunk_size = stream_chunk_size
+        self.error_rate = error_rate
+        self.error_kinds = error_kinds or {"rate_limit": 1.0}
+        self.random = random.Random(seed)
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.recent = collections.deque()
+
+    def generate(self, contents):
+        delay, text = self._respond(contents)
+        try:
+            if delay > 0:
+                time.sleep(delay)
+            return text
+        finally:
+            self._finish()
+
+    def generate_stream(self, contents):
+        delay, text = self._respond(contents)
+        chunks = [text[i:i + self.stream_chunk_size] for i in range(0, len(text), self.stream_chunk_size)]
+
+        # Spread the sampled latency over the chunks like a token stream
+        try:
+            for chunk in chunks:
+                if delay > 0:
+                    time.sleep(delay / len(chunks))
+                yield chunk
+        finally:
+            self._finish()
+
+    def _respond(self, contents):
+        with self.lock:
+            self.calls += 1
+            self._admit()
+            self.in_flight += 1
+            delay = self._sample_latency() + self.image_latency * sum(not isinstance(part, str) for part in contents)
+            error = self._sample_error()
+            rng = random.Random(self.random.random())
+
+        if error:
+            try:
+                if delay > 0:
+                    time.sleep(delay)
+            finally:
+                self._finish()
+            status_code, message = FAKE_ERRORS[error]
+            raise BackendError(message, status_code=status_code)
+
+        key = recording_key(contents)
+        if key in self.recordings:
+            return delay, self.recordings[key]
+
+        return delay, synthetic_response(prompt_of(contents), rng)
+
+    def _admit(self):
+        # Server-side quotas: reject overload immediately like a rate-limited API
+        now = time.monotonic()
+        while self.recent and now - self.recent[0] >= 1.0:
+            self.recent.popleft()
+        if (self.max_concurrency > 0 and self.in_flight >= self.max_concurrency) or \
+                (self.rpm > 0 and len(self.recent) >= max(self.rpm / 60, 1)):
+            self.rejected += 1
+            status_code, message = FAKE_ERRORS["rate_limit"]
+            raise BackendError(message, status_code=status_code)
+        self.recent.append(now)
+
+    def _finish(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def _sample_latency(self):
+        if self.latency <= 0:
+            return 0.0
+        if self.latency_sigma <= 0:
+            return self.latency
+        return self.random.lognormvariate(0.0, self.latency_sigma) * self.latency
+
+    def _sample_error(self):
+        if self.error_rate <= 0 or self.random.random() >= self.error_rate:
+            return None
+        kinds = list(self.error_kinds)
+        weights = [self.error_kinds[kind] for kind in kinds]
+        return self.random.choices(kinds, weights=weights)[0]
+
+class RecordingBackend(ModelBackend):
+    """
+    Wrapper that appends every response of another backend to a JSONL file
+    so it can be replayed offline with FakeBackend.
+
+    Args:
+        backend (ModelBackend): backend to record
+        recordings_path (str): JSONL output file
+    """
+
+    name = "recording"
+
+    def __init__(self, backend, recordings_path):
+        self.backend = backend
+        self.model_name = backend.model_name
+        self.recordings_path = recordings_path
+        self.lock = threading.Lock()
+
+    def generate(self, contents):
+        text = self.backend.generate(contents)
+        self._record(contents, text)
+        return text
+
+    def generate_stream(self, contents):
+        chunks = []
+        for chunk in self.backend.generate_stream(contents):
+            chunks.append(chunk)
+            yield chunk
+        self._record(contents, "".join(chunks))
+
+    def _record(self, contents, text):
+        record = {"key": recording_key(contents), "text": text}
+        with self.lock:
+            with open(self.recordings_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+###################################################################
+# Helper Functions
+###################################################################
+
+def prompt_of(contents):
+    """
+    Return the prompt string of a contents list.
+    """
+    return "\n".join(part for part in contents if isinstance(part, str))
+
+def recording_key(contents):
+    """
+    Digest of the images and prompts of a contents list, used to match
+    recorded responses.
+
+    Args:
+        contents (list): images and prompt strings
+
+    Returns:
+        str: hex digest
+    """
+    digest = hashlib.sha256()
+    for part in contents:
+        if isinstance(part, str):
+            digest.update(part.encode("utf-8"))
+        elif isinstance(part, (bytes, bytearray, memoryview)):
+            digest.update(part)
+        elif isinstance(part, dict) and "data" in part:
+            digest.update(part["data"])
+        elif hasattr(part, "tobytes"):
+            digest.update(part.tobytes())
+    return digest.hexdigest()
+
+def load_recordings(recordings_path):
+    """
+    Load a JSONL recordings file into a key -> response text dict.
+    """
+    recordings = {}
+    with open(recordings_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                recordings[record["key"]] = record["text"]
+    return recordings
+
+def synthetic_receipt(receipt_type, rng):
+    """
+    Build a synthetic receipt following the schema of the given type.
+
+    Args:
+        receipt_type (str): one of the keys of utils.PROMPTS
+        rng (random.Random): random generator
+
+    Returns:
+        dict: synthetic receipt data
+    """
+    receipt = {
+        "type": receipt_type,
+        "business_name": f"SYNTHETIC {receipt_type} {rng.randint(1, 999)}",
+        "date": f"{rng.randint(1, 28):02d}.{rng.randint(1, 12):02d}.2025",
+    }
+    if receipt_type == "FUEL":
+        receipt["license_plate"] = f"34 ABC {rng.randint(100, 999)}"
+
+    if receipt_type == "MARKET":
+        prices = [rng.randint(100, 50000) / 100 for _ in range(rng.randint(1, 30))]
+        receipt["items"] = [
+            {"name": f"ITEM {i}", "price": f"{price:.2f}".replace(".", ",")}
+            for i, price in enumerate(prices, 1)
+        ]
+        total = sum(prices)
+    else:
+        total = rng.randint(1000, 500000) / 100
+
+    receipt["total_amount"] = f"{total:.2f}".replace(".", ",")
+    if receipt_type != "MARKET":
+        receipt["vat_percentage"] = rng.choice(["%1", "%10", "%20"])
+    return receipt
+
+def synthetic_response(prompt, rng):
+    """
+    Build a synthetic response text for one of the prompts in utils.
+
+    Args:
+        prompt (str): prompt sent to the backend
+        rng (random.Random): random generator
+
+    Returns:
+        str: response text as the model would return it
+    """
+    receipt_types = list(utils.PROMPTS)
+
+    if prompt == utils.TYPE_DETERMINATION_PROMPT:
+        return rng.choice(receipt_types)
+
+    batch = re.search(r"You are given (\d+) receipt images", prompt)
+    if batch:
+        receipts = []
+        for index in range(int(batch.group(1))):
+            receipt = synthetic_receipt(rng.choice(receipt_types), rng)
+            receipts.append({"index": index, **receipt})
+        return f"```json\n{json.dumps(receipts, ensure_ascii=False, indent=2)}\n```"
+
+    if re.search(r"The image is part \d+ of \d+ of a long grocery receipt", prompt):
+        items = synthetic_receipt("MARKET", rng)["items"]
+        return f"```json\n{json.dumps({'items': items}, ensure_ascii=False, indent=2)}\n```"
+
+    receipt_type = next((t for t in receipt_types if f"({t})" in prompt), None)
+    if receipt_type is None:
+        receipt_type = rng.choice(receipt_types)
+
+    receipt = synthetic_receipt(receipt_type, rng)
+    if "Do not list the purchased items" in prompt:
+        receipt.pop("items", None)
+    return f"```json\n{json.dumps(receipt, ensure_ascii=False, indent=2)}\n```"
+
+###################################################################
+# Backend Factory
+###################################################################
+
+def create_backend(name=None):
+    """
+    Create the model backend selected by the environment.
+
+    Environment variables:
+        MODEL_BACKEND: "gemini" (default) or "fake"
+        GEMINI_API_KEY, GEMINI_MODEL: Gemini settings
+        FAKE_RECORDINGS, FAKE_LATENCY, FAKE_LATENCY_SIGMA, FAKE_IMAGE_LATENCY, FAKE_ERROR_RATE,
+        FAKE_SEED, FAKE_MAX_CONCURRENCY, FAKE_RPM: fake backend settings
+
+    Args:
+        name (str): backend name, overrides MODEL_BACKEND
+
+    Returns:
+        ModelBackend: backend instance
+    """
+    name = name or os.getenv("MODEL_BACKEND", "gemini")
+
+    if name == "gemini":
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY not found in environment variables!")
+        return GeminiBackend(api_key, os.getenv("GEMINI_MODEL", DEFAULT_GEMINI_MODEL))
+
+    if name == "fake":
+        seed = os.getenv("FAKE_SEED")
+        return FakeBackend(
+            recordings_path=os.getenv("FAKE_RECORDINGS") or None,
+            latency=float(os.getenv("FAKE_LATENCY", "0")),
+            latency_sigma=float(os.getenv("FAKE_LATENCY_SIGMA", "0")),
+            image_latency=float(os.getenv("FAKE_IMAGE_LATENCY", "0")),
+            error_rate=float(os.getenv("FAKE_ERROR_RATE", "0")),
+            seed=int(seed) if seed else None,
+            max_concurrency=int(os.getenv("FAKE_MAX_CONCURRENCY", "0")),
+            rpm=float(os.getenv("FAKE_RPM", "0")),
+        )
+
+    raise ValueError(f"Unknown model backend: {name}")
@@ -0,0 +1,308 @@
+import csv
+import glob
+import json
+import math
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import metrics
+import pipeline
+import utils
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+CSV_FIELDS = [
+    "file", "success", "type", "business_name", "date", "license_plate",
+    "total_amount", "vat_percentage", "items", "error", "processing_time", "cached",
+    "input_bytes", "payload_bytes",
+]
+
+###################################################################
+# Input Collection
+###################################################################
+
+def collect_images(inputs):
+    """
+    Expand files, directories and glob patterns into a sorted list of image paths.
+
+    Args:
+        inputs (list): file paths, directories or glob patterns
+
+    Returns:
+        list: unique image paths
+    """
+    paths = set()
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for root, _, files in os.walk(entry):
+                paths.update(os.path.join(root, name) for name in files)
+        elif os.path.isfile(entry):
+            paths.add(entry)
+        else:
+            paths.update(p for p in glob.glob(entry, recursive=True) if os.path.isfile(p))
+
+    return sorted(os.path.normpath(p) for p in paths if p.lower().endswith(IMAGE_EXTENSIONS))
+
+###################################################################
+# Output Writers
+###################################################################
+
+class ResultWriter:
+    """
+    Append-only JSONL/CSV writer that flushes every row so finished receipts
+    survive an interrupted run.
+
+    Args:
+        output_path (str): output file
+        output_format (str): "jsonl" or "csv"
+    """
+
+    def __init__(self, output_path, output_format="jsonl"):
+        if output_format not in ("jsonl", "csv"):
+            raise ValueError(f"Unknown output format: {output_format}")
+
+        write_header = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        self.output_format = output_format
+        self.file = open(output_path, "a", encoding="utf-8", newline="")
+        if output_format == "csv":
+            self.csv_writer = csv.DictWriter(self.file, fieldnames=CSV_FIELDS)
+            if write_header:
+                self.csv_writer.writeheader()
+
+    def write(self, image_path, result):
+        data = result.get("data") or {}
+        if self.output_format == "jsonl":
+            row = {
+                "file": image_path,
+                "success": result["success"],
+                "data": data if result["success"] else None,
+                "error": result.get("error"),
+                "processing_time": round(result["processing_time"], 4),
+                "cached": result.get("cached", False),
+                "image_digest": result.get("image_digest"),
+                "input_bytes": result.get("input_bytes"),
+                "payload_bytes": result.get("payload_bytes"),
+                "stages": {name: round(seconds, 6) for name, seconds in result.get("stages", {}).items()},
+            }
+            if "classification" in result:
+                row["classification"] = result["classification"]
+            if "duplicate" in result:
+                row["duplicate"] = result["duplicate"]
+            if "crop" in result:
+                row["crop"] = result["crop"]
+            if "preprocess" in result:
+                row["preprocess"] = result["preprocess"]
+            if "tiling" in result:
+                row["tiling"] = result["tiling"]
+            self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        else:
+            row = {field: data.get(field) for field in CSV_FIELDS if field in data}
+            if "items" in row:
+                row["items"] = json.dumps(row["items"], ensure_ascii=False)
+            row.update({
+                "file": image_path,
+                "success": result["success"],
+                "error": result.get("error"),
+                "processing_time": round(result["processing_time"], 4),
+                "cached": result.get("cached", False),
+                "input_bytes": result.get("input_bytes"),
+                "payload_bytes": result.get("payload_bytes"),
+            })
+            self.csv_writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class Checkpoint:
+    """
+    Append-only list of successfully processed image paths.
+
+    Args:
+        path (str): checkpoint file
+    """
+
+    def __init__(self, path):
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.done = {line.rstrip("\n") for line in f if line.strip()}
+        self.file = open(path, "a", encoding="utf-8")
+
+    def mark(self, image_path):
+        self.done.add(image_path)
+        self.file.write(image_path + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+###################################################################
+# Batch Runner
+###################################################################
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile of a list of numbers.
+
+    Args:
+        values (list): numbers
+        q (float): percentile between 0 and 100
+
+    Returns:
+        float: percentile value, 0.0 for an empty list
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def run_batch(inputs, backend, output_path, output_format="jsonl", workers=4,
+              mode=utils.EXTRACTION_MODE_ONE_SHOT, cache=None, checkpoint_path=None,
+              process=pipeline.process_receipt, on_result=None, store=None, store_chunk=500):
+    """
+    Process many receipts concurrently and stream the results to a file.
+
+    Images already listed in the checkpoint are skipped, so re-running the same
+    command after an interruption only processes the remaining files. Failed
+    receipts are written to the output but not checkpointed and are retried on
+    the next run.
+
+    Args:
+        inputs (list): file paths, directories or glob patterns
+        backend (backends.ModelBackend): model backend
+        output_path (str): JSONL or CSV output file
+        output_format (str): "jsonl" or "csv"
+        workers (int): maximum number of receipts processed at the same time
+        mode (str): one of utils.EXTRACTION_MODES
+        cache (result_cache.ResultCache): optional result cache
+        checkpoint_path (str): checkpoint file, defaults to <output_path>.checkpoint
+        process (callable): function processing a single receipt
+        on_result (callable): called with (image_path, result) after every receipt
+        store (results_store.ResultsStore): optional store receiving the successful receipts
+        store_chunk (int): receipts inserted into the store per transaction; they are
+            checkpointed once stored, so an interrupted run re-processes unstored receipts
+
+    Returns:
+        dict: run statistics
+    """
+    checkpoint = Checkpoint(checkpoint_path or f"{output_path}.checkpoint")
+    all_paths = collect_images(inputs)
+    image_paths = [p for p in all_paths if p not in checkpoint.done]
+    writer = ResultWriter(output_path, output_format)
+
+    latencies = []
+    stage_latencies = {}
+    classifications = []
+    duplicates = 0
+    cropped = 0
+    tiled = 0
+    profiles = {}
+    failures = 0
+    unstored = []
+    stored = 0
+    run_start_time = time.time()
+
+    def store_results():
+        nonlocal stored
+        ids = store.add_many([record for _, record in unstored])
+        stored += sum(receipt_id is not None for receipt_id in ids)
+        for image_path, _ in unstored:
+            checkpoint.mark(image_path)
+        unstored.clear()
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+            paths = iter(image_paths)
+
+            # Keep at most two receipts per worker in flight so huge inputs are not queued at once
+            def submit_next():
+                image_path = next(paths, None)
+                if image_path is not None:
+                    pending[executor.submit(process, image_path, backend, mode, cache)] = image_path
+
+            for _ in range(workers * 2):
+                submit_next()
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    image_path = pending.pop(future)
+                    result = future.result()
+                    writer.write(image_path, result)
+                    latencies.append(result["processing_time"])
+                    for name, seconds in result.get("stages", {}).items():
+                        stage_latencies.setdefault(name, []).append(seconds)
+                    if "classification" in result:
+                        classifications.append(metrics.classification_outcome(result))
+                    duplicates += "duplicate" in result
+                    cropped += result.get("crop", {}).get("cropped", False)
+                    tiled += "tiling" in result
+                    if "preprocess" in result:
+                        profile = result["preprocess"]["profile"]
+                        profiles[profile] = profiles.get(profile, 0) + 1
+                    if result["success"] and store is not None:
+                        unstored.append((image_path, {
+                            "data": result["data"], "source": image_path,
+                            "image_digest": result.get("image_digest"), "model_name": backend.model_name,
+                        }))
+                        if len(unstored) >= store_chunk:
+                            store_results()
+                    elif result["success"]:
+                        checkpoint.mark(image_path)
+                    else:
+                        failures += 1
+                    if on_result is not None:
+                        on_result(image_path, result)
+                    submit_next()
+    finally:
+        if unstored:
+            store_results()
+        writer.close()
+        checkpoint.close()
+
+    elapsed = time.time() - run_start_time
+    return {
+        "processed": len(latencies),
+        "skipped": len(all_paths) - len(image_paths),
+        "failed": failures,
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "stages": {
+            name: {"p50": percentile(values, 50), "p95": percentile(values, 95)}
+            for name, values in stage_latencies.items()
+        },
+        "classifier": classifier_stats(classifications),
+        "duplicates": duplicates,
+        "cropped": cropped,
+        "tiled": tiled,
+        "profiles": profiles,
+        "stored": stored,
+    }
+
+def classifier_stats(outcomes):
+    """
+    Summarize local classifier outcomes (see metrics.classification_outcome).
+
+    The hit rate is the share of receipts whose type came from the local
+    classifier. The agreement is measured on the receipts that still asked the
+    model, where the model's type tells whether the local guess was right.
+
+    Args:
+        outcomes (list): (decision, agreement) tuples
+
+    Returns:
+        dict: "classified", "hit_rate" and "remote_agreement" (None without remote receipts)
+    """
+    local = sum(1 for decision, _ in outcomes if decision == "local")
+    checked = [agreement == "match" for decision, agreement in outcomes
+               if decision == "remote" and agreement != "unknown"]
+    return {
+        "classified": len(outcomes),
+        "hit_rate": local / len(outcomes) if outcomes else 0.0,
+        "remote_agreement": sum(checked) / len(checked) if checked else None,
+    }
@@ -0,0 +1,235 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import utils
+
+logger = logging.getLogger("receipt_extractor.batching")
+
+###################################################################
+# Batching Scheduler
+###################################################################
+
+# Queued to wake the dispatcher when a receipt it waits for will not come
+_WAKE = object()
+
+class BatchRequest:
+    """
+    A receipt waiting to be sent as part of a batch.
+    """
+
+    def __init__(self, img):
+        self.img = img
+        self.future = Future()
+        self.submitted_at = time.perf_counter()
+        self.dispatched_at = None
+
+class BatchingScheduler:
+    """
+    Collects receipts arriving within a short window and extracts them with a
+    single multi-image model request (utils.extract_receipt_batch).
+
+    A batch is sent as soon as it holds max_batch_size receipts, max_wait
+    seconds after its first receipt arrived, or as soon as no other receipt is
+    on its way: callers announce() receipts they may submit (e.g. while they
+    are being preprocessed), and the dispatcher only waits for more while
+    announced receipts are outstanding. Receipts the batch response has no
+    usable object for, and every receipt of a failed or malformed batch, are
+    handed back to their caller, which falls back to the per-receipt request.
+    A receipt that is sent alone is also handed back without a batch request.
+
+    Args:
+        backend (backends.ModelBackend): model backend
+        max_batch_size (int): maximum receipts per request
+        max_wait (float): seconds the first receipt of a batch waits for more
+        max_concurrent_batches (int): batch requests in flight at the same time
+    """
+
+    def __init__(self, backend, max_batch_size=4, max_wait=0.05, max_concurrent_batches=4):
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix="batch")
+        self.lock = threading.Lock()
+        self.counters = {"batches": 0, "batched_receipts": 0, "fallbacks": 0, "failed_batches": 0, "single": 0}
+        self.upcoming = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._dispatch, name="batch-dispatcher", daemon=True)
+        self.thread.start()
+
+    def announce(self):
+        """
+        Tell the scheduler a receipt may be submitted soon, so that batches wait
+        for it. Every announcement ends with submit(announced=True) or withdraw().
+        """
+        with self.lock:
+            self.upcoming += 1
+
+    def withdraw(self):
+        """
+        Withdraw an announced receipt that will not be submitted.
+        """
+        with self.lock:
+            self.upcoming -= 1
+        self.requests.put(_WAKE)
+
+    def submit(self, img, announced=False):
+        """
+        Queue a preprocessed and encoded receipt image.
+
+        Args:
+            img (image): preprocessed image or upload payload
+            announced (bool): the receipt was announced with announce()
+
+        Returns:
+            BatchRequest: request whose future resolves to the receipt data, or None to fall back
+        """
+        if self.closed:
+            raise RuntimeError("Batching scheduler is closed")
+        request = BatchRequest(img)
+        # Queued together with the end of its announcement, the dispatcher sees both or neither
+        with self.lock:
+            if announced:
+                self.upcoming -= 1
+            self.requests.put(request)
+        return request
+
+    def extract(self, img, timer=None, announced=False):
+        """
+        Extract a receipt as part of a batch and wait for it. The time spent
+        waiting for the batch to fill is recorded as the "batch_wait" stage and
+        the rest as "extract_call".
+
+        Args:
+            img (image): preprocessed image or upload payload
+            timer (metrics.StageTimer): optional stage timer
+            announced (bool): the receipt was announced with announce()
+
+        Returns:
+            dict: parsed receipt data, or None when the caller must extract the receipt on its own
+        """
+        request = self.submit(img, announced)
+        receipt_data = request.future.result()
+        if timer is not None:
+            finished_at = time.perf_counter()
+            dispatched_at = request.dispatched_at or finished_at
+            timer.add("batch_wait", dispatched_at - request.submitted_at)
+            if receipt_data is not None:
+                timer.add("extract_call", finished_at - dispatched_at)
+        return receipt_data
+
+    def _dispatch(self):
+        while True:
+            first = self.requests.get()
+            if first is None:
+                return
+            if first is _WAKE:
+                continue
+            batch = [first]
+            deadline = first.submitted_at + self.max_wait
+            stop = False
+            while len(batch) < self.max_batch_size:
+                with self.lock:
+                    if not self.upcoming and self.requests.empty():
+                        # Nothing else is on its way, waiting would only delay this batch
+                        break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if request is _WAKE:
+                    continue
+                if request is None:
+                    stop = True
+                    break
+                batch.append(request)
+
+            dispatched_at = time.perf_counter()
+            for request in batch:
+                request.dispatched_at = dispatched_at
+            self.executor.submit(self._run_batch, batch)
+            if stop:
+                return
+
+    def _run_batch(self, batch):
+        if len(batch) == 1:
+            with self.lock:
+                self.counters["single"] += 1
+            batch[0].future.set_result(None)
+            return
+
+        try:
+            receipts = utils.extract_receipt_batch(self.backend, [request.img for request in batch])
+            failed = False
+        except Exception as e:
+            logger.warning("Batch of %d receipts failed, falling back to single requests: %s", len(batch), e)
+            receipts = [None] * len(batch)
+            failed = True
+
+        with self.lock:
+            self.counters["batches"] += 1
+            self.counters["batched_receipts"] += len(batch)
+            self.counters["fallbacks"] += sum(receipt is None for receipt in receipts)
+            self.counters["failed_batches"] += failed
+
+        for request, receipt_data in zip(batch, receipts):
+            request.future.set_result(receipt_data)
+
+    def stats(self):
+        """
+        Returns:
+            dict: batch counters and the mean batch size
+        """
+        with self.lock:
+            stats = dict(self.counters)
+        stats["mean_batch_size"] = stats["batched_receipts"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+    def close(self):
+        """
+        Send the queued receipts and stop the dispatcher.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.requests.put(None)
+        self.thread.join()
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+###################################################################
+# Scheduler Factory
+###################################################################
+
+def create_scheduler(backend):
+    """
+    Create the batching scheduler configured by the environment.
+
+    Environment variables:
+        BATCH_MAX_SIZE: receipts per model request, 0 or 1 (default) disables batching
+        BATCH_MAX_WAIT: seconds to wait for a batch to fill (default 0.05)
+        BATCH_CONCURRENCY: batch requests in flight at the same time (default 4)
+
+    Returns:
+        BatchingScheduler: scheduler or None when disabled
+    """
+    max_batch_size = int(os.getenv("BATCH_MAX_SIZE", "0"))
+    if max_batch_size <= 1:
+        return None
+    return BatchingScheduler(
+        backend,
+        max_batch_size=max_batch_size,
+        max_wait=float(os.getenv("BATCH_MAX_WAIT", "0.05")),
+        max_concurrent_batches=int(os.getenv("BATCH_CONCURRENCY", "4")),
+    )
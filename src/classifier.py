@@ -0,0 +1,318 @@
+import argparse
+import json
+import os
+import cv2
+import numpy as np
+import batch
+import pipeline
+import utils
+
+###################################################################
+# Layout Features
+###################################################################
+
+FEATURE_NAMES = (
+    "aspect_ratio", "ink_density", "line_count", "line_density",
+    "line_fill", "right_column_ink", "priced_lines",
+)
+
+# Filename prefixes of the labeled sample images
+LABEL_PREFIXES = {
+    "fuel": "FUEL",
+    "market": "MARKET",
+    "meal": "RESTAURANT",
+    "restaurant": "RESTAURANT",
+}
+
+FEATURE_WIDTH = 400
+
+def layout_features(img):
+    """
+    Compute the layout features of a preprocessed (binarized) receipt image.
+
+    Fuel slips are short with few lines, market slips are long with many
+    lines that end in a price on the right, restaurant slips sit in between.
+    The image is downscaled to a fixed width first, so the features do not
+    depend on the resolution and cost a few milliseconds, and measured on the
+    bounding box of the ink so the background around the receipt is ignored.
+
+    Args:
+        img (image): preprocessed PIL image or grayscale ndarray (dark text on white)
+
+    Returns:
+        np.ndarray: float64 vector in the order of FEATURE_NAMES
+    """
+    gray = np.asarray(img)
+    if gray.ndim == 3:
+        gray = cv2.cvtColor(gray, cv2.COLOR_RGB2GRAY)
+    height, width = gray.shape
+    scaled_height = max(1, round(height * FEATURE_WIDTH / width))
+    ink = cv2.resize(gray, (FEATURE_WIDTH, scaled_height), interpolation=cv2.INTER_AREA) < 128
+    ink = ink[_ink_span(ink.sum(axis=1)), :][:, _ink_span(ink.sum(axis=0))]
+    height, width = ink.shape
+
+    # Text lines are runs of rows containing ink
+    row_ink = ink.mean(axis=1)
+    text_rows = row_ink > 0.02
+    edges = np.diff(text_rows.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    keep = ends - starts >= 3
+    starts, ends = starts[keep], ends[keep]
+
+    line_fill = 0.0
+    priced_lines = 0.0
+    if len(starts):
+        line_ink = np.array([ink[start:end].any(axis=0) for start, end in zip(starts, ends)])
+        columns = np.arange(width)
+        first = np.where(line_ink, columns, width).min(axis=1)
+        last = np.where(line_ink, columns, -1).max(axis=1)
+        line_fill = float(np.mean((last - first + 1) / width))
+        # Item lines print a name on the left and a price on the right
+        priced_lines = float(np.mean(line_ink[:, :width * 2 // 5].any(axis=1)
+                                     & line_ink[:, width * 3 // 4:].any(axis=1)))
+
+    total_ink = ink.sum()
+    right_column_ink = float(ink[:, width * 3 // 4:].sum() / total_ink) if total_ink else 0.0
+
+    return np.array([
+        np.log(height / width),
+        ink.mean(),
+        np.log1p(len(starts)),
+        len(starts) / height * 100,
+        line_fill,
+        right_column_ink,
+        priced_lines,
+    ], dtype=np.float64)
+
+def _ink_span(profile, margin=0.01):
+    """
+    Slice of a row or column ink profile holding all but the outer 1% of the ink on each side.
+    """
+    total = profile.sum()
+    if total == 0:
+        return slice(0, len(profile))
+    cumulative = np.cumsum(profile)
+    start = int(np.searchsorted(cumulative, total * margin))
+    end = int(np.searchsorted(cumulative, total * (1 - margin))) + 1
+    return slice(start, max(end, start + 1))
+
+def label_from_filename(path):
+    """
+    Receipt type of a labeled sample image named like "fuel-5.jpeg" or "meal-9.jpeg".
+
+    Returns:
+        str: receipt type or None when the name carries no known label
+    """
+    prefix = os.path.basename(path).split("-")[0].split("_")[0].lower()
+    return LABEL_PREFIXES.get(prefix)
+
+###################################################################
+# Nearest Centroid Classifier
+###################################################################
+
+class ReceiptTypeClassifier:
+    """
+    Nearest-centroid classifier over standardized layout features.
+
+    The confidence of a prediction is the softmax of the negative distances
+    to the class centroids, so it is close to 1 when the receipt is much
+    nearer to one class than to the others.
+
+    Args:
+        centroids (dict): receipt type -> centroid in standardized feature space
+        mean (np.ndarray): feature means of the training data
+        scale (np.ndarray): feature standard deviations of the training data
+        threshold (float): minimum confidence for a prediction to be used
+    """
+
+    def __init__(self, centroids, mean, scale, threshold=0.8):
+        self.centroids = {label: np.asarray(c, dtype=np.float64) for label, c in centroids.items()}
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.threshold = threshold
+
+    @classmethod
+    def fit(cls, features, labels, threshold=0.8):
+        """
+        Train the classifier.
+
+        Args:
+            features (np.ndarray): one layout feature vector per row
+            labels (list): receipt type of every row
+
+        Returns:
+            ReceiptTypeClassifier: trained classifier
+        """
+        features = np.asarray(features, dtype=np.float64)
+        mean = features.mean(axis=0)
+        scale = features.std(axis=0)
+        scale[scale == 0] = 1.0
+        standardized = (features - mean) / scale
+        labels = np.asarray(labels)
+        centroids = {label: standardized[labels == label].mean(axis=0) for label in sorted(set(labels))}
+        return cls(centroids, mean, scale, threshold)
+
+    def predict(self, features):
+        """
+        Predict the receipt type of a feature vector.
+
+        Returns:
+            tuple: (receipt type, confidence between 0 and 1)
+        """
+        point = (np.asarray(features, dtype=np.float64) - self.mean) / self.scale
+        labels = list(self.centroids)
+        distances = np.array([np.linalg.norm(point - self.centroids[label]) for label in labels])
+        weights = np.exp(distances.min() - distances)
+        best = int(distances.argmin())
+        return labels[best], float(weights[best] / weights.sum())
+
+    def classify(self, img):
+        """
+        Classify a preprocessed receipt image.
+
+        Returns:
+            dict: "type", "confidence" and "accepted" (confidence reached the threshold)
+        """
+        receipt_type, confidence = self.predict(layout_features(img))
+        return {"type": receipt_type, "confidence": confidence, "accepted": confidence >= self.threshold}
+
+    def to_dict(self):
+        return {
+            "features": list(FEATURE_NAMES),
+            "centroids": {label: c.tolist() for label, c in self.centroids.items()},
+            "mean": self.mean.tolist(),
+            "scale": self.scale.tolist(),
+            "threshold": self.threshold,
+        }
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path, threshold=None):
+        """
+        Load a classifier written by save().
+
+        Args:
+            path (str): JSON model file
+            threshold (float): overrides the stored confidence threshold
+        """
+        with open(path, encoding="utf-8") as f:
+            model = json.load(f)
+        if model.get("features") != list(FEATURE_NAMES):
+            raise ValueError(f"Classifier model {path} was trained on different features")
+        return cls(model["centroids"], model["mean"], model["scale"],
+                   model["threshold"] if threshold is None else threshold)
+
+###################################################################
+# Training and Evaluation
+###################################################################
+
+def load_labeled_features(inputs):
+    """
+    Preprocess the labeled sample images like pipeline.process_receipt() does
+    (same decoding, cropping and profile settings) and compute their layout features.
+
+    Args:
+        inputs (list): image files, directories or glob patterns
+
+    Returns:
+        tuple: (feature matrix, labels, paths) of the images with a label in their name
+    """
+    features, labels, paths = [], [], []
+    for path in batch.collect_images(inputs):
+        label = label_from_filename(path)
+        if label is None:
+            continue
+        with open(path, "rb") as f:
+            gray = utils.load_grayscale(f.read(), pipeline.decode_max_side())
+        features.append(layout_features(pipeline.prepare_image(gray)[0]))
+        labels.append(label)
+        paths.append(path)
+    return np.array(features).reshape(len(features), len(FEATURE_NAMES)), labels, paths
+
+def evaluate(features, labels, thresholds=(0.5, 0.6, 0.7, 0.8, 0.9)):
+    """
+    Leave-one-out evaluation of the classifier on labeled features.
+
+    For every threshold, the hit rate is the share of receipts classified
+    locally (remote type call skipped) and the accuracy is measured on those
+    receipts only; "overall_accuracy" ignores the threshold.
+
+    Returns:
+        dict: "overall_accuracy", "predictions" and one entry per threshold
+    """
+    predictions = []
+    for i in range(len(labels)):
+        rest = [j for j in range(len(labels)) if j != i]
+        model = ReceiptTypeClassifier.fit(features[rest], [labels[j] for j in rest])
+        predictions.append(model.predict(features[i]))
+
+    report = {
+        "overall_accuracy": float(np.mean([p[0] == label for p, label in zip(predictions, labels)])) if labels else 0.0,
+        "predictions": predictions,
+        "thresholds": {},
+    }
+    for threshold in thresholds:
+        hits = [(p[0] == label) for p, label in zip(predictions, labels) if p[1] >= threshold]
+        report["thresholds"][threshold] = {
+            "hit_rate": len(hits) / len(labels) if labels else 0.0,
+            "accuracy": float(np.mean(hits)) if hits else None,
+        }
+    return report
+
+###################################################################
+# Classifier Factory
+###################################################################
+
+def create_classifier():
+    """
+    Load the local receipt-type classifier configured by the environment.
+
+    Environment variables:
+        CLASSIFIER_MODEL: JSON model written by "python classifier.py train", unset disables it
+        CLASSIFIER_THRESHOLD: minimum confidence to skip the remote type call
+
+    Returns:
+        ReceiptTypeClassifier: classifier or None when disabled
+    """
+    path = os.getenv("CLASSIFIER_MODEL")
+    if not path:
+        return None
+    threshold = os.getenv("CLASSIFIER_THRESHOLD")
+    return ReceiptTypeClassifier.load(path, float(threshold) if threshold else None)
+
+####################################################################
+# Command line interface
+####################################################################
+def main():
+    parser = argparse.ArgumentParser(description="Train or evaluate the local receipt-type classifier.")
+    parser.add_argument("command", choices=("train", "evaluate"))
+    parser.add_argument("inputs", nargs="+", help="labeled images (fuel-*, market-*, meal-*), directories or globs")
+    parser.add_argument("--output", default="receipt_classifier.json", help="model file written by train")
+    parser.add_argument("--threshold", type=float, default=0.8, help="confidence threshold stored in the model")
+    args = parser.parse_args()
+
+    features, labels, paths = load_labeled_features(args.inputs)
+    if not labels:
+        parser.error("no labeled images found")
+
+    if args.command == "train":
+        ReceiptTypeClassifier.fit(features, labels, args.threshold).save(args.output)
+        counts = {label: labels.count(label) for label in sorted(set(labels))}
+        print(f"Trained on {len(labels)} images {counts}, saved to {args.output}")
+        return
+
+    report = evaluate(features, labels)
+    for path, label, (predicted, confidence) in zip(paths, labels, report["predictions"]):
+        print(f"{os.path.basename(path):30} {label:10} -> {predicted:10} {confidence:.2f}")
+    print(f"\nLeave-one-out accuracy: {report['overall_accuracy']:.0%}")
+    print(f"{'threshold':>9} {'hit rate':>9} {'accuracy':>9}")
+    for threshold, row in report["thresholds"].items():
+        accuracy = f"{row['accuracy']:.0%}" if row["accuracy"] is not None else "-"
+        print(f"{threshold:>9.2f} {row['hit_rate']:>9.0%} {accuracy:>9}")
+
+if __name__ == "__main__":
+    main()
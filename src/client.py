@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+from urllib.parse import urlencode
+import daemon_socket
+
+# Only the standard library is imported here: the client is started once per
+# receipt by ingestion scripts, while cv2, numpy, the model client and the
+# caches stay loaded in the worker daemon (service.py --unix-socket).
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+####################################################################
+# Daemon protocol
+####################################################################
+class DaemonUnavailable(Exception):
+    """
+    Raised when no worker daemon listens on the socket.
+    """
+
+def request(socket_path, method, path, body=b"", timeout=300):
+    """
+    Send one HTTP/1.1 request to the daemon over its Unix domain socket.
+
+    Args:
+        socket_path (str): socket of service.py --unix-socket
+        method (str): HTTP method
+        path (str): request path with the query string
+        body (bytes): request body
+        timeout (float): seconds to wait for the response
+
+    Returns:
+        tuple: (status code, decoded JSON body, headers dict)
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            raise DaemonUnavailable(f"No receipt worker daemon at {socket_path} ({e.strerror})") from e
+        head = (f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n")
+        sock.sendall(head.encode("latin-1") + body)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        sock.close()
+
+    head, _, payload = b"".join(chunks).partition(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return int(lines[0].split()[1]), json.loads(payload) if payload else {}, headers
+
+def extract_file(image_path, socket_path=daemon_socket.DEFAULT_SOCKET, mode=None, retries=30):
+    """
+    Extract one receipt file with the daemon, waiting while its queue is full.
+
+    Args:
+        image_path (str): receipt image
+        socket_path (str): socket of the daemon
+        mode (str): extraction mode, the daemon's default when None
+        retries (int): attempts while the daemon answers 429
+
+    Returns:
+        dict: result as returned by the service (/extract)
+    """
+    with open(image_path, "rb") as f:
+        body = f.read()
+    query = {"source": image_path}
+    if mode:
+        query["mode"] = mode
+    for _ in range(retries):
+        status, result, headers = request(socket_path, "POST", f"/extract?{urlencode(query)}", body)
+        if status != 429:
+            break
+        time.sleep(float(headers.get("retry-after", "1")))
+    if "success" not in result:
+        result = {"success": False, "error": result.get("error", f"HTTP {status}")}
+    return result
+
+def collect_files(inputs):
+    """
+    Expand directories into the receipt images they contain.
+    """
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if name.lower().endswith(IMAGE_EXTENSIONS)))
+        else:
+            files.append(path)
+    return files
+
+####################################################################
+# Receipt output
+####################################################################
+def print_receipt(receipt_data):
+    print(f"Fiş Türü: {receipt_data.get('type', 'N/A')}")
+    print(f"İşletme Adı: {receipt_data.get('business_name', 'N/A')}")
+    print(f"Tarih: {receipt_data.get('date', 'N/A')}")
+
+    if receipt_data.get('type') == "FUEL":
+        if 'license_plate' in receipt_data:
+            print(f"Plaka: {receipt_data.get('license_plate', 'N/A')}")
+
+    if receipt_data.get('type') == "MARKET":
+        if 'items' in receipt_data and isinstance(receipt_data['items'], list):
+            print("\nAlınan Ürünler:")
+            for item in receipt_data['items']:
+                print(f"{item.get('name', 'N/A')}")
+                print(f"Fiyat: {item.get('price', 'N/A')}")
+                print("-------------------")
+
+    print(f"Toplam Tutar: {receipt_data.get('total_amount', 'N/A')}")
+
+def print_result(image_path, result, as_json, show_path):
+    if as_json:
+        print(json.dumps({"source": image_path, **result}, ensure_ascii=False), flush=True)
+        return
+    if show_path:
+        print(f"== {image_path}")
+    if result["success"]:
+        print_receipt(result["data"])
+    else:
+        print(f"Hata oluştu: {result['error']}")
+    if "processing_time" in result:
+        print(f"Processing time: {result['processing_time']:.2f} seconds" + (" (cached)" if result.get("cached") else ""))
+    print(flush=True)
+
+####################################################################
+# Command line interface
+####################################################################
+def main():
+    parser = argparse.ArgumentParser(
+        description="Extract receipts with the resident worker daemon (start it with: service.py --unix-socket).")
+    parser.add_argument("inputs", nargs="+", help="receipt images or directories")
+    parser.add_argument("--socket", default=os.getenv("SERVICE_SOCKET") or daemon_socket.DEFAULT_SOCKET,
+                        help="Unix domain socket of the daemon")
+    parser.add_argument("--mode", choices=("one_shot", "two_step"), default=None,
+                        help="extraction mode, the daemon's default when omitted")
+    parser.add_argument("--jobs", type=int, default=1, help="receipts sent to the daemon at the same time")
+    parser.add_argument("--json", action="store_true", help="print one JSON line per receipt")
+    args = parser.parse_args()
+
+    files = collect_files(args.inputs)
+    executor = None
+    if args.jobs > 1 and len(files) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+
+        executor = ThreadPoolExecutor(max_workers=args.jobs)
+
+    def extract(path):
+        return extract_file(path, args.socket, args.mode)
+
+    failed = 0
+    try:
+        # Results are printed in input order either way
+        for path, result in zip(files, executor.map(extract, files) if executor else map(extract, files)):
+            print_result(path, result, args.json, len(files) > 1)
+            failed += not result["success"]
+    except DaemonUnavailable as e:
+        print(f"{e}. Start it with: python src/service.py --unix-socket {args.socket}", file=sys.stderr)
+        return 2
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
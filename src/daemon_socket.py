@@ -0,0 +1,52 @@
+import os
+import socket
+import stat
+
+# Only the standard library is imported here: client.py loads this module on
+# every start, service.py uses it to claim the socket of the worker daemon.
+
+DEFAULT_SOCKET = os.path.join(os.getenv("XDG_RUNTIME_DIR") or "/tmp",
+                              f"receipt-extractor-{os.getuid() if hasattr(os, 'getuid') else 0}.sock")
+
+class SocketInUse(Exception):
+    """
+    Raised when the socket path belongs to a running daemon or is not a socket.
+    """
+
+def remove_stale_socket(path, timeout=1.0):
+    """
+    Remove the socket left behind by a daemon that did not shut down cleanly.
+    Paths that are not sockets and sockets a daemon still accepts
+    connections on are left alone.
+
+    Args:
+        path (str): socket path
+        timeout (float): seconds to wait for a connection to a live daemon
+
+    Raises:
+        SocketInUse: the path is not a socket or a daemon listens on it
+    """
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise SocketInUse(f"{path} exists and is not a socket")
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        pass
+    except OSError as e:
+        raise SocketInUse(f"Cannot tell whether a daemon listens on {path} ({e})") from e
+    else:
+        raise SocketInUse(f"A daemon already listens on {path}")
+    finally:
+        sock.close()
+
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,273 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from result_cache import prompt_version
+
+###################################################################
+# Hamming Helpers
+###################################################################
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+def to_signed(phash):
+    """
+    Map an unsigned 64-bit hash to the signed range of SQLite integers.
+    """
+    return phash - (1 << 64) if phash >= 1 << 63 else phash
+
+def chunk_masks(radius):
+    """
+    All CHUNK_BITS-bit masks with at most `radius` bits set.
+
+    Returns:
+        np.ndarray: uint64 masks, the zero mask first
+    """
+    values = np.arange(1 << CHUNK_BITS, dtype=np.uint64)
+    return values[np.bitwise_count(values) <= radius]
+
+def hash_chunks(hashes, chunk):
+    """
+    The `chunk`-th CHUNK_BITS-bit slice of every hash.
+    """
+    return (hashes >> np.uint64(chunk * CHUNK_BITS)) & np.uint64(CHUNK_MASK)
+
+###################################################################
+# Duplicate Index
+###################################################################
+
+class DuplicateIndex:
+    """
+    Persistent index of the perceptual hashes (utils.perceptual_hash) of
+    processed receipts and their extraction results, used to reuse the
+    result of a near-duplicate photo instead of calling the model again.
+
+    Lookups use multi-index hashing: the 64-bit hash is split into CHUNKS
+    chunks and, by the pigeonhole principle, a hash within max_distance bits
+    differs in at most max_distance // CHUNKS bits in one of its chunks. The
+    chunks of all hashes are kept sorted in memory, so a lookup probes every
+    chunk value within that radius with a binary search and only computes
+    the full hamming distance of the few candidates it finds. New hashes are
+    kept in a small buffer that is searched exhaustively and merged into the
+    sorted arrays once it grows past merge_threshold entries.
+
+    Hashes and results are stored in SQLite and loaded on open. Entries of
+    other prompt versions are kept for processes still running them but are
+    not loaded, so they are never matched.
+
+    Args:
+        path (str): SQLite database file
+        model_name (str): model whose results are indexed and reused
+        max_distance (int): maximum hamming distance of a near-duplicate
+        merge_threshold (int): buffered hashes before the sorted arrays are rebuilt
+    """
+
+    def __init__(self, path, model_name, max_distance=10, merge_threshold=4096):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.model_name = model_name
+        self.max_distance = max_distance
+        self.merge_threshold = merge_threshold
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.masks = {max_distance // CHUNKS: chunk_masks(max_distance // CHUNKS)}
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS duplicates (
+                id INTEGER PRIMARY KEY,
+                phash INTEGER,
+                model_name TEXT,
+                prompt_version TEXT,
+                data TEXT,
+                created_at REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_duplicates_model ON duplicates (model_name, prompt_version)")
+
+        # Entries of other prompt versions are kept for processes still running them; only this
+        # version's entries are loaded, so results with an outdated schema are never reused
+        self.conn.commit()
+
+        rows = self.conn.execute(
+            "SELECT id, phash FROM duplicates WHERE model_name = ? AND prompt_version = ?",
+            (model_name, prompt_version()),
+        ).fetchall()
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        hashes = np.array([row[1] for row in rows], dtype=np.int64).view(np.uint64)
+        self._build(ids, hashes)
+        self.pending_ids = []
+        self.pending_hashes = []
+
+    def _build(self, ids, hashes):
+        self.ids = ids
+        self.hashes = hashes
+        self.chunk_order = []
+        self.chunk_sorted = []
+        for chunk in range(CHUNKS):
+            values = hash_chunks(hashes, chunk)
+            order = np.argsort(values, kind="stable")
+            self.chunk_order.append(order)
+            self.chunk_sorted.append(values[order])
+
+    def _merge_pending(self):
+        ids = np.concatenate([self.ids, np.array(self.pending_ids, dtype=np.int64)])
+        hashes = np.concatenate([self.hashes, np.array(self.pending_hashes, dtype=np.uint64)])
+        self.pending_ids, self.pending_hashes = [], []
+        self._build(ids, hashes)
+
+    def _candidates(self, query, radius):
+        if radius not in self.masks:
+            self.masks[radius] = chunk_masks(radius)
+        masks = self.masks[radius]
+
+        positions = []
+        for chunk in range(CHUNKS):
+            probes = hash_chunks(query, chunk) ^ masks
+            sorted_values = self.chunk_sorted[chunk]
+            starts = np.searchsorted(sorted_values, probes, side="left")
+            lengths = np.searchsorted(sorted_values, probes, side="right") - starts
+            found = lengths > 0
+            if not found.any():
+                continue
+            # Expand the [start, start + length) ranges of all probes at once
+            starts, lengths = starts[found], lengths[found]
+            offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            positions.append(self.chunk_order[chunk][offsets])
+        return np.concatenate(positions) if positions else np.empty(0, dtype=np.int64)
+
+    def nearest(self, phash, max_distance=None):
+        """
+        Find the closest indexed hash within max_distance bits.
+
+        Args:
+            phash (int): unsigned 64-bit perceptual hash
+            max_distance (int): overrides the index threshold
+
+        Returns:
+            tuple: (row id, hamming distance) or None when there is no near-duplicate
+        """
+        max_distance = self.max_distance if max_distance is None else max_distance
+        query = np.uint64(phash)
+        best = None
+        with self.lock:
+            positions = self._candidates(query, max_distance // CHUNKS)
+            if len(positions):
+                distances = np.bitwise_count(self.hashes[positions] ^ query)
+                i = int(distances.argmin())
+                best = (int(self.ids[positions[i]]), int(distances[i]))
+
+            if self.pending_hashes:
+                distances = np.bitwise_count(np.array(self.pending_hashes, dtype=np.uint64) ^ query)
+                i = int(distances.argmin())
+                if best is None or distances[i] < best[1]:
+                    best = (self.pending_ids[i], int(distances[i]))
+
+        if best is None or best[1] > max_distance:
+            return None
+        return best
+
+    def lookup(self, phash, max_distance=None):
+        """
+        Find the extraction result of a near-duplicate receipt.
+
+        Args:
+            phash (int): unsigned 64-bit perceptual hash
+            max_distance (int): overrides the index threshold
+
+        Returns:
+            dict: {"id", "distance", "data"} or None
+        """
+        match = self.nearest(phash, max_distance)
+        with self.lock:
+            if match is None:
+                self.misses += 1
+                return None
+            row = self.conn.execute("SELECT data FROM duplicates WHERE id = ?", (match[0],)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return {"id": match[0], "distance": match[1], "data": json.loads(row[0])}
+
+    def add(self, phash, receipt_data):
+        """
+        Index the extraction result of a receipt.
+
+        Returns:
+            int: row id
+        """
+        return self.add_many([(phash, receipt_data)])[0]
+
+    def add_many(self, entries):
+        """
+        Index many (phash, receipt_data) pairs in one transaction, e.g. to backfill an archive.
+
+        Returns:
+            list: row ids
+        """
+        now = time.time()
+        version = prompt_version()
+        with self.lock:
+            ids = []
+            for phash, receipt_data in entries:
+                cursor = self.conn.execute(
+                    "INSERT INTO duplicates (phash, model_name, prompt_version, data, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (to_signed(phash), self.model_name, version, json.dumps(receipt_data, ensure_ascii=False), now),
+                )
+                ids.append(cursor.lastrowid)
+                self.pending_ids.append(cursor.lastrowid)
+                self.pending_hashes.append(phash)
+            self.conn.commit()
+            if len(self.pending_ids) >= self.merge_threshold:
+                self._merge_pending()
+        return ids
+
+    def stats(self):
+        """
+        Return the hit/miss counters and the number of indexed receipts.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.ids) + len(self.pending_ids),
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+###################################################################
+# Index Factory
+###################################################################
+
+def create_index(model_name):
+    """
+    Open the near-duplicate index configured by the environment.
+
+    Environment variables:
+        DUPLICATE_INDEX_PATH: SQLite file, unset or empty (default) disables near-duplicate reuse
+        DUPLICATE_MAX_DISTANCE: maximum hamming distance of a near-duplicate (default 10)
+
+    Args:
+        model_name (str): model whose results are indexed
+
+    Returns:
+        DuplicateIndex: index or None when disabled
+    """
+    path = os.getenv("DUPLICATE_INDEX_PATH")
+    if not path:
+        return None
+    return DuplicateIndex(path, model_name, max_distance=int(os.getenv("DUPLICATE_MAX_DISTANCE", "10")))
@@ -0,0 +1,126 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("receipt_extractor.memory_budget")
+
+###################################################################
+# Memory Budget
+###################################################################
+
+class Reservation:
+    """
+    Bytes reserved from a MemoryBudget; release() is idempotent and the
+    reservation can be used as a context manager.
+    """
+
+    def __init__(self, budget, amount, waited):
+        self.budget = budget
+        self.amount = amount
+        self.waited = waited
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.budget._release(self.amount)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+class MemoryBudget:
+    """
+    Per-process limit on the memory held by decoded images. Receipts reserve
+    their estimated working set before decoding and wait in arrival order
+    while the budget is used up, so a burst of large photos is queued
+    instead of being decoded all at once.
+
+    A reservation larger than the whole budget is admitted once nothing else
+    is reserved, so an oversized image runs alone instead of waiting forever.
+
+    Args:
+        limit_bytes (int): bytes that may be reserved at the same time
+    """
+
+    def __init__(self, limit_bytes):
+        self.limit_bytes = limit_bytes
+        self.reserved = 0
+        self.peak = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self._queue = []
+        self._condition = threading.Condition()
+
+    def reserve(self, amount):
+        """
+        Block until amount bytes fit into the budget.
+
+        Args:
+            amount (int): bytes to reserve
+
+        Returns:
+            Reservation: release it once the image data is no longer referenced
+        """
+        start = time.perf_counter()
+        ticket = object()
+        with self._condition:
+            self._queue.append(ticket)
+            try:
+                while self._queue[0] is not ticket or not self._fits(amount):
+                    self._condition.wait()
+            finally:
+                self._queue.remove(ticket)
+                # The next receipt in line may fit into what is left
+                self._condition.notify_all()
+            self.reserved += amount
+            self.peak = max(self.peak, self.reserved)
+            waited = time.perf_counter() - start
+            if waited > 0.001:
+                self.waits += 1
+                self.wait_seconds += waited
+        return Reservation(self, amount, waited)
+
+    def _fits(self, amount):
+        return self.reserved == 0 or self.reserved + amount <= self.limit_bytes
+
+    def _release(self, amount):
+        with self._condition:
+            self.reserved -= amount
+            self._condition.notify_all()
+
+    def stats(self):
+        """
+        Current state for health checks and benchmarks.
+
+        Returns:
+            dict: limit, reserved and peak reserved bytes, queued receipts, waits and total wait time
+        """
+        with self._condition:
+            return {
+                "limit_bytes": self.limit_bytes,
+                "reserved_bytes": self.reserved,
+                "peak_bytes": self.peak,
+                "queued": len(self._queue),
+                "waits": self.waits,
+                "wait_seconds": self.wait_seconds,
+            }
+
+def create_budget():
+    """
+    Create the memory budget configured by the environment.
+
+    Environment variables:
+        IMAGE_MEMORY_BUDGET: megabytes of decoded image data per process (default 512, 0 disables)
+
+    Returns:
+        MemoryBudget: budget, or None when disabled
+    """
+    megabytes = float(os.getenv("IMAGE_MEMORY_BUDGET", "512"))
+    if megabytes <= 0:
+        return None
+    logger.info("Image memory budget: %.0f MB", megabytes)
+    return MemoryBudget(int(megabytes * 1024 * 1024))
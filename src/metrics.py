@@ -0,0 +1,229 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("receipt_extractor.metrics")
+
+###################################################################
+# Stage Timing
+###################################################################
+
+STAGES = (
+    "cache_lookup", "memory_wait", "decode", "duplicate_lookup", "localize", "assess", "preprocess", "encode",
+    "classify", "tile", "batch_wait", "type_call", "extract_call", "reask_call", "parse", "cache_store", "duplicate_store",
+)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class StageTimer:
+    """
+    Collects the duration of the pipeline stages of a single receipt.
+    A stage entered several times (e.g. retried calls) accumulates its time.
+
+    Args:
+        on_stage (callable): called with the stage name whenever a stage ends (e.g. to drive a progress bar)
+    """
+
+    def __init__(self, on_stage=None):
+        self.stages = {}
+        self.on_stage = on_stage
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+            if self.on_stage is not None:
+                self.on_stage(name)
+
+    def add(self, name, seconds):
+        """
+        Record a stage measured elsewhere (e.g. by another thread).
+        """
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        if self.on_stage is not None:
+            self.on_stage(name)
+
+def stage(timer, name):
+    """
+    Time a stage on an optional timer.
+
+    Args:
+        timer (StageTimer): timer or None
+        name (str): stage name
+
+    Returns:
+        context manager
+    """
+    return timer.stage(name) if timer is not None else contextlib.nullcontext()
+
+###################################################################
+# Metrics Registry
+###################################################################
+
+class Histogram:
+    """
+    Cumulative Prometheus-style histogram.
+
+    Args:
+        buckets (tuple): upper bounds of the buckets
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+class MetricsRegistry:
+    """
+    Thread-safe registry of per-stage latency histograms and receipt counters,
+    rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stage_histograms = {}
+        self.total_histogram = Histogram()
+        self.receipts = {}
+        self.payload_bytes = 0
+        self.classifications = {}
+        self.profiles = {}
+
+    def observe(self, result):
+        """
+        Record the result dict returned by pipeline.process_receipt().
+        """
+        status = "error" if not result["success"] else "duplicate" if result.get("duplicate") \
+            else "cached" if result.get("cached") else "success"
+        with self.lock:
+            for name, seconds in result.get("stages", {}).items():
+                self.stage_histograms.setdefault(name, Histogram()).observe(seconds)
+            self.total_histogram.observe(result["processing_time"])
+            self.receipts[status] = self.receipts.get(status, 0) + 1
+            self.payload_bytes += result.get("payload_bytes") or 0
+            if "preprocess" in result:
+                profile = result["preprocess"]["profile"]
+                self.profiles[profile] = self.profiles.get(profile, 0) + 1
+            classification = result.get("classification")
+            if classification is not None:
+                key = classification_outcome(result)
+                self.classifications[key] = self.classifications.get(key, 0) + 1
+
+    def render_prometheus(self):
+        """
+        Render all metrics in the Prometheus text format.
+
+        Returns:
+            str: exposition text
+        """
+        lines = []
+        with self.lock:
+            lines.append("# HELP receipt_stage_seconds Duration of the receipt pipeline stages.")
+            lines.append("# TYPE receipt_stage_seconds histogram")
+            for name in sorted(self.stage_histograms):
+                lines.extend(_render_histogram("receipt_stage_seconds", self.stage_histograms[name], f'stage="{name}",'))
+
+            lines.append("# HELP receipt_processing_seconds End-to-end processing time of a receipt.")
+            lines.append("# TYPE receipt_processing_seconds histogram")
+            lines.extend(_render_histogram("receipt_processing_seconds", self.total_histogram, ""))
+
+            lines.append("# HELP receipts_total Processed receipts by status.")
+            lines.append("# TYPE receipts_total counter")
+            for status in sorted(self.receipts):
+                lines.append(f'receipts_total{{status="{status}"}} {self.receipts[status]}')
+
+            lines.append("# HELP receipt_payload_bytes_total Image bytes uploaded to the model.")
+            lines.append("# TYPE receipt_payload_bytes_total counter")
+            lines.append(f"receipt_payload_bytes_total {self.payload_bytes}")
+
+            lines.append("# HELP receipt_preprocess_profile_total Receipts by the preprocessing profile chosen for them.")
+            lines.append("# TYPE receipt_preprocess_profile_total counter")
+            for profile in sorted(self.profiles):
+                lines.append(f'receipt_preprocess_profile_total{{profile="{profile}"}} {self.profiles[profile]}')
+
+            lines.append("# HELP receipt_classifier_total Local type classifications by decision and agreement with the extracted type.")
+            lines.append("# TYPE receipt_classifier_total counter")
+            for (decision, agreement) in sorted(self.classifications):
+                count = self.classifications[(decision, agreement)]
+                lines.append(f'receipt_classifier_total{{decision="{decision}",agreement="{agreement}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """
+        Atomically write the exposition text to a file (e.g. for the node exporter textfile collector).
+        """
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(temp_path, path)
+
+def classification_outcome(result):
+    """
+    Decision of the local classifier for a result ("local" when its type was
+    used, "remote" when the model was asked) and whether the predicted type
+    agrees with the type of the extracted receipt ("match", "mismatch" or
+    "unknown" when extraction failed).
+
+    Returns:
+        tuple: (decision, agreement)
+    """
+    classification = result["classification"]
+    decision = "local" if classification["accepted"] else "remote"
+    data = result.get("data") if result["success"] else None
+    if not data:
+        return decision, "unknown"
+    return decision, "match" if data.get("type") == classification["type"] else "mismatch"
+
+def _render_histogram(name, histogram, labels):
+    lines = []
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {count}')
+    lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {histogram.count}')
+    labels = labels.rstrip(",")
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {histogram.sum:.6f}")
+    lines.append(f"{name}_count{suffix} {histogram.count}")
+    return lines
+
+REGISTRY = MetricsRegistry()
+
+###################################################################
+# Structured Logging
+###################################################################
+
+def log_result(result, source=None):
+    """
+    Record a pipeline result in the default registry and emit it as a
+    structured (JSON) log line on the receipt_extractor.metrics logger.
+
+    Args:
+        result (dict): result returned by pipeline.process_receipt()
+        source (str): optional file name or identifier of the receipt
+    """
+    REGISTRY.observe(result)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({
+            "event": "receipt_processed",
+            "source": source,
+            "success": result["success"],
+            "cached": result.get("cached", False),
+            "processing_time": round(result["processing_time"], 6),
+            "stages": {name: round(seconds, 6) for name, seconds in result.get("stages", {}).items()},
+            "payload_bytes": result.get("payload_bytes"),
+            "classification": result.get("classification"),
+            "duplicate": result.get("duplicate"),
+            "preprocess": result.get("preprocess"),
+        }))
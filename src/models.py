@@ -0,0 +1,116 @@
+import dataclasses
+import re
+from dataclasses import dataclass, field
+import utils
+
+###################################################################
+# Receipt Models
+###################################################################
+
+@dataclass(slots=True)
+class ReceiptItem:
+    name: str = None
+    price: str = None
+
+@dataclass(slots=True)
+class FuelReceipt:
+    type: str = "FUEL"
+    business_name: str = None
+    date: str = None
+    license_plate: str = None
+    total_amount: str = None
+    vat_percentage: str = None
+
+@dataclass(slots=True)
+class RestaurantReceipt:
+    type: str = "RESTAURANT"
+    business_name: str = None
+    date: str = None
+    total_amount: str = None
+    vat_percentage: str = None
+
+@dataclass(slots=True)
+class MarketReceipt:
+    type: str = "MARKET"
+    business_name: str = None
+    date: str = None
+    total_amount: str = None
+    items: list = field(default_factory=list)
+
+RECEIPT_MODELS = {
+    "FUEL": FuelReceipt,
+    "RESTAURANT": RestaurantReceipt,
+    "MARKET": MarketReceipt,
+}
+
+ITEM_FIELDS = tuple(f.name for f in dataclasses.fields(ReceiptItem))
+
+###################################################################
+# Schema Validation
+###################################################################
+
+def schema_fields(receipt_type):
+    """
+    Top-level field names of a receipt type in the order of its PROMPTS schema.
+
+    Args:
+        receipt_type (str): one of the keys of utils.PROMPTS
+
+    Returns:
+        tuple: field names
+    """
+    keys = re.findall(r'"(\w+)"\s*:', utils.PROMPTS[receipt_type])
+    return tuple(key for key in dict.fromkeys(keys) if key not in ITEM_FIELDS)
+
+def validate_receipt(receipt_data):
+    """
+    Validate parsed receipt data against the PROMPTS schema of its type.
+
+    Args:
+        receipt_data (dict): parsed receipt data with a known "type"
+
+    Returns:
+        list: names of the missing or malformed top-level fields
+    """
+    failing = []
+    for name in schema_fields(receipt_data["type"]):
+        value = receipt_data.get(name)
+        if name == "items":
+            if not isinstance(value, list) or not all(
+                isinstance(item, dict) and all(item.get(key) not in (None, "") for key in ITEM_FIELDS)
+                for item in value
+            ):
+                failing.append(name)
+        elif value is None or value == "" or isinstance(value, (dict, list)):
+            failing.append(name)
+    return failing
+
+###################################################################
+# Conversion Functions
+###################################################################
+
+def receipt_from_dict(receipt_data):
+    """
+    Build the receipt model of the data's type. Keys outside the schema are dropped.
+
+    Args:
+        receipt_data (dict): parsed receipt data with a known "type"
+
+    Returns:
+        FuelReceipt, RestaurantReceipt or MarketReceipt
+    """
+    model = RECEIPT_MODELS[receipt_data["type"]]
+    values = {f.name: receipt_data[f.name] for f in dataclasses.fields(model) if f.name in receipt_data}
+    if "items" in values:
+        items = values["items"] if isinstance(values["items"], list) else []
+        values["items"] = [
+            ReceiptItem(**{key: item.get(key) for key in ITEM_FIELDS})
+            for item in items if isinstance(item, dict)
+        ]
+    return model(**values)
+
+def receipt_to_dict(receipt):
+    """
+    Convert a receipt model back to the plain dict used for display and storage.
+    """
+    return dataclasses.asdict(receipt)
@@ -0,0 +1,318 @@
+import json
+import os
+import time
+import numpy as np
+import metrics
+import models
+import result_cache
+import streaming
+import tiling
+import utils
+
+###################################################################
+# Receipt Pipeline
+###################################################################
+
+def read_image_bytes(image):
+    """
+    Return the raw encoded bytes of an image path, bytes object or file-like object.
+    """
+    if isinstance(image, (bytes, bytearray)):
+        return bytes(image)
+    if isinstance(image, memoryview):
+        return image.tobytes()
+    if hasattr(image, "getvalue"):
+        return image.getvalue()
+    if hasattr(image, "read"):
+        return image.read()
+    with open(image, "rb") as f:
+        return f.read()
+
+def upload_settings():
+    """
+    Image upload settings from the environment (UPLOAD_MAX_SIDE, UPLOAD_FORMAT, UPLOAD_JPEG_QUALITY).
+
+    Returns:
+        dict: keyword arguments of utils.encode_for_upload()
+    """
+    return {
+        "max_side": int(os.getenv("UPLOAD_MAX_SIDE", "1600")),
+        "image_format": os.getenv("UPLOAD_FORMAT", "webp1"),
+        "jpeg_quality": int(os.getenv("UPLOAD_JPEG_QUALITY", "85")),
+    }
+
+def decode_max_side():
+    """
+    Longest side JPEGs are decoded at from the environment (DECODE_MAX_SIDE, 0 for full resolution).
+    """
+    return int(os.getenv("DECODE_MAX_SIDE", str(utils.DECODE_MAX_SIDE)))
+
+def crop_enabled():
+    """
+    Whether receipts are cropped to their detected outline (RECEIPT_CROP, off by default).
+    """
+    return os.getenv("RECEIPT_CROP", "0").lower() not in ("0", "false", "no", "off")
+
+def tiling_enabled():
+    """
+    Whether tall market receipts are extracted from overlapping bands (RECEIPT_TILING, off by default).
+    """
+    return os.getenv("RECEIPT_TILING", "0").lower() not in ("0", "false", "no", "off")
+
+def tiling_settings():
+    """
+    Band layout of tiled extraction from the environment (TILE_MIN_ASPECT, TILE_BAND_RATIO,
+    TILE_OVERLAP_LINES, TILE_MAX_BANDS).
+
+    Returns:
+        dict: keyword arguments of tiling.plan_bands()
+    """
+    return {
+        "min_aspect": float(os.getenv("TILE_MIN_ASPECT", "2.5")),
+        "band_ratio": float(os.getenv("TILE_BAND_RATIO", "1.5")),
+        "overlap_lines": int(os.getenv("TILE_OVERLAP_LINES", "2")),
+        "max_bands": int(os.getenv("TILE_MAX_BANDS", "8")),
+    }
+
+def preprocess_profile():
+    """
+    Preprocessing profile from the environment (PREPROCESS_PROFILE): "auto" (default)
+    chooses it per receipt from the measured image quality, "skip", "light", "full" or
+    "contrast" force it.
+    """
+    profile = os.getenv("PREPROCESS_PROFILE", "auto")
+    if profile != "auto" and profile not in utils.PREPROCESS_PROFILES:
+        raise ValueError(f"Unknown preprocessing profile: {profile}")
+    return profile
+
+def prepare_image(gray, crop=None, profile=None, preprocess=utils.preprocess_image, timer=None):
+    """
+    Crop a decoded receipt, choose its preprocessing profile and preprocess it.
+    Shared by process_receipt() and classifier training, so the classifier
+    sees the same images when it is trained as when it is used.
+
+    Args:
+        gray (ndarray): decoded grayscale receipt
+        crop (bool): crop to the detected receipt, defaults to crop_enabled()
+        profile (str): "auto" or one of utils.PREPROCESS_PROFILES, defaults to preprocess_profile()
+        preprocess (callable): preprocessing function, e.g. PreprocessExecutor.preprocess
+        timer (metrics.StageTimer): optional stage timer
+
+    Returns:
+        tuple: (preprocessed image, info) where info holds the "crop" outcome when
+        cropping is enabled and the "preprocess" profile (with the "quality" in auto mode)
+    """
+    info = {}
+    if crop if crop is not None else crop_enabled():
+        with metrics.stage(timer, "localize"):
+            gray, info["crop"] = utils.crop_to_receipt(gray)
+    profile = profile or preprocess_profile()
+    if profile == "auto":
+        with metrics.stage(timer, "assess"):
+            quality = utils.assess_quality(gray)
+            profile = utils.choose_profile(quality)
+        info["preprocess"] = {"profile": profile, "quality": quality}
+    else:
+        info["preprocess"] = {"profile": profile}
+    with metrics.stage(timer, "preprocess"):
+        return preprocess(gray, profile), info
+
+def process_receipt(image, backend, mode=utils.EXTRACTION_MODE_ONE_SHOT, cache=None, upload=None,
+                    preprocess=utils.preprocess_image, on_event=None, classifier=None, on_stage=None,
+                    scheduler=None, duplicate_index=None, crop=None, profile=None, memory=None, tile=None):
+    """
+    Run the full pipeline (cache lookup, preprocessing, extraction) for one receipt.
+    The image is read once and processed in memory; large JPEGs are decoded at
+    reduced resolution (see decode_max_side()).
+
+    Args:
+        image: receipt image path, raw bytes or file-like object
+        backend (backends.ModelBackend): model backend
+        mode (str): one of utils.EXTRACTION_MODES
+        cache (result_cache.ResultCache): optional result cache
+        upload (dict): utils.encode_for_upload() settings, defaults to upload_settings()
+        preprocess (callable): preprocessing function, e.g. PreprocessExecutor.preprocess; any
+            function other than utils.preprocess_image is given the encoded image to decode
+            (with max_side) when the decoded pixels are not needed in this process, that is
+            without cropping, the auto profile and a duplicate index
+        on_event (callable): stream the extraction and report fields/items as they complete
+        classifier (classifier.ReceiptTypeClassifier): optional local type classifier; a
+            confident prediction replaces the remote type detection
+        on_stage (callable): called with the name of every completed stage
+        scheduler (batching.BatchingScheduler): optional scheduler sending the one-shot extraction
+            together with other receipts; falls back to a single request when the batch cannot be used
+            (ignored when streaming with on_event, in two-step mode and for a classified type)
+        duplicate_index (duplicate_index.DuplicateIndex): optional perceptual-hash index; the result
+            of a near-duplicate photo of an earlier receipt is reused without a model call
+        crop (bool): crop the photo to the detected receipt before preprocessing, defaults to crop_enabled()
+        profile (str): "auto" or one of utils.PREPROCESS_PROFILES, defaults to preprocess_profile()
+        memory (memory_budget.MemoryBudget): optional budget the decoded image is reserved from;
+            the receipt waits while other receipts hold it and releases it once the upload is encoded
+        tile (bool): extract tall receipts that may be market receipts from overlapping bands
+            (see tiling.extract_tiled(), bypasses the scheduler), defaults to tiling_enabled()
+
+    Returns:
+        dict: result with "success", "data" (plain dict) and "receipt" (models object)
+        or "error", "processing_time", "cached" (result cache hit), the SHA-256 "image_digest" of the
+        image, the "input_bytes"/"payload_bytes" sizes of the upload, the
+        per-stage durations in "stages", the local
+        "classification" when a classifier is used and the matched "duplicate"
+        {"id", "distance"} when the result was reused from a near-duplicate and
+        the outcome of the receipt localization in "crop" when cropping is enabled;
+        "preprocess" holds the chosen profile and, in auto mode, the measured "quality";
+        "tiling" holds the bands, dropped duplicates, band "payload_bytes" and the
+        "reconciliation" of the total when a market receipt was extracted from bands
+    """
+    process_start_time = time.time()
+    timer = metrics.StageTimer(on_stage)
+    result = {"success": False, "cached": False, "stages": timer.stages}
+    reservation = None
+    # Batched requests use the one-shot prompt; announce the receipt so that
+    # batches wait for it while it is being preprocessed
+    batched = scheduler is not None and on_event is None and mode == utils.EXTRACTION_MODE_ONE_SHOT
+    if batched:
+        scheduler.announce()
+    try:
+        image_bytes = read_image_bytes(image)
+        result["image_digest"] = result_cache.image_digest(image_bytes)
+
+        cache_key = None
+        if cache is not None:
+            with timer.stage("cache_lookup"):
+                cache_key = result_cache.make_key(image_bytes, backend.model_name, digest=result["image_digest"])
+                cached = cache.get(cache_key)
+            if cached is not None:
+                result.update({
+                    "success": True,
+                    "data": cached["data"],
+                    "receipt": models.receipt_from_dict(cached["data"]),
+                    "cached": True
+                })
+                return result
+
+        max_side = decode_max_side()
+        image_file = utils.open_image(image_bytes, max_side)
+        if memory is not None:
+            with timer.stage("memory_wait"):
+                reservation = memory.reserve(utils.working_set_bytes(image_file.size))
+
+        crop = crop if crop is not None else crop_enabled()
+        profile = profile or preprocess_profile()
+        if (preprocess is not utils.preprocess_image and not crop and profile != "auto"
+                and duplicate_index is None):
+            # Nothing here needs the decoded pixels: the preprocessing pool decodes
+            # the image in its worker instead of receiving a copy of them
+            image_file.close()
+            with timer.stage("preprocess"):
+                processed_img = preprocess(image_bytes, profile, max_side=max_side)
+            result["preprocess"] = {"profile": profile}
+            gray = None
+        else:
+            with timer.stage("decode"):
+                gray = utils.load_grayscale(image_file, max_side)
+                image_file.close()
+
+        phash = None
+        if duplicate_index is not None:
+            with timer.stage("duplicate_lookup"):
+                phash = utils.perceptual_hash(gray)
+                duplicate = duplicate_index.lookup(phash)
+            if duplicate is not None:
+                if cache is not None:
+                    with timer.stage("cache_store"):
+                        cache.put(cache_key, duplicate["data"])
+                result.update({
+                    "success": True,
+                    "data": duplicate["data"],
+                    "receipt": models.receipt_from_dict(duplicate["data"]),
+                    "duplicate": {"id": duplicate["id"], "distance": duplicate["distance"]},
+                    "input_bytes": len(image_bytes)
+                })
+                return result
+
+        if gray is not None:
+            processed_img, prepared = prepare_image(gray, crop, profile, preprocess, timer)
+            result.update(prepared)
+        upload = upload or upload_settings()
+        with timer.stage("encode"):
+            payload = utils.encode_for_upload(processed_img, **upload)
+
+        receipt_type = None
+        if classifier is not None:
+            with timer.stage("classify"):
+                result["classification"] = classifier.classify(processed_img)
+            if result["classification"]["accepted"]:
+                receipt_type = result["classification"]["type"]
+
+        bands = None
+        if receipt_type in (None, "MARKET") and (tile if tile is not None else tiling_enabled()):
+            with timer.stage("tile"):
+                binary = np.asarray(processed_img)
+                bands = [utils.encode_for_upload(binary[top:bottom], **upload)
+                         for top, bottom in tiling.plan_bands(binary, **tiling_settings()) or ()]
+                binary = None
+
+        if batched and (receipt_type is not None or bands):
+            # Not batched after all: batches must not keep waiting for this receipt
+            batched = False
+            scheduler.withdraw()
+
+        # Only the encoded upload is needed from here on; free the decoded images
+        # before waiting for the model
+        gray = processed_img = None
+        if reservation is not None:
+            reservation.release()
+
+        receipt_data = None
+        if bands:
+            # None when a band could not be read, the receipt is then extracted with a single request
+            receipt_data, tiled = tiling.extract_tiled(backend, payload, bands, receipt_type=receipt_type,
+                                                       timer=timer, on_event=on_event)
+            if tiled is not None:
+                tiled["payload_bytes"] = sum(len(band["data"]) for band in bands)
+                result["tiling"] = tiled
+        elif batched:
+            batched = False
+            receipt_data = scheduler.extract(payload, timer=timer, announced=True)
+        if receipt_data is None:
+            receipt_data = utils.extract_receipt_data(backend, payload, mode=mode, timer=timer,
+                                                      stream=streaming.event_stream(on_event) if on_event is not None else None,
+                                                      receipt_type=receipt_type)
+
+        # Ask again for missing or malformed fields only instead of re-running the receipt
+        failing = models.validate_receipt(receipt_data)
+        if failing:
+            receipt_data = utils.reask_fields(backend, payload, receipt_data, failing, timer=timer)
+        receipt = models.receipt_from_dict(receipt_data)
+        receipt_data = models.receipt_to_dict(receipt)
+
+        if cache is not None:
+            with timer.stage("cache_store"):
+                cache.put(cache_key, receipt_data)
+        if duplicate_index is not None:
+            with timer.stage("duplicate_store"):
+                duplicate_index.add(phash, receipt_data)
+
+        result.update({
+            "success": True,
+            "data": receipt_data,
+            "receipt": receipt,
+            "reasked_fields": failing,
+            "input_bytes": len(image_bytes),
+            "payload_bytes": len(payload["data"])
+        })
+        return result
+
+    except json.JSONDecodeError as e:
+        result["error"] = f"JSON parsing error: {str(e)}"
+        return result
+    except Exception as e:
+        result["error"] = f"Analysis error: {str(e)}"
+        return result
+    finally:
+        if batched:
+            scheduler.withdraw()
+        if reservation is not None:
+            reservation.release()
+        result["processing_time"] = time.time() - process_start_time
+        metrics.log_result(result, source=image if isinstance(image, str) else None)
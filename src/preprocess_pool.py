@@ -0,0 +1,187 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from PIL import Image
+import utils
+
+###################################################################
+# Worker Functions
+###################################################################
+
+def _to_shared(array):
+    """
+    Copy an array into a new shared memory block and return its descriptor.
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    descriptor = (shm.name, array.shape, array.dtype.str)
+    shm.close()
+    return descriptor
+
+def _from_shared(descriptor, unlink=False):
+    """
+    Copy an array out of a shared memory block described by _to_shared().
+    """
+    name, shape, dtype = descriptor
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return np.array(np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+def _release_shared(descriptor):
+    """
+    Unlink a shared memory block described by _to_shared().
+    """
+    shm = shared_memory.SharedMemory(name=descriptor[0])
+    shm.close()
+    shm.unlink()
+
+def _preprocess_worker(source, profile="full", max_side=utils.DECODE_MAX_SIDE):
+    """
+    Preprocess one image in a worker process. Pixel input arrives as a shared
+    memory descriptor; encoded bytes and paths are small enough to be sent as is
+    and are decoded here. The result is written to a new shared memory block
+    owned by the caller.
+    """
+    kind, value = source
+    if kind == "shm":
+        name, shape, dtype = value
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            img = utils.preprocess_image(np.ndarray(shape, dtype=dtype, buffer=shm.buf), profile)
+        finally:
+            shm.close()
+    else:
+        img = utils.preprocess_image(value, profile, max_side)
+
+    return _to_shared(np.asarray(img))
+
+###################################################################
+# Preprocess Executor
+###################################################################
+
+class PreprocessExecutor:
+    """
+    Process pool running utils.preprocess_image outside of the calling process.
+
+    Encoded images are decoded in the workers; decoded pixel data travels
+    through shared memory instead of being pickled.
+    submit() blocks once max_queue images are queued or running, so batch runs
+    cannot buffer an unbounded number of decoded images.
+
+    Args:
+        max_workers (int): number of worker processes, defaults to the CPU count
+        max_queue (int): maximum number of images queued or in progress, defaults to 2 per worker
+        start_method (str): multiprocessing start method ("spawn" is safe with threaded callers)
+    """
+
+    def __init__(self, max_workers=None, max_queue=None, start_method="spawn"):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max_queue or self.max_workers * 2
+        self.slots = threading.BoundedSemaphore(self.max_queue)
+
+        # Start the tracker first so workers share it and shared memory blocks are unlinked once
+        resource_tracker.ensure_running()
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context(start_method),
+        )
+
+    def submit(self, image, profile="full", max_side=utils.DECODE_MAX_SIDE):
+        """
+        Queue an image for preprocessing.
+
+        Args:
+            image: file path, raw bytes, PIL image or ndarray
+            profile (str): preprocessing profile (see utils.choose_profile)
+            max_side (int): smallest longest side to decode encoded images at
+
+        Returns:
+            concurrent.futures.Future: resolves to the preprocessed PIL image
+        """
+        self.slots.acquire()
+        input_shm = None
+        try:
+            if isinstance(image, (Image.Image, np.ndarray)):
+                input_shm = _to_shared(np.ascontiguousarray(image))
+                source = ("shm", input_shm)
+            elif isinstance(image, (bytearray, memoryview)):
+                source = ("data", bytes(image))
+            else:
+                source = ("data", image)
+            worker_future = self.pool.submit(_preprocess_worker, source, profile, max_side)
+        except BaseException:
+            self.slots.release()
+            if input_shm is not None:
+                _release_shared(input_shm)
+            raise
+
+        return self._wrap(worker_future, input_shm)
+
+    def _wrap(self, worker_future, input_shm):
+        future = Future()
+
+        def done(f):
+            self.slots.release()
+            try:
+                if input_shm is not None:
+                    _release_shared(input_shm)
+                if f.cancelled():
+                    future.cancel()
+                elif f.exception() is not None:
+                    future.set_exception(f.exception())
+                else:
+                    future.set_result(Image.fromarray(_from_shared(f.result(), unlink=True)))
+            except BaseException as e:
+                if not future.done():
+                    future.set_exception(e)
+
+        worker_future.add_done_callback(done)
+        return future
+
+    def preprocess(self, image, profile="full", max_side=utils.DECODE_MAX_SIDE):
+        """
+        Preprocess an image in the pool and wait for the result. Drop-in
+        replacement for utils.preprocess_image that releases the calling thread
+        (and the GIL) while the worker runs.
+        """
+        return self.submit(image, profile, max_side).result()
+
+    def shutdown(self, wait=True):
+        """
+        Stop the worker processes; queued images that did not start are cancelled.
+        """
+        self.pool.shutdown(wait=wait, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+###################################################################
+# Executor Factory
+###################################################################
+
+def create_executor():
+    """
+    Create the preprocessing pool configured by the environment.
+
+    Environment variables:
+        PREPROCESS_WORKERS: number of worker processes, 0 (default) preprocesses in the calling thread
+        PREPROCESS_QUEUE: maximum number of queued images
+
+    Returns:
+        PreprocessExecutor: executor or None when disabled
+    """
+    workers = int(os.getenv("PREPROCESS_WORKERS", "0"))
+    if workers <= 0:
+        return None
+    queue = os.getenv("PREPROCESS_QUEUE")
+    return PreprocessExecutor(max_workers=workers, max_queue=int(queue) if queue else None)
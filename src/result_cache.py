@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import utils
+
+###################################################################
+# Cache Keys
+###################################################################
+
+def prompt_version():
+    """
+    Digest of every prompt that shapes an extraction result. Editing
+    TYPE_DETERMINATION_PROMPT, PROMPTS, ONE_SHOT_PROMPT or the tiled
+    extraction prompts changes the version and therefore invalidates the
+    cached results.
+
+    Returns:
+        str: short hex digest
+    """
+    digest = hashlib.sha256()
+    digest.update(utils.TYPE_DETERMINATION_PROMPT.encode("utf-8"))
+    digest.update(utils.ONE_SHOT_PROMPT.encode("utf-8"))
+    digest.update(utils.TILE_SUMMARY_PROMPT.encode("utf-8"))
+    digest.update(utils.TILE_ITEMS_PROMPT.encode("utf-8"))
+    for receipt_type in sorted(utils.PROMPTS):
+        digest.update(receipt_type.encode("utf-8"))
+        digest.update(utils.PROMPTS[receipt_type].encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+def image_digest(image_bytes):
+    """
+    SHA-256 hex digest identifying a raw image.
+    """
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def make_key(image_bytes, model_name, digest=None):
+    """
+    Content-addressed cache key of a raw image.
+
+    Args:
+        image_bytes (bytes): raw uploaded image bytes
+        model_name (str): name of the model producing the result
+        digest (str): image_digest() of the bytes when it is already known
+
+    Returns:
+        str: cache key
+    """
+    return f"{digest or image_digest(image_bytes)}:{prompt_version()}:{model_name}"
+
+###################################################################
+# Result Cache
+###################################################################
+
+class ResultCache:
+    """
+    Disk-backed (SQLite) cache of parsed extraction results with LRU eviction.
+    The cache can be shared by processes running different prompt versions.
+
+    Args:
+        path (str): SQLite database file
+        max_entries (int): maximum number of cached results
+        max_bytes (int): maximum total size of the cached JSON
+        ttl (float): seconds after which an entry expires, None to keep entries until evicted
+    """
+
+    def __init__(self, path, max_entries=10000, max_bytes=64 * 1024 * 1024, ttl=None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                receipt_type TEXT,
+                data TEXT,
+                size INTEGER,
+                prompt_version TEXT,
+                created_at REAL,
+                accessed_at REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_results_accessed_at ON results (accessed_at)")
+        # Entries of other prompt versions are not hit by this process (the version is part of the key)
+        # but are kept for processes still running them; they age out through the TTL and LRU eviction
+        self.conn.commit()
+
+    def get(self, key):
+        """
+        Look up a cached result.
+
+        Args:
+            key (str): cache key from make_key()
+
+        Returns:
+            dict: {"type": ..., "data": ...} or None on a miss
+        """
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT receipt_type, data, created_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is not None and self.ttl is not None and now - row[2] > self.ttl:
+                self.conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self.conn.commit()
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+
+        return {"type": row[0], "data": json.loads(row[1])}
+
+    def put(self, key, receipt_data):
+        """
+        Store a parsed result and evict the least recently used entries
+        when the size limits are exceeded.
+
+        Args:
+            key (str): cache key from make_key()
+            receipt_data (dict): parsed receipt data
+        """
+        data = json.dumps(receipt_data, ensure_ascii=False)
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, receipt_data.get("type"), data, len(data.encode("utf-8")), prompt_version(), now, now),
+            )
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        if self.ttl is not None:
+            self.conn.execute("DELETE FROM results WHERE created_at < ?", (time.time() - self.ttl,))
+
+        entries, total_bytes = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        if entries <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+
+        # Walk from the least recently used entry until both limits hold again
+        evict_keys = []
+        for key, size in self.conn.execute("SELECT key, size FROM results ORDER BY accessed_at"):
+            if entries <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            evict_keys.append((key,))
+            entries -= 1
+            total_bytes -= size
+        self.conn.executemany("DELETE FROM results WHERE key = ?", evict_keys)
+
+    def stats(self):
+        """
+        Return the hit/miss counters and the current cache size.
+        """
+        with self.lock:
+            entries, total_bytes = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": total_bytes,
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+###################################################################
+# Cache Factory
+###################################################################
+
+def create_cache():
+    """
+    Create the result cache configured by the environment.
+
+    Environment variables:
+        RESULT_CACHE_PATH: SQLite file (default .cache/results.sqlite3), empty to disable the cache
+        RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL: eviction limits
+
+    Returns:
+        ResultCache: cache instance or None when disabled
+    """
+    path = os.getenv("RESULT_CACHE_PATH", os.path.join(".cache", "results.sqlite3"))
+    if not path:
+        return None
+
+    ttl = os.getenv("RESULT_CACHE_TTL")
+    return ResultCache(
+        path,
+        max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000")),
+        max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+        ttl=float(ttl) if ttl else None,
+    )
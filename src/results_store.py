@@ -0,0 +1,545 @@
+import argparse
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import utils
+
+###################################################################
+# Field Normalization
+###################################################################
+
+DATE_PATTERN = re.compile(r'(\d{1,2})\s*[./-]\s*(\d{1,2})\s*[./-]\s*(\d{4}|\d{2})')
+ISO_DATE_PATTERN = re.compile(r'(\d{4})-(\d{2})-(\d{2})')
+
+def normalize_date(value):
+    """
+    Convert a receipt date (DD.MM.YYYY, DD/MM/YYYY, DD-MM-YY or ISO) to YYYY-MM-DD.
+
+    Returns:
+        str: ISO date or None when the value is not a valid date
+    """
+    if not isinstance(value, str):
+        return None
+    match = ISO_DATE_PATTERN.search(value)
+    if match:
+        year, month, day = (int(part) for part in match.groups())
+    else:
+        match = DATE_PATTERN.search(value)
+        if not match:
+            return None
+        day, month, year = (int(part) for part in match.groups())
+        if year < 100:
+            year += 2000
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        return None
+    return f"{year:04d}-{month:02d}-{day:02d}"
+
+def normalize_plate(value):
+    """
+    Canonical license plate: upper case without spaces or dashes ("34 abc 146" -> "34ABC146").
+    """
+    if not isinstance(value, str):
+        return None
+    plate = re.sub(r'[\s-]+', '', value).upper()
+    return plate or None
+
+def _clean_text(value):
+    return (value.strip() or None) if isinstance(value, str) else None
+
+def _number(value):
+    return None if math.isnan(value) else float(value)
+
+###################################################################
+# Results Store
+###################################################################
+
+# Rollup tables and the receipt columns they are grouped by. Aggregates are
+# answered from the first rollup holding every grouping and filter column.
+ROLLUPS = {
+    "monthly_totals": ("month", "receipt_type", "license_plate"),
+    "business_totals": ("month", "business_name", "receipt_type"),
+}
+GROUP_COLUMNS = ("month", "receipt_type", "license_plate", "business_name")
+
+class ResultsStore:
+    """
+    SQLite store of every extracted receipt for reporting.
+
+    Each receipt is a row with its normalized fields (ISO date, month,
+    canonical license plate, amounts as numbers, VAT amount included in the
+    total) next to the full JSON; MARKET items are child rows. Receipts are
+    indexed by date, business name, type and license plate, and images
+    already stored (same SHA-256) are skipped, so re-running a batch does not
+    count a receipt twice.
+
+    Aggregates are served from rollup tables (monthly totals per type and
+    plate, and per business) that are updated in the same transaction as
+    the inserts, so their cost depends on the number of groups rather than
+    the number of receipts.
+
+    Args:
+        path (str): SQLite database file
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS receipts (
+                id INTEGER PRIMARY KEY,
+                image_digest TEXT UNIQUE,
+                source TEXT,
+                model_name TEXT,
+                receipt_type TEXT,
+                business_name TEXT,
+                date TEXT,
+                receipt_date TEXT,
+                month TEXT,
+                license_plate TEXT,
+                total_amount REAL,
+                vat_percentage REAL,
+                vat_amount REAL,
+                data TEXT,
+                created_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_receipts_date ON receipts (receipt_date);
+            CREATE INDEX IF NOT EXISTS idx_receipts_business ON receipts (business_name, receipt_date);
+            CREATE INDEX IF NOT EXISTS idx_receipts_type ON receipts (receipt_type, receipt_date);
+            CREATE INDEX IF NOT EXISTS idx_receipts_plate ON receipts (license_plate, receipt_date);
+
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY,
+                receipt_id INTEGER NOT NULL REFERENCES receipts (id) ON DELETE CASCADE,
+                position INTEGER,
+                name TEXT,
+                price REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_items_receipt ON items (receipt_id);
+            CREATE INDEX IF NOT EXISTS idx_items_name ON items (name);
+
+            CREATE TABLE IF NOT EXISTS monthly_totals (
+                month TEXT,
+                receipt_type TEXT,
+                license_plate TEXT,
+                receipts INTEGER,
+                total_amount REAL,
+                vat_amount REAL,
+                PRIMARY KEY (month, receipt_type, license_plate)
+            ) WITHOUT ROWID;
+            -- Covering indexes: rollup queries never touch the table itself
+            CREATE INDEX IF NOT EXISTS idx_monthly_totals_plate
+                ON monthly_totals (license_plate, month, receipt_type, receipts, total_amount, vat_amount);
+            CREATE INDEX IF NOT EXISTS idx_monthly_totals_type
+                ON monthly_totals (receipt_type, license_plate, month, receipts, total_amount, vat_amount);
+
+            CREATE TABLE IF NOT EXISTS business_totals (
+                month TEXT,
+                business_name TEXT,
+                receipt_type TEXT,
+                receipts INTEGER,
+                total_amount REAL,
+                vat_amount REAL,
+                PRIMARY KEY (month, business_name, receipt_type)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_business_totals_name
+                ON business_totals (business_name, month, receipt_type, receipts, total_amount, vat_amount);
+        """)
+        self.conn.commit()
+
+    def add(self, receipt_data, source=None, image_digest=None, model_name=None):
+        """
+        Store one extracted receipt.
+
+        Returns:
+            int: receipt id, or None when the image was already stored
+        """
+        ids = self.add_many([{"data": receipt_data, "source": source, "image_digest": image_digest,
+                              "model_name": model_name}])
+        return ids[0]
+
+    def add_many(self, records):
+        """
+        Store many receipts in one transaction. The monetary columns of the
+        whole batch are normalized at once with utils.receipt_amount_columns().
+
+        Args:
+            records (iterable): dicts with "data" (receipt dict) and optional
+                "source", "image_digest" and "model_name"
+
+        Returns:
+            list: receipt id per record, None for images that were already stored
+        """
+        records = list(records)
+        datas = [record["data"] for record in records]
+        columns = utils.receipt_amount_columns(datas)
+        totals, _ = columns["total_amount"]
+        vats, _ = columns["vat_percentage"]
+        prices, _ = columns["item_price"]
+        item_names = columns["item_name"]
+        item_receipts = columns["item_receipt"].tolist()
+        item_positions = columns["item_position"].tolist()
+
+        now = time.time()
+        rows = []
+        for index, (record, data) in enumerate(zip(records, datas)):
+            receipt_date = normalize_date(data.get("date"))
+            total, vat = _number(totals[index]), _number(vats[index])
+            rows.append((
+                record.get("image_digest"),
+                record.get("source"),
+                record.get("model_name"),
+                data.get("type"),
+                _clean_text(data.get("business_name")),
+                data.get("date"),
+                receipt_date,
+                receipt_date[:7] if receipt_date else None,
+                normalize_plate(data.get("license_plate")),
+                total,
+                vat,
+                # Turkish receipt totals include VAT
+                total * vat / (100 + vat) if total is not None and vat is not None else None,
+                json.dumps(data, ensure_ascii=False),
+                now,
+            ))
+
+        with self.lock:
+            try:
+                ids = []
+                for row in rows:
+                    cursor = self.conn.execute("""
+                        INSERT OR IGNORE INTO receipts (image_digest, source, model_name, receipt_type,
+                            business_name, date, receipt_date, month, license_plate, total_amount,
+                            vat_percentage, vat_amount, data, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, row)
+                    ids.append(cursor.lastrowid if cursor.rowcount == 1 else None)
+
+                items = [
+                    (ids[receipt_index], position, _clean_text(name), _number(price))
+                    for receipt_index, position, name, price in zip(item_receipts, item_positions, item_names, prices)
+                    if ids[receipt_index] is not None
+                ]
+                self.conn.executemany("INSERT INTO items (receipt_id, position, name, price) VALUES (?, ?, ?, ?)",
+                                      items)
+
+                self._update_rollups([row for row, receipt_id in zip(rows, ids) if receipt_id is not None])
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+        return ids
+
+    def _update_rollups(self, rows):
+        # Sum the batch per group first so every group is written once
+        sums = {name: {} for name in ROLLUPS}
+        for row in rows:
+            values = {"receipt_type": row[3] or "", "business_name": row[4] or "", "month": row[7] or "",
+                      "license_plate": row[8] or ""}
+            for name, keys in ROLLUPS.items():
+                key = tuple(values[column] for column in keys)
+                group = sums[name].setdefault(key, [0, 0.0, 0.0])
+                group[0] += 1
+                group[1] += row[9] or 0.0
+                group[2] += row[11] or 0.0
+
+        for name, keys in ROLLUPS.items():
+            self.conn.executemany(f"""
+                INSERT INTO {name} ({", ".join(keys)}, receipts, total_amount, vat_amount)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT ({", ".join(keys)}) DO UPDATE SET
+                    receipts = receipts + excluded.receipts,
+                    total_amount = total_amount + excluded.total_amount,
+                    vat_amount = vat_amount + excluded.vat_amount
+            """, [key + tuple(group) for key, group in sums[name].items()])
+
+    def rebuild_rollups(self):
+        """
+        Recompute the rollup tables from the receipts (e.g. after editing receipts by hand).
+        """
+        with self.lock:
+            for name, keys in ROLLUPS.items():
+                groups = ", ".join(f"COALESCE({column}, '')" for column in keys)
+                self.conn.execute(f"DELETE FROM {name}")
+                self.conn.execute(f"""
+                    INSERT INTO {name} ({", ".join(keys)}, receipts, total_amount, vat_amount)
+                    SELECT {groups}, COUNT(*), COALESCE(SUM(total_amount), 0), COALESCE(SUM(vat_amount), 0)
+                    FROM receipts GROUP BY {groups}
+                """)
+            self.conn.commit()
+
+    def aggregate(self, by=("month",), receipt_type=None, license_plate=None, business_name=None,
+                  month_from=None, month_to=None):
+        """
+        Receipt count, spend and VAT grouped by any of GROUP_COLUMNS.
+
+        Args:
+            by (tuple): grouping columns, e.g. ("license_plate", "month")
+            receipt_type (str): only receipts of this type
+            license_plate (str): only receipts of this plate
+            business_name (str): only receipts of this business
+            month_from (str): first month (YYYY-MM), inclusive
+            month_to (str): last month (YYYY-MM), inclusive
+
+        Returns:
+            list: dicts with the grouping columns, "receipts", "total_amount" and "vat_amount"
+        """
+        unknown = set(by) - set(GROUP_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown grouping column: {', '.join(sorted(unknown))}")
+
+        filters = {"receipt_type": receipt_type, "license_plate": normalize_plate(license_plate),
+                   "business_name": business_name}
+        conditions, params = [], []
+        for column, value in filters.items():
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if month_from:
+            conditions.append("month >= ?")
+            params.append(month_from)
+        if month_to:
+            conditions.append("month <= ?")
+            params.append(month_to)
+
+        needed = set(by) | {column for column, value in filters.items() if value is not None}
+        if month_from or month_to:
+            needed.add("month")
+        table = next((name for name, keys in ROLLUPS.items() if needed <= set(keys)), None)
+        if table is not None:
+            columns = [column for column in by]
+            measures = "SUM(receipts), SUM(total_amount), SUM(vat_amount)"
+        else:
+            # Groupings no rollup covers scan the (indexed) receipts
+            table = "receipts"
+            columns = [f"COALESCE({column}, '')" for column in by]
+            measures = "COUNT(*), COALESCE(SUM(total_amount), 0), COALESCE(SUM(vat_amount), 0)"
+
+        sql = f"SELECT {', '.join(columns + [measures])} FROM {table}"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        if by:
+            sql += f" GROUP BY {', '.join(columns)} ORDER BY {', '.join(columns)}"
+
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [
+            dict(zip(by, row[:len(by)]), receipts=row[-3], total_amount=round(row[-2], 2),
+                 vat_amount=round(row[-1], 2))
+            for row in rows if row[-3]
+        ]
+
+    def spend_per_plate(self, month_from=None, month_to=None, license_plate=None):
+        """
+        Fuel spend per license plate and month.
+        """
+        rows = self.aggregate(("license_plate", "month"), receipt_type="FUEL", license_plate=license_plate,
+                              month_from=month_from, month_to=month_to)
+        return [row for row in rows if row["license_plate"]]
+
+    def vat_per_type(self, month_from=None, month_to=None):
+        """
+        VAT and spend totals per receipt type.
+        """
+        return self.aggregate(("receipt_type",), month_from=month_from, month_to=month_to)
+
+    def find(self, receipt_type=None, license_plate=None, business_name=None, date_from=None, date_to=None,
+             limit=100):
+        """
+        Stored receipts matching the filters, newest first.
+
+        Args:
+            date_from (str): first date (YYYY-MM-DD), inclusive
+            date_to (str): last date (YYYY-MM-DD), inclusive
+            limit (int): maximum number of receipts
+
+        Returns:
+            list: dicts with "id", "source", the receipt "data" and its MARKET "items" rows
+        """
+        conditions, params = [], []
+        for column, value in (("receipt_type", receipt_type), ("license_plate", normalize_plate(license_plate)),
+                              ("business_name", business_name)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if date_from:
+            conditions.append("receipt_date >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("receipt_date <= ?")
+            params.append(date_to)
+
+        sql = "SELECT id, source, data FROM receipts"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY receipt_date DESC, id DESC LIMIT ?"
+        with self.lock:
+            rows = self.conn.execute(sql, params + [limit]).fetchall()
+            items = {}
+            if rows:
+                placeholders = ", ".join("?" * len(rows))
+                for receipt_id, name, price in self.conn.execute(
+                    f"SELECT receipt_id, name, price FROM items WHERE receipt_id IN ({placeholders}) "
+                    "ORDER BY receipt_id, position", [row[0] for row in rows]
+                ):
+                    items.setdefault(receipt_id, []).append({"name": name, "price": price})
+        return [{"id": row[0], "source": row[1], "data": json.loads(row[2]), "items": items.get(row[0], [])}
+                for row in rows]
+
+    def stats(self):
+        """
+        Return the number of stored receipts and items.
+        """
+        with self.lock:
+            receipts = self.conn.execute("SELECT COUNT(*) FROM receipts").fetchone()[0]
+            items = self.conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        return {"receipts": receipts, "items": items}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+###################################################################
+# Store Factory
+###################################################################
+
+def create_store():
+    """
+    Open the results store configured by the environment.
+
+    Environment variables:
+        RESULTS_STORE_PATH: SQLite file, unset or empty (default) to disable the store
+
+    Returns:
+        ResultsStore: store or None when disabled
+    """
+    path = os.getenv("RESULTS_STORE_PATH")
+    if not path:
+        return None
+    return ResultsStore(path)
+
+###################################################################
+# Command Line Interface
+###################################################################
+
+def import_jsonl(store, paths, chunk_size=1000):
+    """
+    Import the successful rows of batch JSONL output files.
+
+    Returns:
+        tuple: (imported, skipped as already stored)
+    """
+    imported = skipped = 0
+    chunk = []
+
+    def flush():
+        nonlocal imported, skipped
+        ids = store.add_many(chunk)
+        imported += sum(receipt_id is not None for receipt_id in ids)
+        skipped += sum(receipt_id is None for receipt_id in ids)
+        chunk.clear()
+
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                if row.get("success") and row.get("data"):
+                    chunk.append({"data": row["data"], "source": row.get("file"),
+                                  "image_digest": row.get("image_digest")})
+                if len(chunk) >= chunk_size:
+                    flush()
+    if chunk:
+        flush()
+    return imported, skipped
+
+def print_rows(rows):
+    if not rows:
+        print("No receipts")
+        return
+    columns = list(rows[0])
+    widths = {column: max(len(column), *(len(str(row[column])) for row in rows)) for column in columns}
+    print("  ".join(column.rjust(widths[column]) for column in columns))
+    for row in rows:
+        print("  ".join(str(row[column]).rjust(widths[column]) for column in columns))
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the stored receipt results.")
+    parser.add_argument("--db", default=os.getenv("RESULTS_STORE_PATH"),
+                        help="results store SQLite file (default RESULTS_STORE_PATH)")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("import", help="import batch JSONL output")
+    command.add_argument("inputs", nargs="+", help="JSONL files written by test_app.py --output")
+
+    for name, help_text in (("plates", "fuel spend per license plate and month"),
+                            ("vat", "VAT and spend totals per receipt type"),
+                            ("aggregate", "spend and VAT grouped by the --by columns")):
+        command = commands.add_parser(name, help=help_text)
+        if name == "aggregate":
+            command.add_argument("--by", nargs="+", choices=GROUP_COLUMNS, default=["month"])
+            command.add_argument("--type", dest="receipt_type")
+            command.add_argument("--business")
+        command.add_argument("--plate")
+        command.add_argument("--from", dest="month_from", help="first month, YYYY-MM")
+        command.add_argument("--to", dest="month_to", help="last month, YYYY-MM")
+
+    command = commands.add_parser("receipts", help="list stored receipts")
+    command.add_argument("--type", dest="receipt_type")
+    command.add_argument("--plate")
+    command.add_argument("--business")
+    command.add_argument("--from", dest="date_from", help="first date, YYYY-MM-DD")
+    command.add_argument("--to", dest="date_to", help="last date, YYYY-MM-DD")
+    command.add_argument("--limit", type=int, default=20)
+
+    command = commands.add_parser("rebuild", help="recompute the aggregate tables")
+    args = parser.parse_args()
+    if not args.db:
+        parser.error("no results store given, pass --db or set RESULTS_STORE_PATH")
+
+    store = ResultsStore(args.db)
+    start = time.perf_counter()
+    if args.command == "import":
+        imported, skipped = import_jsonl(store, args.inputs)
+        print(f"Imported {imported} receipts ({skipped} already stored) in {time.perf_counter() - start:.2f}s")
+        return
+    if args.command == "rebuild":
+        store.rebuild_rollups()
+        print(f"Rebuilt the aggregate tables in {time.perf_counter() - start:.2f}s")
+        return
+
+    if args.command == "plates":
+        rows = store.spend_per_plate(args.month_from, args.month_to, args.plate)
+    elif args.command == "vat":
+        rows = store.vat_per_type(args.month_from, args.month_to)
+    elif args.command == "aggregate":
+        rows = store.aggregate(tuple(args.by), receipt_type=args.receipt_type, license_plate=args.plate,
+                               business_name=args.business, month_from=args.month_from, month_to=args.month_to)
+    else:
+        rows = store.find(args.receipt_type, args.plate, args.business, args.date_from, args.date_to, args.limit)
+        if not args.json:
+            rows = [{"id": row["id"], "date": row["data"].get("date"), "type": row["data"].get("type"),
+                     "business_name": row["data"].get("business_name"),
+                     "total_amount": row["data"].get("total_amount"), "items": len(row["items"])}
+                    for row in rows]
+    elapsed = time.perf_counter() - start
+
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+    else:
+        print_rows(rows)
+        print(f"({len(rows)} rows in {elapsed * 1000:.1f} ms)")
+
+if __name__ == "__main__":
+    main()
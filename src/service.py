@@ -0,0 +1,516 @@
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import signal
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+from dotenv import load_dotenv
+import backends
+import batching
+import classifier
+import daemon_socket
+import duplicate_index
+import memory_budget
+import metrics
+import pipeline
+import preprocess_pool
+import result_cache
+import results_store
+import throttle
+import utils
+
+logger = logging.getLogger("receipt_extractor.service")
+
+###################################################################
+# HTTP Protocol
+###################################################################
+
+HTTP_REASONS = {
+    200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    411: "Length Required", 413: "Payload Too Large", 422: "Unprocessable Entity",
+    429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+class HTTPError(Exception):
+    """
+    Error answered with an HTTP status code and a JSON body.
+
+    Args:
+        status_code (int): HTTP status code
+        message (str): error description
+        headers (dict): extra response headers (e.g. Retry-After)
+    """
+
+    def __init__(self, status_code, message, headers=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.headers = headers or {}
+
+async def read_request(reader, max_body):
+    """
+    Read one HTTP/1.1 request from a stream.
+
+    Returns:
+        tuple: (method, path, query dict, headers dict, body) or None when the client closed the connection
+    """
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    try:
+        method, target, _ = request_line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        raise HTTPError(411, "Chunked requests are not supported, send Content-Length")
+    length = int(headers.get("content-length") or 0)
+    if length > max_body:
+        raise HTTPError(413, f"Request body exceeds {max_body} bytes")
+    body = await reader.readexactly(length) if length else b""
+
+    url = urlsplit(target)
+    query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+    return method.upper(), url.path, query, headers, body
+
+def write_response(writer, status_code, body, content_type="application/json", headers=None, keep_alive=True):
+    """
+    Write an HTTP/1.1 response; dict bodies are sent as JSON.
+    """
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body, ensure_ascii=False)
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+
+    lines = [
+        f"HTTP/1.1 {status_code} {HTTP_REASONS.get(status_code, 'Unknown')}",
+        f"Content-Type: {content_type}",
+        f"Content-Length: {len(body)}",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+    ]
+    lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+
+###################################################################
+# Jobs
+###################################################################
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+class Job:
+    """
+    A receipt submitted to the service.
+
+    Args:
+        image_bytes (bytes): raw image
+        mode (str): one of utils.EXTRACTION_MODES
+        source (str): optional file name of the receipt, recorded in the results store
+    """
+
+    def __init__(self, image_bytes, mode, source=None):
+        self.id = uuid.uuid4().hex
+        self.image_bytes = image_bytes
+        self.mode = mode
+        self.source = source
+        self.status = JOB_QUEUED
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.result = None
+        self.done = asyncio.get_running_loop().create_future()
+
+    def to_dict(self):
+        job = {"id": self.id, "status": self.status, "submitted_at": self.submitted_at}
+        if self.result is not None:
+            job["result"] = result_to_dict(self.result)
+        return job
+
+def result_to_dict(result):
+    """
+    JSON-serializable view of a pipeline result (without the image and model objects).
+    """
+    keys = ("success", "data", "error", "processing_time", "cached", "image_digest", "input_bytes",
+            "payload_bytes", "reasked_fields", "classification", "duplicate", "crop", "preprocess", "tiling", "stages")
+    return {key: result[key] for key in keys if key in result}
+
+###################################################################
+# Extraction Service
+###################################################################
+
+class ExtractionService:
+    """
+    Asyncio HTTP service running the receipt pipeline.
+
+    Requests are queued in a bounded queue and processed by a fixed number of
+    workers. Each worker runs pipeline.process_receipt in a thread pool, so the
+    CPU-bound preprocessing and the blocking model calls never run on the
+    event loop. When the queue is full new receipts are rejected with 429 and
+    a Retry-After header instead of piling up. On shutdown the server stops
+    accepting connections, rejects new receipts with 503 and finishes the
+    queued ones before exiting.
+
+    The service listens on TCP or, as a local worker daemon keeping the
+    models and clients warm for short-lived callers (see client.py), on a
+    Unix domain socket.
+
+    Endpoints:
+        POST /extract: raw image body, waits for the result (200, or 422 when extraction failed)
+        POST /jobs: raw image body, returns a job id to poll (202)
+        (both accept ?mode= and ?source=, the file name recorded in the results store)
+        GET /jobs/<id>: job status and result
+        GET /healthz: liveness and queue state
+        GET /metrics: Prometheus metrics
+
+    Args:
+        backend (backends.ModelBackend): model backend
+        mode (str): default extraction mode, overridable with ?mode=
+        cache (result_cache.ResultCache): optional result cache
+        type_classifier (classifier.ReceiptTypeClassifier): optional local type classifier
+        scheduler (batching.BatchingScheduler): optional scheduler batching the model requests
+        duplicates (duplicate_index.DuplicateIndex): optional index reusing results of near-duplicate photos
+        store (results_store.ResultsStore): optional store receiving every extracted receipt
+        memory (memory_budget.MemoryBudget): optional budget queuing receipts whose decoded images do not fit
+        preprocess (callable): preprocessing function, e.g. PreprocessExecutor.preprocess
+        workers (int): receipts processed at the same time
+        max_queue (int): receipts waiting for a worker before requests are rejected
+        job_ttl (float): seconds finished jobs stay available for polling
+        max_body (int): maximum request body size in bytes
+    """
+
+    def __init__(self, backend, mode=utils.EXTRACTION_MODE_ONE_SHOT, cache=None, type_classifier=None,
+                 preprocess=utils.preprocess_image, workers=4, max_queue=32, job_ttl=600,
+                 max_body=10 * 1024 * 1024, scheduler=None, duplicates=None, store=None,
+                 memory=None):
+        self.backend = backend
+        self.mode = mode
+        self.cache = cache
+        self.type_classifier = type_classifier
+        self.preprocess = preprocess
+        self.scheduler = scheduler
+        self.duplicates = duplicates
+        self.store = store
+        self.memory = memory
+        self.workers = workers
+        self.max_queue = max_queue
+        self.job_ttl = job_ttl
+        self.max_body = max_body
+
+        self.jobs = {}
+        self.queue = None
+        self.running = 0
+        self.rejected = 0
+        self.draining = False
+        self.server = None
+        self.worker_tasks = []
+        self.connections = set()
+        self.active_requests = 0
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extract")
+
+    async def start(self, host="127.0.0.1", port=8080, unix_socket=None):
+        """
+        Start the workers and listen for connections, on unix_socket instead
+        of host and port when given (only the current user may connect).
+
+        Raises:
+            daemon_socket.SocketInUse: another daemon listens on unix_socket
+        """
+        if unix_socket:
+            daemon_socket.remove_stale_socket(unix_socket)
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if unix_socket:
+            directory = os.path.dirname(unix_socket)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Created with owner-only permissions, there is no window in which others may connect
+            umask = os.umask(0o077)
+            try:
+                self.server = await asyncio.start_unix_server(self._handle_connection, path=unix_socket)
+            finally:
+                os.umask(umask)
+        else:
+            self.server = await asyncio.start_server(self._handle_connection, host, port)
+        return self.server
+
+    async def drain(self, timeout=30.0):
+        """
+        Stop accepting work and wait (up to timeout seconds) for queued and running receipts.
+        """
+        self.draining = True
+        if self.server is not None:
+            self.server.close()
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Drain timed out with %d receipts queued", self.queue.qsize())
+
+        for task in self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        # Let clients waiting on /extract receive their responses, then drop idle keep-alive connections
+        deadline = time.monotonic() + 5.0
+        while self.active_requests and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for task in list(self.connections):
+            task.cancel()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        self.executor.shutdown(wait=True)
+
+    def submit(self, image_bytes, mode=None, source=None):
+        """
+        Queue a receipt.
+
+        Returns:
+            Job: the queued job
+
+        Raises:
+            HTTPError: 503 while draining, 429 when the queue is full
+        """
+        if self.draining:
+            raise HTTPError(503, "Service is shutting down")
+        mode = mode or self.mode
+        if mode not in utils.EXTRACTION_MODES:
+            raise HTTPError(400, f"Unknown extraction mode: {mode}")
+        if not image_bytes:
+            raise HTTPError(400, "Request body must contain the receipt image")
+
+        self._expire_jobs()
+        job = Job(image_bytes, mode, source)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise HTTPError(429, "Too many receipts queued, retry later", {"Retry-After": "1"})
+        self.jobs[job.id] = job
+        return job
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            job.status = JOB_RUNNING
+            self.running += 1
+            try:
+                process = functools.partial(
+                    pipeline.process_receipt, job.image_bytes, self.backend, job.mode, self.cache,
+                    preprocess=self.preprocess, classifier=self.type_classifier, scheduler=self.scheduler,
+                    duplicate_index=self.duplicates, memory=self.memory,
+                )
+                job.result = await loop.run_in_executor(self.executor, process)
+                if job.result["success"] and self.store is not None:
+                    store = functools.partial(self.store.add, job.result["data"], source=job.source or job.id,
+                                              image_digest=job.result["image_digest"],
+                                              model_name=self.backend.model_name)
+                    await loop.run_in_executor(self.executor, store)
+                job.status = JOB_DONE if job.result["success"] else JOB_FAILED
+            except Exception as e:
+                job.result = {"success": False, "error": f"Analysis error: {str(e)}"}
+                job.status = JOB_FAILED
+            finally:
+                # The image is no longer needed once processed
+                job.image_bytes = None
+                job.finished_at = time.time()
+                self.running -= 1
+                if not job.done.done():
+                    job.done.set_result(job)
+                self.queue.task_done()
+
+    def _expire_jobs(self):
+        cutoff = time.time() - self.job_ttl
+        expired = [job_id for job_id, job in self.jobs.items() if job.finished_at and job.finished_at < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    async def _handle_connection(self, reader, writer):
+        self.connections.add(asyncio.current_task())
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, self.max_body)
+                except HTTPError as e:
+                    write_response(writer, e.status_code, {"error": str(e)}, headers=e.headers, keep_alive=False)
+                    await writer.drain()
+                    break
+                except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+                    break
+                if request is None:
+                    break
+
+                method, path, query, headers, body = request
+                self.active_requests += 1
+                try:
+                    try:
+                        status_code, response, content_type, extra_headers = await self._route(method, path, query, body)
+                    except HTTPError as e:
+                        status_code, response, content_type, extra_headers = e.status_code, {"error": str(e)}, "application/json", e.headers
+                    except Exception as e:
+                        logger.exception("Request failed")
+                        status_code, response, content_type, extra_headers = 500, {"error": str(e)}, "application/json", {}
+
+                    keep_alive = headers.get("connection", "").lower() != "close" and not self.draining
+                    write_response(writer, status_code, response, content_type, extra_headers, keep_alive)
+                    await writer.drain()
+                finally:
+                    self.active_requests -= 1
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.connections.discard(asyncio.current_task())
+            writer.close()
+
+    async def _route(self, method, path, query, body):
+        json_type = "application/json"
+
+        if path == "/extract":
+            if method != "POST":
+                raise HTTPError(405, "Use POST")
+            job = self.submit(body, query.get("mode"), query.get("source"))
+            await job.done
+            self.jobs.pop(job.id, None)
+            return (200 if job.result["success"] else 422), result_to_dict(job.result), json_type, {}
+
+        if path == "/jobs":
+            if method != "POST":
+                raise HTTPError(405, "Use POST")
+            job = self.submit(body, query.get("mode"), query.get("source"))
+            return 202, {"id": job.id, "status": job.status}, json_type, {"Location": f"/jobs/{job.id}"}
+
+        if path.startswith("/jobs/"):
+            if method != "GET":
+                raise HTTPError(405, "Use GET")
+            job = self.jobs.get(path[len("/jobs/"):])
+            if job is None:
+                raise HTTPError(404, "Unknown or expired job")
+            return 200, job.to_dict(), json_type, {}
+
+        if path == "/healthz":
+            return (503 if self.draining else 200), self.health(), json_type, {}
+
+        if path == "/metrics":
+            return 200, self.render_metrics(), "text/plain; version=0.0.4", {}
+
+        raise HTTPError(404, f"Unknown path: {path}")
+
+    def health(self):
+        return {
+            "status": "draining" if self.draining else "ok",
+            "queued": self.queue.qsize(),
+            "running": self.running,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "duplicates": self.duplicates.stats() if self.duplicates is not None else None,
+            "memory": self.memory.stats() if self.memory is not None else None,
+            "model": self.backend.stats() if isinstance(self.backend, throttle.ThrottledBackend) else None,
+        }
+
+    def render_metrics(self):
+        lines = [
+            "# HELP receipt_service_queue_depth Receipts waiting for a worker.",
+            "# TYPE receipt_service_queue_depth gauge",
+            f"receipt_service_queue_depth {self.queue.qsize()}",
+            "# HELP receipt_service_running Receipts being processed.",
+            "# TYPE receipt_service_running gauge",
+            f"receipt_service_running {self.running}",
+            "# HELP receipt_service_rejected_total Receipts rejected because the queue was full.",
+            "# TYPE receipt_service_rejected_total counter",
+            f"receipt_service_rejected_total {self.rejected}",
+        ]
+        if self.memory is not None:
+            memory = self.memory.stats()
+            lines += [
+                "# HELP receipt_service_image_memory_reserved_bytes Decoded image memory reserved from the budget.",
+                "# TYPE receipt_service_image_memory_reserved_bytes gauge",
+                f"receipt_service_image_memory_reserved_bytes {memory['reserved_bytes']}",
+                "# HELP receipt_service_image_memory_queued Receipts waiting for image memory.",
+                "# TYPE receipt_service_image_memory_queued gauge",
+                f"receipt_service_image_memory_queued {memory['queued']}",
+            ]
+        text = metrics.REGISTRY.render_prometheus() + "\n".join(lines) + "\n"
+        if isinstance(self.backend, throttle.ThrottledBackend):
+            text += self.backend.render_prometheus()
+        return text
+
+###################################################################
+# Entry Point
+###################################################################
+
+async def serve(service, host, port, drain_timeout, unix_socket=None):
+    """
+    Run the service until SIGINT/SIGTERM, then drain it.
+    """
+    await service.start(host, port, unix_socket)
+    address = f"unix:{unix_socket}" if unix_socket else f"http://{host}:{port}"
+    logger.info("Listening on %s (%d workers, queue %d)", address, service.workers, service.max_queue)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    logger.info("Draining %d queued and %d running receipts", service.queue.qsize(), service.running)
+    await service.drain(drain_timeout)
+    if unix_socket and os.path.exists(unix_socket):
+        os.unlink(unix_socket)
+    logger.info("Stopped")
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="HTTP receipt extraction service.")
+    parser.add_argument("--host", default=os.getenv("SERVICE_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVICE_PORT", "8080")))
+    parser.add_argument("--unix-socket", nargs="?", const=daemon_socket.DEFAULT_SOCKET, default=os.getenv("SERVICE_SOCKET"),
+                        help="listen on a Unix domain socket instead of TCP, the local worker daemon of client.py "
+                             f"(default path {daemon_socket.DEFAULT_SOCKET})")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVICE_WORKERS", "4")),
+                        help="receipts processed at the same time")
+    parser.add_argument("--queue", type=int, default=int(os.getenv("SERVICE_QUEUE", "32")),
+                        help="receipts waiting for a worker before new ones are rejected with 429")
+    parser.add_argument("--drain-timeout", type=float, default=float(os.getenv("SERVICE_DRAIN_TIMEOUT", "30")),
+                        help="seconds to finish queued receipts on shutdown")
+    parser.add_argument("--mode", choices=utils.EXTRACTION_MODES,
+                        default=os.getenv("EXTRACTION_MODE", utils.EXTRACTION_MODE_ONE_SHOT))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+
+    backend = throttle.create_throttled_backend(backends.create_backend())
+    executor = preprocess_pool.create_executor()
+    scheduler = batching.create_scheduler(backend)
+    service = ExtractionService(
+        backend, mode=args.mode, cache=result_cache.create_cache(),
+        type_classifier=classifier.create_classifier(),
+        duplicates=duplicate_index.create_index(backend.model_name),
+        store=results_store.create_store(),
+        memory=memory_budget.create_budget(),
+        preprocess=executor.preprocess if executor is not None else utils.preprocess_image,
+        workers=args.workers, max_queue=args.queue, scheduler=scheduler,
+    )
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.drain_timeout, args.unix_socket))
+    except daemon_socket.SocketInUse as e:
+        parser.exit(1, f"Not starting: {e}\n")
+    finally:
+        if scheduler is not None:
+            scheduler.close()
+        if executor is not None:
+            executor.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import json
+
+# Result of _load() for incomplete text; None is a valid JSON value (null)
+INCOMPLETE = object()
+
+###################################################################
+# Incremental Receipt Parser
+###################################################################
+
+class IncrementalReceiptParser:
+    """
+    Incremental parser for a receipt JSON object arriving in chunks.
+
+    Text before the first "{" (e.g. a ```json fence) is skipped. Every
+    top-level field is reported as soon as its value is complete, and the
+    objects of the top-level "items" array are reported one by one while the
+    array is still streaming. The parser only drives progressive rendering;
+    the final result is parsed from the full text like the non-streaming path.
+
+    Events:
+        ("field", key, value): a completed top-level field (other than "items")
+        ("item", index, item): a completed element of the "items" array
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.started = False
+        self.finished = False
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.key = None
+        self.expect_key = True
+        self.value_start = None
+        self.item_start = None
+        self.item_count = 0
+
+    def feed(self, chunk):
+        """
+        Consume the next chunk of the response.
+
+        Args:
+            chunk (str): response text chunk
+
+        Returns:
+            list: events completed by this chunk
+        """
+        self.buffer += chunk
+        events = []
+        while self.pos < len(self.buffer) and not self.finished:
+            self._step(self.buffer[self.pos], events)
+            self.pos += 1
+        return events
+
+    def _step(self, char, events):
+        if not self.started:
+            if char == "{":
+                self.started = True
+                self.depth = 1
+            return
+
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif char == "\\":
+                self.escape = True
+            elif char == '"':
+                self.in_string = False
+                if self.depth == 1 and self.expect_key:
+                    self.key = self._load(self.string_start, self.pos + 1)
+            return
+
+        if char == '"':
+            self.in_string = True
+            self.string_start = self.pos
+        elif char == ":" and self.depth == 1:
+            self.expect_key = False
+            self.value_start = self.pos + 1
+        elif char in "{[":
+            self.depth += 1
+            if char == "{" and self.depth == 3 and self.key == "items":
+                self.item_start = self.pos
+        elif char in "}]":
+            if char == "}" and self.depth == 3 and self.item_start is not None:
+                item = self._load(self.item_start, self.pos + 1)
+                if item is not INCOMPLETE:
+                    events.append(("item", self.item_count, item))
+                    self.item_count += 1
+                self.item_start = None
+            self.depth -= 1
+            if self.depth == 0:
+                self._end_value(events)
+                self.finished = True
+        elif char == "," and self.depth == 1:
+            self._end_value(events)
+
+    def _end_value(self, events):
+        if self.key is not None and self.value_start is not None and self.key != "items":
+            value = self._load(self.value_start, self.pos)
+            if value is not INCOMPLETE:
+                events.append(("field", self.key, value))
+        self.key = None
+        self.value_start = None
+        self.expect_key = True
+
+    def _load(self, start, end):
+        try:
+            return json.loads(self.buffer[start:end])
+        except ValueError:
+            return INCOMPLETE
+
+###################################################################
+# Event Stream
+###################################################################
+
+def event_stream(on_event):
+    """
+    Stream hook of utils.extract_receipt_data() reporting the fields and items
+    of every streamed response to on_event, each response with its own parser.
+
+    Args:
+        on_event (callable): called with every IncrementalReceiptParser event
+
+    Returns:
+        callable: hook returning the chunk callback of a new response
+    """
+    def start():
+        parser = IncrementalReceiptParser()
+
+        def on_chunk(chunk):
+            for event in parser.feed(chunk):
+                on_event(event)
+        return on_chunk
+    return start
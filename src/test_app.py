@@ -1,78 +1,210 @@
-import google.generativeai as genai
-import PIL.Image
-import json
-import time
+import argparse
+import functools
+import logging
 import os
 from dotenv import load_dotenv
+import backends
+import batch
+import batching
+import classifier
+import client
+import duplicate_index
+import memory_budget
+import metrics
+import pipeline
+import preprocess_pool
+import result_cache
+import results_store
+import throttle
 import utils
 
 load_dotenv()
-####################################################################
-# Gemini API Configuration
-####################################################################
-genai.configure(api_key = os.getenv("GEMINI_API_KEY"))
-model = genai.GenerativeModel('gemini-2.5-flash')
 
 ####################################################################
-# Image preprocessing
+# Command line interface
 ####################################################################
-process_start_time = time.time()
-image_path = "./data/fuel-2.jpeg"
-img = utils.preprocess_image(image_path)
+def parse_args():
+    parser = argparse.ArgumentParser(description="Extract information from receipt images.")
+    parser.add_argument("inputs", nargs="+", help="receipt images, directories or glob patterns")
+    parser.add_argument("--mode", choices=utils.EXTRACTION_MODES,
+                        default=os.getenv("EXTRACTION_MODE", utils.EXTRACTION_MODE_ONE_SHOT),
+                        help="one_shot sends a single request per receipt, two_step sends two")
+    parser.add_argument("--output", help="JSONL/CSV file for batch results (enables batch mode)")
+    parser.add_argument("--format", choices=("jsonl", "csv"), default=None,
+                        help="output format, guessed from the output extension by default")
+    parser.add_argument("--workers", type=int, default=4, help="number of receipts processed concurrently")
+    parser.add_argument("--checkpoint", help="checkpoint file, defaults to <output>.checkpoint")
+    parser.add_argument("--preprocess-workers", type=int,
+                        default=int(os.getenv("PREPROCESS_WORKERS", "0")),
+                        help="preprocess in a pool of this many processes (0 preprocesses in the worker threads)")
+    parser.add_argument("--preprocess-queue", type=int, default=None,
+                        help="maximum number of images queued for the preprocessing pool")
+    parser.add_argument("--classifier-model", default=os.getenv("CLASSIFIER_MODEL"),
+                        help="local receipt-type classifier model (see classifier.py train)")
+    parser.add_argument("--classifier-threshold", type=float,
+                        default=float(os.getenv("CLASSIFIER_THRESHOLD")) if os.getenv("CLASSIFIER_THRESHOLD") else None,
+                        help="minimum classifier confidence to skip the remote type detection")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("BATCH_MAX_SIZE", "0")),
+                        help="send up to this many receipts in one model request (batch mode, 0 disables)")
+    parser.add_argument("--batch-wait", type=float, default=float(os.getenv("BATCH_MAX_WAIT", "0.05")),
+                        help="seconds a receipt waits for others to join its model request")
+    parser.add_argument("--duplicate-index", default=os.getenv("DUPLICATE_INDEX_PATH"),
+                        help="reuse the results of near-duplicate photos indexed in this SQLite file")
+    parser.add_argument("--duplicate-distance", type=int, default=int(os.getenv("DUPLICATE_MAX_DISTANCE", "10")),
+                        help="maximum perceptual-hash distance (bits of 64) of a near-duplicate")
+    parser.add_argument("--store", default=os.getenv("RESULTS_STORE_PATH"),
+                        help="SQLite results store receiving every extracted receipt (off by default)")
+    parser.add_argument("--metrics-file", default=os.getenv("METRICS_FILE"),
+                        help="write Prometheus-style stage histograms to this file")
+    parser.add_argument("--log-metrics", action="store_true",
+                        help="log a structured JSON line with the stage timings of every receipt")
+    return parser.parse_args()
 
-####################################################################
-# Detects receipt type
-####################################################################
-type_contents = [
-    img,
-    utils.TYPE_DETERMINATION_PROMPT
-]
+def run_single(image_path, backend, mode, cache, type_classifier, duplicates, store):
+    result = pipeline.process_receipt(image_path, backend, mode, cache, classifier=type_classifier,
+                                      duplicate_index=duplicates)
+    if result["success"] and store is not None:
+        store.add(result["data"], source=image_path, image_digest=result["image_digest"],
+                  model_name=backend.model_name)
 
-type_response = model.generate_content(type_contents)
-receipt_type = type_response.text.strip().upper()
+    if result["success"]:
+        client.print_receipt(result["data"])
+    else:
+        print(f"Hata oluştu: {result['error']}")
 
-####################################################################
-# Extract informations from the receipt
-####################################################################
-contents = [
-    img,
-    f"""Extract the receipt information based on the determined type ({receipt_type}) 
-    and return ONLY a valid JSON object with the following structure:
-    {utils.PROMPTS[receipt_type]}
-    Return ONLY the JSON object with no additional text or formatting.""",
-]
+    print(f"Processing time: {result['processing_time']:.2f} seconds")
+    for name, seconds in result["stages"].items():
+        print(f"  {name}: {seconds * 1000:.1f} ms")
+    if result.get("payload_bytes"):
+        print(f"Upload size: {result['input_bytes'] / 1024:.1f} KB -> {result['payload_bytes'] / 1024:.1f} KB")
+    if "crop" in result:
+        crop = result["crop"]
+        if crop["cropped"]:
+            print(f"Cropped to the receipt outline ({crop['area']:.0%} of the photo)")
+        else:
+            print("No confident receipt outline, full photo kept")
+    if "preprocess" in result:
+        preprocess = result["preprocess"]
+        quality = preprocess.get("quality")
+        print(f"Preprocessing profile: {preprocess['profile']}"
+              + (f" (sharpness {quality['sharpness']:.0f}, brightness {quality['brightness']:.0f}, "
+                 f"contrast {quality['contrast']:.0f})" if quality else ""))
+    if "tiling" in result:
+        tiled = result["tiling"]
+        reconciliation = tiled["reconciliation"]
+        if reconciliation["total_source"] == "items":
+            comparison = " (total taken from the items)"
+        elif reconciliation["consistent"] is None:
+            comparison = ""
+        else:
+            comparison = f" vs total {reconciliation['total_amount']:.2f}" + \
+                ("" if reconciliation["consistent"] else " (mismatch)")
+        print(f"Extracted from {tiled['bands']} bands ({tiled['duplicates']} duplicate items dropped at the seams), "
+              f"items total {reconciliation['items_total']:.2f}{comparison}")
+    if "classification" in result:
+        classification = result["classification"]
+        source = "local" if classification["accepted"] else "model"
+        print(f"Local classifier: {classification['type']} ({classification['confidence']:.2f}), type from {source}")
+    if result["cached"]:
+        print("Result served from cache")
+    elif "duplicate" in result:
+        print(f"Result reused from near-duplicate receipt #{result['duplicate']['id']} "
+              f"(distance {result['duplicate']['distance']})")
+
+def run_batch(args, backend, cache, executor, type_classifier, scheduler, duplicates, store):
+    output_format = args.format or ("csv" if args.output.lower().endswith(".csv") else "jsonl")
+
+    def on_result(image_path, result):
+        status = "ok" if result["success"] else f"error: {result['error']}"
+        print(f"[{result['processing_time']:.2f}s] {image_path} {status}", flush=True)
+
+    # Worker threads queue for decoded image memory instead of decoding every large photo at once
+    memory = memory_budget.create_budget()
+    process = functools.partial(pipeline.process_receipt, classifier=type_classifier, scheduler=scheduler,
+                                duplicate_index=duplicates, memory=memory)
+    if executor is not None:
+        # Worker threads wait on the pool, so model calls overlap with preprocessing on all cores
+        process = functools.partial(process, preprocess=executor.preprocess)
+
+    stats = batch.run_batch(
+        args.inputs, backend, args.output, output_format=output_format, workers=args.workers,
+        mode=args.mode, cache=cache, checkpoint_path=args.checkpoint, process=process,
+        on_result=on_result, store=store,
+    )
+
+    print("-------------------")
+    print(f"Processed: {stats['processed']} (failed: {stats['failed']}, skipped from checkpoint: {stats['skipped']})")
+    print(f"Elapsed: {stats['elapsed']:.2f} seconds")
+    print(f"Throughput: {stats['throughput']:.2f} receipts/sec")
+    print(f"Latency p50: {stats['p50']:.2f}s  p95: {stats['p95']:.2f}s")
+    for name in metrics.STAGES:
+        if name in stats["stages"]:
+            stage = stats["stages"][name]
+            print(f"  {name}: p50 {stage['p50'] * 1000:.1f} ms  p95 {stage['p95'] * 1000:.1f} ms")
+    print(f"Cropped to the receipt outline: {stats['cropped']}/{stats['processed']}")
+    if stats["tiled"]:
+        print(f"Extracted from bands: {stats['tiled']}/{stats['processed']}")
+    if store is not None:
+        print(f"Stored: {stats['stored']} new receipts in {args.store}")
+    if stats["profiles"]:
+        print("Preprocessing profiles: " + ", ".join(f"{profile} {count}" for profile, count in sorted(stats["profiles"].items())))
+    if scheduler is not None:
+        batch_stats = scheduler.stats()
+        print(f"Model batches: {batch_stats['batches']} (mean size {batch_stats['mean_batch_size']:.1f}, "
+              f"fallbacks: {batch_stats['fallbacks']}, failed batches: {batch_stats['failed_batches']})")
+    if stats["classifier"]["classified"]:
+        agreement = stats["classifier"]["remote_agreement"]
+        print(f"Local classifier hit rate: {stats['classifier']['hit_rate']:.0%}"
+              + (f"  agreement on model-typed receipts: {agreement:.0%}" if agreement is not None else ""))
+    if isinstance(backend, throttle.ThrottledBackend):
+        model = backend.stats()
+        print(f"Model calls: {model['attempts']} (retries: {model['retries']}, rate limited: {model['rate_limited']}, "
+              f"server errors: {model['server_errors']}, failed: {model['failures']}), "
+              f"concurrency limit {model['limit']:.1f}, circuit {model['circuit']}")
+    if memory is not None and memory.waits:
+        memory_stats = memory.stats()
+        print(f"Waited for image memory: {memory_stats['waits']} receipts, {memory_stats['wait_seconds']:.2f}s "
+              f"(peak {memory_stats['peak_bytes'] / 1e6:.0f} of {memory_stats['limit_bytes'] / 1e6:.0f} MB)")
+    if duplicates is not None:
+        print(f"Near-duplicates reused: {stats['duplicates']} (index size: {duplicates.stats()['entries']})")
 
-response = model.generate_content(contents)
+def main():
+    args = parse_args()
+    if args.log_metrics:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
 
-try:
-    if not response.text:
-        raise ValueError("API response error!")
-    
-    json_string = response.text
-    cleaned_json = utils.clean_json_string(json_string)
-    receipt_data = json.loads(cleaned_json)
+    # Model backend configuration (MODEL_BACKEND=gemini|fake), throttled and retried (MODEL_* settings)
+    backend = throttle.create_throttled_backend(backends.create_backend())
+    cache = result_cache.create_cache()
+    type_classifier = None
+    if args.classifier_model:
+        type_classifier = classifier.ReceiptTypeClassifier.load(args.classifier_model, args.classifier_threshold)
+    duplicates = None
+    if args.duplicate_index:
+        duplicates = duplicate_index.DuplicateIndex(args.duplicate_index, backend.model_name,
+                                                    max_distance=args.duplicate_distance)
+    store = results_store.ResultsStore(args.store) if args.store else None
 
-    print(f"Fiş Türü: {receipt_data.get('type', 'N/A')}")
-    print(f"İşletme Adı: {receipt_data.get('business_name', 'N/A')}")
-    print(f"Tarih: {receipt_data.get('date', 'N/A')}")
-    
-    if receipt_data.get('type') == "FUEL":
-        if 'license_plate' in receipt_data:
-            print(f"Plaka: {receipt_data.get('license_plate', 'N/A')}")
-    
-    if receipt_data.get('type') == "MARKET":
-        if 'items' in receipt_data and isinstance(receipt_data['items'], list):
-            print("\nAlınan Ürünler:")
-            for item in receipt_data['items']:
-                print(f"{item.get('name', 'N/A')}")
-                print(f"Fiyat: {item.get('price', 'N/A')}")
-                print("-------------------")
+    if args.output is None and len(args.inputs) == 1 and os.path.isfile(args.inputs[0]):
+        run_single(args.inputs[0], backend, args.mode, cache, type_classifier, duplicates, store)
+    elif args.output is None:
+        raise SystemExit("--output is required when processing several receipts")
+    else:
+        scheduler = None
+        if args.batch_size > 1:
+            scheduler = batching.BatchingScheduler(backend, max_batch_size=args.batch_size, max_wait=args.batch_wait)
+        try:
+            if args.preprocess_workers > 0:
+                with preprocess_pool.PreprocessExecutor(args.preprocess_workers, args.preprocess_queue) as executor:
+                    run_batch(args, backend, cache, executor, type_classifier, scheduler, duplicates, store)
+            else:
+                run_batch(args, backend, cache, None, type_classifier, scheduler, duplicates, store)
+        finally:
+            if scheduler is not None:
+                scheduler.close()
 
-    print(f"Toplam Tutar: {receipt_data.get('total_amount', 'N/A')}")
+    if args.metrics_file:
+        metrics.REGISTRY.write_prometheus(args.metrics_file)
 
-except:
-    print(f"Hata oluştu:")
-    
-process_end_time = time.time()
-process_duration = process_end_time - process_start_time
-print(f"Processing time: {process_duration:.2f} seconds")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
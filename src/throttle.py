@@ -0,0 +1,599 @@
+import contextlib
+import logging
+import os
+import random
+import threading
+import time
+from backends import BackendError, ModelBackend
+
+logger = logging.getLogger("receipt_extractor.throttle")
+
+# Rough token cost of an uploaded receipt image (Gemini counts 258 tokens per
+# 768x768 tile, about five tiles for a 1600px upload) and of a response
+IMAGE_TOKENS = 1290
+RESPONSE_TOKENS = 400
+
+###################################################################
+# Exceptions
+###################################################################
+
+class CircuitOpenError(BackendError):
+    """
+    Raised without calling the model while the circuit breaker is open.
+    """
+
+    def __init__(self, message):
+        super().__init__(message, status_code=503)
+
+class DeadlineExceeded(BackendError):
+    """
+    Raised when a call cannot be sent or retried before its deadline.
+    """
+
+    def __init__(self, message):
+        super().__init__(message, status_code=504)
+
+###################################################################
+# Token Bucket
+###################################################################
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at a per-minute rate.
+
+    The bucket holds at most burst seconds of budget, so calls are paced
+    evenly instead of spending a whole minute of quota at once. Amounts
+    larger than the bucket are admitted when it is full and leave it in
+    debt, as does charge(), so the average rate is kept either way.
+
+    Args:
+        per_minute (float): tokens added per minute
+        burst (float): capacity of the bucket in seconds of budget
+    """
+
+    def __init__(self, per_minute, burst=1.0):
+        self.rate = per_minute / 60.0
+        self.capacity = max(self.rate * burst, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount, deadline=None):
+        """
+        Take tokens, waiting for the bucket to refill.
+
+        Args:
+            amount (float): tokens needed
+            deadline (float): time.monotonic() by which the tokens must be available
+
+        Returns:
+            float: seconds spent waiting
+
+        Raises:
+            DeadlineExceeded: the tokens cannot be available before the deadline
+        """
+        needed = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= needed:
+                    self.tokens -= amount
+                    return waited
+                wait = (needed - self.tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise DeadlineExceeded("Rate limit budget not available before the deadline")
+            time.sleep(wait)
+            waited += wait
+
+    def charge(self, amount):
+        """
+        Take tokens without waiting (e.g. response tokens known after the call).
+        """
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+    def available(self):
+        with self.lock:
+            self._refill()
+            return self.tokens
+
+###################################################################
+# Adaptive Concurrency
+###################################################################
+
+class AdaptiveConcurrency:
+    """
+    Limit of concurrent model calls adjusted AIMD-style.
+
+    Every successful call that used the whole limit raises it by 1/limit
+    (about one more call per round trip). An overload signal halves it: a
+    429 or 5xx response, or a short-term mean latency that rose above
+    latency_tolerance times the long-term mean (requests queueing at the
+    server). Decreases are spaced by one round trip so a burst of
+    failures of calls sent together counts once.
+
+    Args:
+        initial (int): starting limit
+        minimum (int): lowest limit
+        maximum (int): highest limit
+        decrease (float): factor applied to the limit on overload
+        latency_tolerance (float): short-term / long-term latency ratio treated as overload
+    """
+
+    def __init__(self, initial=8, minimum=1, maximum=32, decrease=0.5, latency_tolerance=2.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.waiting = 0
+        self.short_latency = None
+        self.long_latency = None
+        self.last_decrease = 0.0
+        self.decreases = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, deadline=None):
+        """
+        Wait for a free slot.
+
+        Returns:
+            float: seconds spent waiting
+
+        Raises:
+            DeadlineExceeded: no slot became free before the deadline
+        """
+        start = time.monotonic()
+        with self.condition:
+            self.waiting += 1
+            try:
+                while self.in_flight >= int(self.limit):
+                    timeout = None if deadline is None else deadline - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        raise DeadlineExceeded("No model call slot became free before the deadline")
+                    self.condition.wait(timeout)
+                self.in_flight += 1
+            finally:
+                self.waiting -= 1
+        return time.monotonic() - start
+
+    def release(self, latency=None, overloaded=False):
+        """
+        Free a slot and adjust the limit.
+
+        Args:
+            latency (float): duration of a successful call, None when it failed or was abandoned
+            overloaded (bool): the call failed with a 429 or 5xx response
+        """
+        with self.condition:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            if latency is not None:
+                self.short_latency = latency if self.short_latency is None else 0.8 * self.short_latency + 0.2 * latency
+                self.long_latency = latency if self.long_latency is None else 0.98 * self.long_latency + 0.02 * latency
+                overloaded = self.short_latency > self.latency_tolerance * self.long_latency
+
+            now = time.monotonic()
+            if overloaded:
+                # Before the first success the round trip is unknown, assume a second
+                round_trip = self.short_latency if self.short_latency is not None else 1.0
+                if now - self.last_decrease >= round_trip:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self.last_decrease = now
+                    self.decreases += 1
+            elif latency is not None and saturated:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+
+###################################################################
+# Circuit Breaker
+###################################################################
+
+class CircuitBreaker:
+    """
+    Stops calling the model after sustained server failures.
+
+    After failure_threshold consecutive server errors (5xx) the circuit opens and
+    no call is sent for cooldown seconds. Then a single probe call is let
+    through (half-open): its success closes the circuit, its failure opens
+    it again. Calls arriving meanwhile wait for the circuit to close when
+    their deadline allows it and fail immediately otherwise, so an outage
+    shorter than the deadline delays receipts instead of failing them.
+    Rate-limit responses (429) are left to the concurrency limit and
+    retries, and client errors (other 4xx, blocked answers) and exceptions
+    that are not model responses do not count as failures.
+
+    Args:
+        failure_threshold (int): consecutive failures opening the circuit
+        cooldown (float): seconds the circuit stays open
+    """
+
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.opens = 0
+        self.rejected = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, deadline=None):
+        """
+        Wait until a call may be sent.
+
+        Args:
+            deadline (float): time.monotonic() after which the call is given up
+
+        Returns:
+            bool: whether the call is the half-open probe
+
+        Raises:
+            CircuitOpenError: the circuit does not close before the deadline
+        """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if self.state == "open" and now - self.opened_at >= self.cooldown:
+                    self.state = "half_open"
+                if self.state == "closed":
+                    return False
+                if self.state == "half_open" and not self.probing:
+                    self.probing = True
+                    return True
+
+                # Open (wait for the cooldown) or half-open with a probe in flight (wait for its outcome)
+                wake = self.opened_at + self.cooldown if self.state == "open" else None
+                if deadline is not None and (wake if wake is not None else now) >= deadline:
+                    self.rejected += 1
+                    raise CircuitOpenError("Model calls suspended after repeated failures (circuit open)")
+                until = [t for t in (wake, deadline) if t is not None]
+                self.condition.wait(min(until) - now if until else None)
+
+    def record(self, success, probe=False):
+        """
+        Record the outcome of a sent call.
+        """
+        with self.condition:
+            if probe:
+                self.probing = False
+            if success:
+                if self.state != "closed":
+                    logger.info("Circuit closed")
+                self.state = "closed"
+                self.failures = 0
+            else:
+                self.failures += 1
+                if probe or (self.state == "closed" and self.failures >= self.failure_threshold):
+                    if self.state == "closed":
+                        self.opens += 1
+                        logger.warning("Circuit opened after %d consecutive failed model calls", self.failures)
+                    self.state = "open"
+                    self.opened_at = time.monotonic()
+            self.condition.notify_all()
+
+    def release(self, probe=False):
+        """
+        Give back a call whose outcome says nothing about the server (e.g. an abandoned stream).
+        """
+        if probe:
+            with self.condition:
+                self.probing = False
+                self.condition.notify_all()
+
+###################################################################
+# Throttled Backend
+###################################################################
+
+class Attempt:
+    """
+    Outcome of one model call, filled in by ThrottledBackend.
+    """
+
+    def __init__(self):
+        self.text = None
+        self.error = None
+
+class ThrottledBackend(ModelBackend):
+    """
+    Wrapper scheduling the calls of another backend, shared by every thread
+    that uses it.
+
+    Each call waits for a slot of the adaptive concurrency limit and for
+    the requests-per-minute and tokens-per-minute budgets, then is sent.
+    429 and 5xx responses are retried with full-jitter exponential backoff
+    while attempts and the deadline allow it. A streamed call is only
+    retried before its first chunk was delivered. Sustained server
+    failures open the circuit breaker, which holds calls back until a
+    probe succeeds and fails those whose deadline ends first.
+
+    Args:
+        backend (ModelBackend): backend to throttle
+        rpm (float): requests per minute, 0 for no limit
+        tpm (float): estimated tokens per minute, 0 for no limit
+        concurrency (AdaptiveConcurrency): concurrency limit
+        breaker (CircuitBreaker): circuit breaker
+        max_attempts (int): attempts per call including the first
+        backoff_base (float): backoff in seconds before the first retry
+        backoff_cap (float): maximum backoff in seconds
+        deadline (float): seconds a call may take in total, waits and retries included
+        seed (int): random seed of the backoff jitter
+    """
+
+    name = "throttled"
+
+    def __init__(self, backend, rpm=0, tpm=0, concurrency=None, breaker=None, max_attempts=4,
+                 backoff_base=0.5, backoff_cap=8.0, deadline=120.0, seed=None):
+        self.backend = backend
+        self.model_name = backend.model_name
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self.breaker = breaker or CircuitBreaker()
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.deadline = deadline
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.rate_waiting = 0
+        self.counters = {
+            "calls": 0, "attempts": 0, "retries": 0, "failures": 0, "rate_limited": 0, "server_errors": 0,
+            "throttle_waits": 0, "throttle_wait_seconds": 0.0, "queue_wait_seconds": 0.0, "deadline_exceeded": 0,
+        }
+
+    def generate(self, contents):
+        deadline = self._start()
+        attempt = 0
+        while True:
+            with self._attempt(contents, deadline) as call:
+                try:
+                    call.text = self.backend.generate(contents)
+                    return call.text
+                except BackendError as e:
+                    call.error = e
+            attempt += 1
+            self._backoff(call.error, attempt, deadline)
+
+    def generate_stream(self, contents):
+        deadline = self._start()
+        attempt = 0
+        while True:
+            with self._attempt(contents, deadline) as call:
+                chunks = []
+                try:
+                    for chunk in self.backend.generate_stream(contents):
+                        chunks.append(chunk)
+                        yield chunk
+                    call.text = "".join(chunks)
+                    return
+                except BackendError as e:
+                    if chunks:
+                        raise
+                    call.error = e
+            attempt += 1
+            self._backoff(call.error, attempt, deadline)
+
+    def _start(self):
+        with self.lock:
+            self.counters["calls"] += 1
+        return time.monotonic() + self.deadline
+
+    @contextlib.contextmanager
+    def _attempt(self, contents, deadline):
+        try:
+            probe = self.breaker.acquire(deadline)
+        except CircuitOpenError:
+            self._count("failures")
+            raise
+
+        try:
+            queue_wait = self.concurrency.acquire(deadline)
+        except DeadlineExceeded:
+            self.breaker.release(probe)
+            self._count("deadline_exceeded")
+            self._count("failures")
+            raise
+
+        try:
+            self._acquire_budget(contents, deadline)
+        except DeadlineExceeded:
+            self.concurrency.release()
+            self.breaker.release(probe)
+            self._count("failures")
+            raise
+
+        with self.lock:
+            self.counters["attempts"] += 1
+            self.counters["queue_wait_seconds"] += queue_wait
+        call = Attempt()
+        error = None
+        start = time.monotonic()
+        try:
+            yield call
+            error = call.error
+        except BackendError as e:
+            error = e
+            raise
+        finally:
+            if call.text is not None:
+                self.concurrency.release(latency=time.monotonic() - start)
+                self.breaker.record(True, probe)
+                if self.tokens is not None:
+                    self.tokens.charge(len(call.text) / 4 - RESPONSE_TOKENS)
+            elif error is None:
+                # Abandoned streams and errors that are not model responses (a bug, an
+                # unreadable answer) say nothing about the server's health
+                self.concurrency.release()
+                self.breaker.release(probe)
+            else:
+                self._count("rate_limited" if error.status_code == 429 else
+                            "server_errors" if error.status_code >= 500 else None)
+                self.concurrency.release(overloaded=error.retryable)
+                if error.status_code >= 500:
+                    self.breaker.record(False, probe)
+                else:
+                    self.breaker.release(probe)
+
+    def _acquire_budget(self, contents, deadline):
+        waited = 0.0
+        with self.lock:
+            self.rate_waiting += 1
+        try:
+            if self.requests is not None:
+                waited += self.requests.acquire(1, deadline)
+            if self.tokens is not None:
+                waited += self.tokens.acquire(estimate_tokens(contents), deadline)
+        except DeadlineExceeded:
+            self._count("deadline_exceeded")
+            raise
+        finally:
+            with self.lock:
+                self.rate_waiting -= 1
+                if waited > 0:
+                    self.counters["throttle_waits"] += 1
+                    self.counters["throttle_wait_seconds"] += waited
+
+    def _backoff(self, error, attempt, deadline):
+        if not error.retryable or attempt >= self.max_attempts:
+            self._count("failures")
+            raise error
+        delay = self.random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** (attempt - 1)))
+        if time.monotonic() + delay > deadline:
+            self._count("deadline_exceeded")
+            self._count("failures")
+            raise error
+        self._count("retries")
+        time.sleep(delay)
+
+    def _count(self, name):
+        if name is not None:
+            with self.lock:
+                self.counters[name] += 1
+
+    def stats(self):
+        """
+        Returns:
+            dict: current limit, in-flight and queued calls, budgets, circuit state and counters
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            stats["rate_waiting"] = self.rate_waiting
+        with self.concurrency.condition:
+            stats.update({
+                "limit": round(self.concurrency.limit, 2),
+                "in_flight": self.concurrency.in_flight,
+                "queued": self.concurrency.waiting,
+                "limit_decreases": self.concurrency.decreases,
+                "latency_short": self.concurrency.short_latency,
+                "latency_long": self.concurrency.long_latency,
+            })
+        with self.breaker.condition:
+            stats.update({"circuit": self.breaker.state, "circuit_opens": self.breaker.opens,
+                          "circuit_rejected": self.breaker.rejected})
+        stats["rpm_available"] = self.requests.available() if self.requests is not None else None
+        stats["tpm_available"] = self.tokens.available() if self.tokens is not None else None
+        return stats
+
+    def render_prometheus(self):
+        """
+        Render the scheduler state in the Prometheus text format.
+
+        Returns:
+            str: exposition text
+        """
+        stats = self.stats()
+        lines = [
+            "# HELP receipt_model_concurrency_limit Adaptive limit of concurrent model calls.",
+            "# TYPE receipt_model_concurrency_limit gauge",
+            f"receipt_model_concurrency_limit {stats['limit']}",
+            "# HELP receipt_model_in_flight Model calls in flight.",
+            "# TYPE receipt_model_in_flight gauge",
+            f"receipt_model_in_flight {stats['in_flight']}",
+            "# HELP receipt_model_queued Model calls waiting for a concurrency slot.",
+            "# TYPE receipt_model_queued gauge",
+            f"receipt_model_queued {stats['queued']}",
+            "# HELP receipt_model_rate_waiting Model calls waiting for the RPM/TPM budget.",
+            "# TYPE receipt_model_rate_waiting gauge",
+            f"receipt_model_rate_waiting {stats['rate_waiting']}",
+            "# HELP receipt_model_circuit_open Whether the model circuit breaker is open (1) or half-open (0.5).",
+            "# TYPE receipt_model_circuit_open gauge",
+            f"receipt_model_circuit_open {({'closed': 0, 'half_open': 0.5, 'open': 1})[stats['circuit']]}",
+            "# HELP receipt_model_events_total Model call scheduling events.",
+            "# TYPE receipt_model_events_total counter",
+        ]
+        for event in ("attempts", "retries", "failures", "rate_limited", "server_errors", "throttle_waits",
+                      "deadline_exceeded", "limit_decreases", "circuit_opens", "circuit_rejected"):
+            lines.append(f'receipt_model_events_total{{event="{event}"}} {stats[event]}')
+        return "\n".join(lines) + "\n"
+
+###################################################################
+# Helper Functions
+###################################################################
+
+def estimate_tokens(contents):
+    """
+    Rough token count of a request: prompt characters / 4, a fixed cost per
+    image and the expected response.
+
+    Args:
+        contents (list): images and prompt strings
+
+    Returns:
+        float: estimated tokens
+    """
+    text = sum(len(part) for part in contents if isinstance(part, str))
+    images = sum(not isinstance(part, str) for part in contents)
+    return text / 4 + images * IMAGE_TOKENS + RESPONSE_TOKENS
+
+###################################################################
+# Throttle Factory
+###################################################################
+
+def create_throttled_backend(backend):
+    """
+    Wrap a backend in the scheduler configured by the environment.
+
+    Environment variables:
+        MODEL_THROTTLE: "0" disables throttling and retries (default "1")
+        MODEL_RPM / MODEL_TPM: requests and estimated tokens per minute (default 0, no limit)
+        MODEL_CONCURRENCY / MODEL_MIN_CONCURRENCY / MODEL_MAX_CONCURRENCY: initial, lowest and
+            highest concurrent calls (default 8, 1 and 32)
+        MODEL_MAX_ATTEMPTS: attempts per call including the first (default 4)
+        MODEL_DEADLINE: seconds a call may take with waits and retries (default 120)
+        MODEL_CIRCUIT_FAILURES / MODEL_CIRCUIT_COOLDOWN: consecutive failures opening the
+            circuit (default 5) and seconds it stays open (default 30)
+
+    Args:
+        backend (ModelBackend): backend to wrap
+
+    Returns:
+        ModelBackend: ThrottledBackend, or the backend itself when disabled
+    """
+    if os.getenv("MODEL_THROTTLE", "1").lower() in ("0", "false", "no", "off"):
+        return backend
+    return ThrottledBackend(
+        backend,
+        rpm=float(os.getenv("MODEL_RPM", "0")),
+        tpm=float(os.getenv("MODEL_TPM", "0")),
+        concurrency=AdaptiveConcurrency(
+            initial=int(os.getenv("MODEL_CONCURRENCY", "8")),
+            minimum=int(os.getenv("MODEL_MIN_CONCURRENCY", "1")),
+            maximum=int(os.getenv("MODEL_MAX_CONCURRENCY", "32")),
+        ),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv("MODEL_CIRCUIT_FAILURES", "5")),
+            cooldown=float(os.getenv("MODEL_CIRCUIT_COOLDOWN", "30")),
+        ),
+        max_attempts=int(os.getenv("MODEL_MAX_ATTEMPTS", "4")),
+        deadline=float(os.getenv("MODEL_DEADLINE", "120")),
+    )
@@ -0,0 +1,309 @@
+import difflib
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import metrics
+import utils
+
+logger = logging.getLogger("receipt_extractor.tiling")
+
+###################################################################
+# Band Detection
+###################################################################
+
+# Text line pitch as a fraction of the receipt width: 80 mm receipt paper
+# prints about 48 characters per line with characters twice as tall as wide
+LINE_PITCH = 1 / 24
+
+def row_ink(binary):
+    """
+    Fraction of dark pixels per row of a thresholded receipt, ignoring the
+    outer 5% on both sides (shadows and paper edges) and smoothed over 3 rows.
+
+    Args:
+        binary (ndarray): 2D uint8 image with dark text on a light background
+
+    Returns:
+        ndarray: float ink fraction per row
+    """
+    width = binary.shape[1]
+    inner = binary[:, width // 20:width - width // 20]
+    ink = np.count_nonzero(inner < 128, axis=1) / max(inner.shape[1], 1)
+    return np.convolve(ink, np.ones(3) / 3, mode="same")
+
+def quietest_row(ink, target, radius):
+    """
+    Row with the least ink within radius of target, the closest one among equals.
+    """
+    low = max(int(target - radius), 1)
+    high = min(int(target + radius) + 1, len(ink) - 1)
+    if low >= high:
+        return int(min(max(target, 1), len(ink) - 1))
+    rows = np.arange(low, high)
+    # Whitespace rows have (almost) no ink; the distance only breaks ties
+    return int(rows[np.argmin(ink[low:high] + np.abs(rows - target) * 1e-6)])
+
+def plan_bands(image, min_aspect=2.5, band_ratio=1.5, overlap_lines=2, max_bands=8):
+    """
+    Split a tall receipt into overlapping horizontal bands cut along whitespace rows.
+
+    Cuts are placed at the row with the least ink near equal band heights, so
+    no text line is split. Every band then extends about overlap_lines text
+    lines past each of its cuts (again ending on the quietest row nearby), so
+    a line near a seam is seen whole by at least one band and an item spanning
+    two lines is not lost.
+
+    Args:
+        image: preprocessed image (PIL image or 2D uint8 array), ideally thresholded
+        min_aspect (float): height / width from which a receipt is split
+        band_ratio (float): target band height as a multiple of the width
+        overlap_lines (int): text lines repeated on both sides of a cut
+        max_bands (int): maximum number of bands
+
+    Returns:
+        list: (top, bottom) row ranges, None when the receipt is not split
+    """
+    binary = np.asarray(image if isinstance(image, np.ndarray) or image.mode == "L" else image.convert("L"))
+    height, width = binary.shape
+    count = min(max_bands, round(height / (band_ratio * width)))
+    if height < min_aspect * width or count < 2:
+        return None
+
+    ink = row_ink(binary)
+    band_height = height / count
+    pitch = width * LINE_PITCH
+    cuts = [quietest_row(ink, band_height * i, band_height / 4) for i in range(1, count)]
+    bounds = [0] + cuts + [height]
+    return [
+        (0 if i == 0 else quietest_row(ink, bounds[i] - overlap_lines * pitch, pitch / 2),
+         height if i == count - 1 else quietest_row(ink, bounds[i + 1] + overlap_lines * pitch, pitch / 2))
+        for i in range(count)
+    ]
+
+###################################################################
+# Item Merge and Reconciliation
+###################################################################
+
+def item_key(item):
+    """
+    Normalized (name, price) of an item for comparing the reads of two bands.
+    """
+    name = re.sub(r"\s+", " ", str(item.get("name") or "")).strip().casefold()
+    price, valid = utils.normalize_monetary_values([item.get("price")])
+    return name, round(float(price[0]), 2) if valid[0] else str(item.get("price") or "").strip()
+
+def same_item(first, second, min_similarity=0.8):
+    """
+    Whether two item reads are the same receipt line: equal prices and similar names.
+    """
+    first_name, first_price = item_key(first)
+    second_name, second_price = item_key(second)
+    if first_price != second_price:
+        return False
+    return first_name == second_name or \
+        difflib.SequenceMatcher(None, first_name, second_name).ratio() >= min_similarity
+
+def seam_overlap(previous, following, max_overlap):
+    """
+    Number of leading items of a band that repeat the trailing items of the band above.
+
+    Args:
+        previous (list): items read from the band above
+        following (list): items read from the band below
+        max_overlap (int): largest number of items the two bands can share
+
+    Returns:
+        int: length of the longest suffix of previous matching a prefix of following
+    """
+    for length in range(min(len(previous), len(following), max_overlap), 0, -1):
+        if all(same_item(a, b) for a, b in zip(previous[-length:], following[:length])):
+            return length
+    return 0
+
+def merge_band_items(band_items, max_overlap=8):
+    """
+    Concatenate the item lists of consecutive bands, dropping the items read
+    twice where the bands overlap.
+
+    Args:
+        band_items (list): item list per band, top to bottom
+        max_overlap (int): largest number of items two neighbouring bands can share
+
+    Returns:
+        tuple: (merged items, dropped) where dropped lists (position, item) of every
+        removed duplicate, position being its index in the merged list
+    """
+    merged, dropped = [], []
+    previous = []
+    for items in band_items:
+        overlap = seam_overlap(previous, items, max_overlap)
+        dropped.extend((len(merged), item) for item in items[:overlap])
+        merged.extend(items[overlap:])
+        previous = items
+    return merged, dropped
+
+def format_amount(value):
+    """
+    Format an amount like the receipts do ("1234,56").
+    """
+    return f"{value:.2f}".replace(".", ",")
+
+def reconcile(receipt_data, dropped, tolerance=0.01):
+    """
+    Check the header/footer total of a tiled market receipt against the sum
+    of its merged items, in place.
+
+    Identical neighbouring items are legitimately printed twice, so when the
+    sum falls short of the total by exactly one dropped duplicate, that item
+    is put back. A missing or unreadable total is filled in from the items.
+
+    Args:
+        receipt_data (dict): merged receipt with "items" and "total_amount"
+        dropped (list): (position, item) duplicates removed by merge_band_items()
+        tolerance (float): largest difference accepted as a match
+
+    Returns:
+        dict: "items_total", "total_amount", "difference" (total - items),
+        "consistent", the number of "restored" duplicates and the "total_source"
+    """
+    items = receipt_data.get("items") or []
+    prices, valid = utils.normalize_monetary_values([item.get("price") for item in items])
+    items_total = float(prices[valid].sum())
+    totals, total_valid = utils.normalize_monetary_values([receipt_data.get("total_amount")])
+
+    report = {"items_total": round(items_total, 2), "restored": 0, "total_source": "receipt"}
+    if not total_valid[0]:
+        if items:
+            receipt_data["total_amount"] = format_amount(items_total)
+            report["total_source"] = "items"
+        report.update({"total_amount": round(items_total, 2) if items else None, "difference": None,
+                       "consistent": None})
+        return report
+
+    total = float(totals[0])
+    if abs(total - items_total) > tolerance and dropped:
+        dropped_prices, dropped_valid = utils.normalize_monetary_values([item.get("price") for _, item in dropped])
+        for (position, item), price, ok in zip(dropped, dropped_prices, dropped_valid):
+            if ok and abs(total - items_total - price) <= tolerance:
+                items.insert(position, item)
+                items_total += float(price)
+                report["restored"] = 1
+                break
+
+    report.update({
+        "items_total": round(items_total, 2),
+        "total_amount": round(total, 2),
+        "difference": round(total - items_total, 2),
+        "consistent": abs(total - items_total) <= tolerance,
+    })
+    return report
+
+###################################################################
+# Tiled Extraction
+###################################################################
+
+def parse_complete_response(text):
+    """
+    Parse a JSON answer like utils.parse_receipt_response(), refusing one that
+    was cut off: the fields or items past the cut would be silently missing.
+
+    Raises:
+        ValueError: the response is empty, cut off or not JSON
+    """
+    if not text:
+        raise ValueError("Empty API response!")
+    cleaned, truncated = utils.repair_json(text)
+    if truncated:
+        raise ValueError("Response is truncated")
+    return json.loads(cleaned, strict=False)
+
+def parse_band_items(text):
+    """
+    Parse the item list returned for one band.
+
+    Raises:
+        ValueError: the response is empty, cut off or not JSON
+    """
+    answer = parse_complete_response(text)
+    items = answer.get("items") if isinstance(answer, dict) else answer
+    return [item for item in items if isinstance(item, dict)] if isinstance(items, list) else []
+
+def extract_tiled(backend, img, band_imgs, receipt_type=None, timer=None, on_event=None, max_overlap=8):
+    """
+    Extract a long market receipt from overlapping bands.
+
+    The whole image is sent once for every field except the items (a short
+    response), while the items of every band are requested at the same time,
+    so the latency is that of the slowest band instead of one response
+    listing every item, and no single response is long enough to be cut
+    off. When the whole-image response reveals another receipt type its
+    complete answer is returned right away and the band requests are
+    abandoned. When the whole-image or a band response cannot be used (empty,
+    cut off, not JSON or of an unknown type), no receipt is returned and the
+    caller extracts it with a single request.
+
+    Args:
+        backend (backends.ModelBackend): model backend
+        img (image): upload of the whole preprocessed receipt
+        band_imgs (list): uploads of the bands, top to bottom (see plan_bands())
+        receipt_type (str): known receipt type, None to let the model determine it
+        timer (metrics.StageTimer): optional stage timer
+        on_event (callable): called with ("field", key, value) and ("item", index, item)
+            events like streaming.IncrementalReceiptParser, as the parts complete
+        max_overlap (int): largest number of items two neighbouring bands can share
+
+    Returns:
+        tuple: (receipt data, tiling report with "bands", "duplicates" and "reconciliation",
+        None when the receipt turned out not to be a market receipt), or
+        (None, None) when a response could not be used
+    """
+    count = len(band_imgs)
+    executor = ThreadPoolExecutor(max_workers=count)
+    try:
+        with metrics.stage(timer, "extract_call"):
+            futures = [
+                executor.submit(backend.generate, [band, utils.build_tile_items_prompt(part, count)])
+                for part, band in enumerate(band_imgs, 1)
+            ]
+            summary_text = backend.generate([img, utils.build_tile_summary_prompt(receipt_type)])
+        with metrics.stage(timer, "parse"):
+            try:
+                receipt_data = parse_complete_response(summary_text)
+                if not isinstance(receipt_data, dict):
+                    raise ValueError("Summary response is not a JSON object")
+                detected = str(receipt_data.get("type", "")).strip().upper()
+                if detected not in utils.PROMPTS:
+                    raise ValueError(f"Unknown receipt type: {detected}")
+            except ValueError as e:
+                logger.warning("Summary of a tiled receipt unreadable, extracting it with a single request: %s", e)
+                return None, None
+            receipt_data["type"] = detected
+        if on_event is not None:
+            for key, value in receipt_data.items():
+                on_event(("field", key, value))
+        if detected != "MARKET":
+            return receipt_data, None
+
+        with metrics.stage(timer, "extract_call"):
+            texts = [future.result() for future in futures]
+    finally:
+        # Band requests still running for a receipt that is not a market receipt
+        # finish in the background, their answers are not needed
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    with metrics.stage(timer, "parse"):
+        try:
+            band_items = [parse_band_items(text) for text in texts]
+        except ValueError as e:
+            logger.warning("Band of a tiled receipt unreadable, extracting it with a single request: %s", e)
+            return None, None
+        items, dropped = merge_band_items(band_items, max_overlap)
+        receipt_data["items"] = items
+        reconciliation = reconcile(receipt_data, dropped)
+    if on_event is not None:
+        for index, item in enumerate(items):
+            on_event(("item", index, item))
+    return receipt_data, {"bands": count, "duplicates": len(dropped) - reconciliation["restored"],
+                          "reconciliation": reconciliation}
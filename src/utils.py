@@ -1,117 +1,958 @@
+import contextlib
+import io
+import json
+import math
+import re
 import cv2
 import numpy as np
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image
 
 ###################################################################
 # Image Preprocessing Functions
 ###################################################################
 
-def preprocess_image(image_path):
+# Longest side JPEGs are decoded at (via DCT scaling): twice the upload side,
+# so a receipt covering half of the photo still reaches the upload resolution
+DECODE_MAX_SIDE = 3200
+
+# Bytes held per pixel of the decoded image while a receipt is preprocessed:
+# decode buffer and array, cropped copy, threshold output and upload copies
+WORKING_BYTES_PER_PIXEL = 4
+
+def open_image(image, max_side=DECODE_MAX_SIDE):
+    """
+    Open an image without decoding it. JPEGs are set up to decode straight
+    to grayscale at the smallest DCT scale (1/2, 1/4 or 1/8) that keeps the
+    longest side at or above max_side, so a 48MP photo is never held at
+    full resolution.
+
+    Args:
+        image: file path, raw bytes or file-like object
+        max_side (int): smallest longest side to decode JPEGs at, None or 0 for full resolution
+
+    Returns:
+        PIL.Image: lazily decoded image, whose size is the size it will be decoded at
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = io.BytesIO(image)
+    image = Image.open(image)
+    if image.format == "JPEG":
+        width, height = image.size
+        scale = min(1.0, max_side / max(width, height)) if max_side else 1.0
+        image.draft("L", (math.ceil(width * scale), math.ceil(height * scale)))
+    return image
+
+def working_set_bytes(size):
+    """
+    Estimated memory needed to preprocess an image of the given decoded size.
+
+    Args:
+        size (tuple): (width, height), e.g. open_image(...).size
+
+    Returns:
+        int: bytes
+    """
+    return size[0] * size[1] * WORKING_BYTES_PER_PIXEL
+
+def load_grayscale(image, max_side=DECODE_MAX_SIDE):
+    """
+    Decode an image source straight into a single-channel array.
+
+    Encoded images are decoded at reduced resolution when they are larger
+    than needed: JPEGs by DCT scaling (see open_image()), other formats
+    by an integer box reduction right after decoding.
+
+    Args:
+        image: file path, raw bytes, file-like object, PIL image or ndarray (RGB/RGBA/gray)
+        max_side (int): smallest longest side to keep, None or 0 for full resolution
+
+    Returns:
+        ndarray: 2D uint8 grayscale array
+    """
+    if isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            return image
+        if image.shape[2] == 4:
+            return cv2.cvtColor(image, cv2.COLOR_RGBA2GRAY)
+        return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+    if not isinstance(image, Image.Image):
+        image = open_image(image, max_side)
+
+    # Let PIL convert to luma directly instead of going through RGB and BGR copies
+    gray = image if image.mode == 'L' else image.convert('L')
+    factor = max(gray.size) // max_side if max_side else 1
+    if factor >= 2:
+        gray = gray.reduce(factor)
+    return np.asarray(gray)
+
+def preview_image(image, max_side=1000):
+    """
+    Small JPEG rendition of an upload for display, decoded at reduced resolution.
+
+    Args:
+        image: file path, raw bytes or file-like object
+        max_side (int): longest side of the preview
+
+    Returns:
+        bytes: JPEG data
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = io.BytesIO(image)
+    image = Image.open(image)
+    image.draft("RGB", (max_side, max_side))
+    image = image.convert("RGB")
+    image.thumbnail((max_side, max_side))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+CROP_WORK_SIDE = 512
+CROP_MIN_AREA = 0.1
+CROP_MAX_AREA = 0.9
+CROP_MIN_RECTANGULARITY = 0.85
+CROP_MARGIN = 0.02
+# Largest tilt corrected; steeper receipts are left to the model, the pipeline does no orientation correction
+CROP_MAX_TILT = 30.0
+
+def find_receipt_quad(gray):
+    """
+    Locate the receipt in a photo.
+
+    Edges of a downscaled copy are closed into blobs and the largest blob is
+    taken as the receipt. It is accepted when it covers a plausible share of
+    the photo and fills most of its rotated bounding rectangle; a paper edge
+    merged with background clutter or a receipt filling the whole frame is
+    rejected, as is an outline tilted by more than CROP_MAX_TILT degrees or
+    whose rectified aspect ratio would swap that of the photo (a tall receipt
+    turned sideways).
+
+    Args:
+        gray (np.ndarray): grayscale image, e.g. from load_grayscale()
+
+    Returns:
+        tuple: (corners, area) with the four corners in image coordinates
+        (top-left, top-right, bottom-right, bottom-left) and the share of the
+        photo they cover, or (None, area) when no confident receipt was found
+    """
+    scale = CROP_WORK_SIDE / max(gray.shape)
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    edges = cv2.Canny(cv2.GaussianBlur(small, (5, 5), 0), 30, 90)
+    edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (15, 15)))
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None, 0.0
+
+    hull = max((cv2.convexHull(contour) for contour in contours), key=cv2.contourArea)
+    hull_area = cv2.contourArea(hull)
+    area = hull_area / (small.shape[0] * small.shape[1])
+    rect = cv2.minAreaRect(hull)
+    rectangularity = hull_area / max(rect[1][0] * rect[1][1], 1.0)
+    if not CROP_MIN_AREA <= area <= CROP_MAX_AREA or rectangularity < CROP_MIN_RECTANGULARITY:
+        return None, area
+
+    # A clean four-point outline also corrects the perspective, the rotated rectangle only the rotation
+    approx = cv2.approxPolyDP(hull, 0.02 * cv2.arcLength(hull, True), True)
+    points = approx.reshape(-1, 2) if len(approx) == 4 else cv2.boxPoints(rect)
+    points = points.astype(np.float32)
+    if len(np.unique(points, axis=0)) < 4:
+        return None, area
+
+    # Clockwise around the centroid (y points down), starting at the corner closest to the top-left direction
+    offsets = points - points.mean(axis=0)
+    angles = np.arctan2(offsets[:, 1], offsets[:, 0])
+    order = np.argsort(angles)
+    start = np.argmin(np.abs(np.angle(np.exp(1j * (angles[order] + 3 * np.pi / 4)))))
+    corners = points[np.roll(order, -start)]
+
+    top_left, top_right, bottom_right, bottom_left = corners
+    top = top_right - top_left
+    if abs(np.degrees(np.arctan2(top[1], top[0]))) > CROP_MAX_TILT:
+        return None, area
+    width = np.linalg.norm(top) + np.linalg.norm(bottom_right - bottom_left)
+    height = np.linalg.norm(bottom_left - top_left) + np.linalg.norm(bottom_right - top_right)
+    extent = np.ptp(corners, axis=0)
+    if (height > width) != (extent[1] > extent[0]):
+        return None, area
+    return corners / scale, area
+
+def crop_to_receipt(gray):
+    """
+    Perspective-correct and crop a photo to the receipt found by find_receipt_quad().
+    The full image is returned unchanged when no confident receipt was found.
+
+    Args:
+        gray (np.ndarray): grayscale image
+
+    Returns:
+        tuple: (image, info) with info {"cropped": bool, "area": share of the photo}
+    """
+    corners, area = find_receipt_quad(gray)
+    if corners is None:
+        return gray, {"cropped": False, "area": round(float(area), 3)}
+
+    # Keep a small margin so characters touching the detected edge are not cut off
+    center = corners.mean(axis=0)
+    corners = center + (corners - center) * (1 + CROP_MARGIN)
+    top_left, top_right, bottom_right, bottom_left = corners
+    width = int(round(max(np.linalg.norm(top_right - top_left), np.linalg.norm(bottom_right - bottom_left))))
+    height = int(round(max(np.linalg.norm(bottom_left - top_left), np.linalg.norm(bottom_right - top_right))))
+    target = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(corners.astype(np.float32), target)
+    cropped = cv2.warpPerspective(gray, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                                  borderMode=cv2.BORDER_REPLICATE)
+    return cropped, {"cropped": True, "area": round(float(area), 3)}
+
+QUALITY_WORK_SIDE = 512
+PREPROCESS_PROFILES = ("skip", "light", "full", "contrast")
+
+def assess_quality(gray):
+    """
+    Measure the quality of a grayscale image on a downscaled copy.
+
+    Args:
+        gray (np.ndarray): grayscale image
+
+    Returns:
+        dict: "sharpness" (variance of the Laplacian), "brightness" (mean),
+        "contrast" (standard deviation), "binary" (share of pixels that are
+        already black or white) and "resolution" (longest side in pixels)
+    """
+    small = gray
+    # Exact halving with INTER_AREA takes OpenCV's fast path, other factors are several times slower
+    while max(small.shape) >= 2 * QUALITY_WORK_SIDE:
+        height, width = small.shape[0] // 2, small.shape[1] // 2
+        small = cv2.resize(small[:height * 2, :width * 2], (width, height), interpolation=cv2.INTER_AREA)
+    if max(small.shape) > QUALITY_WORK_SIDE:
+        scale = QUALITY_WORK_SIDE / max(small.shape)
+        small = cv2.resize(small, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+
+    mean, std = cv2.meanStdDev(small)
+    histogram = cv2.calcHist([small], [0], None, [256], [0, 256]).ravel()
+    return {
+        "sharpness": round(float(cv2.Laplacian(small, cv2.CV_32F).var()), 1),
+        "brightness": round(float(mean[0, 0]), 1),
+        "contrast": round(float(std[0, 0]), 1),
+        "binary": round(float((histogram[:32].sum() + histogram[224:].sum()) / small.size), 3),
+        "resolution": max(gray.shape),
+    }
+
+def choose_profile(quality):
+    """
+    Choose the preprocessing profile for an image from assess_quality().
+
+    "skip" keeps images that are already black and white (scans, exports),
+    "contrast" stretches dim, overexposed or flat images before the full
+    chain, "light" thresholds sharp, well-exposed photos with a cheaper
+    filter and "full" runs the complete chain for blurry or small images.
+
+    Returns:
+        str: one of PREPROCESS_PROFILES
+    """
+    if quality["binary"] >= 0.8 and quality["contrast"] >= 40:
+        return "skip"
+    if quality["contrast"] < 20 or not 80 <= quality["brightness"] <= 235:
+        return "contrast"
+    if quality["sharpness"] >= 300 and quality["resolution"] >= 1000:
+        return "light"
+    return "full"
+
+def preprocess_image(image, profile="full", max_side=DECODE_MAX_SIDE):
     """
     Preprocess the image to get more accurate results from llm models.
 
     Args:
-        image_path (str): image path
+        image: file path, raw bytes, file-like object, PIL image or ndarray
+        profile (str): one of PREPROCESS_PROFILES, see choose_profile()
+        max_side (int): smallest longest side to decode encoded images at (see load_grayscale())
 
     Returns:
         image: preprocessed image
     """
-    # Open image with PIL and preserve orientation
-    img = Image.open(image_path)
-    
-    # Store original orientation to apply at the end
-    original_img = img.copy()
-    
-    # Convert to OpenCV format for advanced processing
-    img_cv = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-    
-    # Convert to grayscale
-    gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
-    
+    if profile not in PREPROCESS_PROFILES:
+        raise ValueError(f"Unknown preprocessing profile: {profile}")
+    gray = load_grayscale(image, max_side)
+    if profile == "skip":
+        return Image.fromarray(gray)
+
+    if profile == "light":
+        # A box-filtered local mean separates crisp text as well as the Gaussian at half the cost
+        thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 21, 10)
+        return Image.fromarray(thresh)
+
+    stretched = None
+    if profile == "contrast":
+        # Stretch dim or flat images first so the fixed offset below does not swallow faint text
+        histogram = cv2.calcHist([np.ascontiguousarray(gray[::4, ::4])], [0], None, [256], [0, 256]).ravel()
+        cumulative = np.cumsum(histogram) / histogram.sum()
+        low, high = int(np.searchsorted(cumulative, 0.01)), int(np.searchsorted(cumulative, 0.99))
+        if high - low < 128:
+            alpha = 255.0 / max(high - low, 1)
+            gray = stretched = cv2.convertScaleAbs(gray, alpha=alpha, beta=-low * alpha)
+
     # Apply adaptive thresholding to better separate text from background
-    thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                  cv2.THRESH_BINARY, 21, 10)
-    
-    # Noise removal with morphological operations
-    kernel = np.ones((1, 1), np.uint8)
-    opening = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel)
-    
-    # Skip deskewing as it might be causing orientation issues
-    # Convert back to PIL format - ensure it's in the right mode for web display
-    enhanced_img = Image.fromarray(opening).convert('RGB')
-    
-    # Apply additional PIL enhancements
-    enhancer = ImageEnhance.Contrast(enhanced_img)
-    enhanced_img = enhancer.enhance(2.0)  # Increased contrast
-    
-    sharpener = ImageEnhance.Sharpness(enhanced_img)
-    enhanced_img = sharpener.enhance(2.0)  # Increased sharpness
-    
-    # Ensure the enhanced image has the same size as the original
-    enhanced_img = enhanced_img.resize(original_img.size)
-    
-    return enhanced_img
+    # (into the stretched copy when there is one, the caller's array is left untouched)
+    thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                  cv2.THRESH_BINARY, 21, 10, dst=stretched)
+
+    # Rotation and perspective are corrected beforehand by crop_to_receipt() (see pipeline.process_receipt)
+    # The thresholded image only holds 0/255 pixels, so contrast and sharpness
+    # enhancement cannot change it any more and a 1x1 opening is a no-op
+    return Image.fromarray(thresh)
+
+def perceptual_hash(gray):
+    """
+    64-bit DCT perceptual hash of a grayscale image.
+
+    The image is reduced to 32x32 and the signs of its lowest 8x8 DCT
+    frequencies (relative to their median) form the hash, so re-compressed,
+    rescaled or slightly cropped copies of a photo differ in only a few bits.
+
+    Args:
+        gray (np.ndarray): grayscale image, e.g. from load_grayscale()
+
+    Returns:
+        int: unsigned 64-bit hash
+    """
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    # The DC term only tracks overall brightness; it is compared like the others but left out of the median
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view(">u8")[0])
+
+###################################################################
+# Upload Encoding Functions
+###################################################################
+
+UPLOAD_FORMATS = ("png1", "webp1", "png", "jpeg")
+
+def encode_for_upload(img, max_side=1600, image_format="webp1", jpeg_quality=85):
+    """
+    Downscale and re-encode the preprocessed image before it is sent to the model.
+
+    Args:
+        img (image): preprocessed image (PIL image or 2D uint8 array)
+        max_side (int): maximum length of the longest side, None or 0 to keep the size
+        image_format (str): "png1" (1-bit PNG, fastest), "webp1" (binary lossless WebP, smallest),
+            "png" (grayscale PNG) or "jpeg" (grayscale JPEG)
+        jpeg_quality (int): JPEG quality
+
+    Returns:
+        dict: inline image blob ({"mime_type": ..., "data": ...}) accepted by Gemini
+    """
+    if image_format not in UPLOAD_FORMATS:
+        raise ValueError(f"Unknown upload format: {image_format}")
+
+    gray = img if isinstance(img, np.ndarray) else np.asarray(img if img.mode == 'L' else img.convert('L'))
+    height, width = gray.shape
+    resized = bool(max_side) and max(height, width) > max_side
+    if resized:
+        scale = max_side / max(height, width)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+    buffer = io.BytesIO()
+    if image_format in ("png1", "webp1"):
+        # Re-binarize after area averaging so the image keeps its binary content
+        # (in place when the resize already made a private copy)
+        binary = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY, dst=gray if resized else None)[1]
+        if image_format == "png1":
+            Image.fromarray(binary).convert("1", dither=Image.Dither.NONE).save(buffer, format="PNG")
+        else:
+            Image.fromarray(binary).save(buffer, format="WEBP", lossless=True)
+    elif image_format == "png":
+        Image.fromarray(gray).save(buffer, format="PNG")
+    else:
+        Image.fromarray(gray).save(buffer, format="JPEG", quality=jpeg_quality)
+
+    mime_type = {"jpeg": "image/jpeg", "webp1": "image/webp"}.get(image_format, "image/png")
+    return {"mime_type": mime_type, "data": buffer.getvalue()}
 
 ###################################################################
 # Output Cleaning Functions
 ###################################################################
 
-def clean_json_string(text):
+OPENING_QUOTES = '"\u201c\u201e\u201f'
+CLOSING_SMART_QUOTES = '\u201d\u201c'
+STRING_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}
+JSON_SCALAR = re.compile(r'-?\d+(\.\d+)?([eE][+-]?\d+)?|true|false|null')
+
+def clean_json_string(text, opening='{'):
     """
     clean the json string to get more accurate results from llm models.
+    See repair_json() for the repairs.
 
     Args:
         text (str): response from llm models
+        opening (str): '{' to extract an object, '[' to extract an array
 
     Returns:
         text: cleaned text to be used in json.loads()
     """
-    
-    try:
-        if '```json' in text:
-            text = text.split('```json')[1]
-        elif '```' in text:
-            text = text.split('```')[1]
-        if '```' in text:
-            text = text.rsplit('```', 1)[0]
-        
-        text = text.strip()
-        text = text.replace('\n', '').replace('\r', '')
-        
-        return text
-    
-    except Exception as e:
-        print(f"Error in cleaning process: {e}")
-        return text
+    return repair_json(text, opening)[0]
+
+def repair_json(text, opening='{'):
+    """
+    Clean the JSON of an llm response and tell whether it was cut off.
+
+    Single pass over the response that keeps only the outermost JSON object
+    or array (dropping code fences and any surrounding text) and repairs common LLM
+    defects: smart quotes used as delimiters, raw line breaks inside strings,
+    trailing commas, unquoted words such as N/A and truncated output, which
+    is cut back to the last complete value and closed.
+
+    Args:
+        text (str): response from llm models
+        opening (str): '{' to extract an object, '[' to extract an array
+
+    Returns:
+        tuple: (cleaned text to be used in json.loads(), True when the
+        response was truncated and closed by the repair)
+    """
+    start = text.find(opening)
+    if start < 0:
+        return text.strip(), False
+
+    out = []
+    stack = []      # open containers: '{' or '['
+    expect = []     # per container: "key", "colon", "value" or "comma"
+    token = []      # unquoted scalar being read
+    in_string = False
+    smart_string = False
+    escape = False
+    safe_len, safe_stack = 0, []
+
+    def value_done():
+        nonlocal safe_len, safe_stack
+        if stack:
+            expect[-1] = "comma"
+        safe_len, safe_stack = len(out), list(stack)
+
+    def flush_token():
+        word = ''.join(token).strip()
+        token.clear()
+        if not word:
+            return
+        out.append(word if JSON_SCALAR.fullmatch(word) else json.dumps(word, ensure_ascii=False))
+        value_done()
+
+    def drop_trailing_comma():
+        while out and out[-1].isspace():
+            out.pop()
+        if out and out[-1] == ',':
+            out.pop()
+
+    for char in text[start:]:
+        if in_string:
+            if escape:
+                out.append(char)
+                escape = False
+            elif char == '\\':
+                out.append(char)
+                escape = True
+            elif char == '"' or (smart_string and char in CLOSING_SMART_QUOTES):
+                out.append('"')
+                in_string = False
+                if stack[-1] == '{' and expect[-1] == "key":
+                    expect[-1] = "colon"
+                else:
+                    value_done()
+            elif char in STRING_ESCAPES:
+                out.append(STRING_ESCAPES.get(char, char))
+            else:
+                out.append(char)
+            continue
+
+        if token and (char in ',:]}' or char.isspace() or char in OPENING_QUOTES):
+            flush_token()
+
+        if char in OPENING_QUOTES:
+            in_string = True
+            smart_string = char != '"'
+            out.append('"')
+        elif char in '{[':
+            stack.append(char)
+            expect.append("key" if char == '{' else "value")
+            out.append(char)
+            safe_len, safe_stack = len(out), list(stack)
+        elif char in '}]':
+            drop_trailing_comma()
+            out.append('}' if stack.pop() == '{' else ']')
+            expect.pop()
+            value_done()
+            if not stack:
+                break
+        elif char == ':':
+            out.append(char)
+            expect[-1] = "value"
+        elif char == ',':
+            out.append(char)
+            expect[-1] = "key" if stack[-1] == '{' else "value"
+        elif char.isspace():
+            out.append(' ')
+        else:
+            token.append(char)
+
+    if stack:
+        # Truncated response: drop the incomplete tail and close the open containers
+        del out[safe_len:]
+        drop_trailing_comma()
+        out.extend('}' if container == '{' else ']' for container in reversed(safe_stack))
+
+    return ''.join(out), bool(stack)
 
 def normalize_monetary_value(value_str):
     """
     Normalize monetary values by removing currency symbols and standardizing decimal separators.
+    Parsed like normalize_monetary_values() so both always agree.
     
     Args:
         value_str (str): The monetary value as a string
         
     Returns:
-        str: Normalized monetary value
+        str: Normalized monetary value with 2 decimal places, "n/a" or, when the
+        value cannot be parsed, the value without currency text
     """
-    if value_str.lower() == "n/a":
-        return value_str.lower()
-    
-    # Remove currency symbols and text
-    cleaned = value_str.lower().replace("tl", "").replace("₺", "").replace("lira", "").strip()
-    
-    try:
-        # Convert to float by first standardizing format
-        # Replace comma with dot for decimal point
-        numeric_str = cleaned.replace(",", ".")
-        
-        # Convert to float and format with 2 decimal places
-        float_value = float(numeric_str)
-        return f"{float_value:.2f}"
-    except ValueError:
-        # If conversion fails, return the original cleaned string
-        return cleaned
-    
+    if str(value_str).strip().lower() == "n/a":
+        return "n/a"
+
+    values, valid = normalize_monetary_values([value_str])
+    if valid[0]:
+        return f"{values[0]:.2f}"
+    return str(value_str).lower().replace("tl", "").replace("₺", "").replace("lira", "").strip()
+
+# Characters allowed before and after the digits of a monetary value ("TL", "TRY", "Lira", "₺", "%", spaces)
+MONETARY_NOISE = " \u00a0%*₺tlryiaTLRYIAİı"
+MAX_MONETARY_DIGITS = 18
+
+def normalize_monetary_values(values):
+    """
+    Normalize a whole column of monetary or percentage values at once.
+
+    Values are parsed with Turkish number formatting rules: "1.234,56 TL" ->
+    1234.56, "24,99" -> 24.99, "%20" -> 20.0. When both separators appear the
+    last one is the decimal separator; a single dot followed by exactly three
+    digits is a thousands separator. Currency text, "%" and spaces are only
+    accepted before and after the number ("1 2" and "1a2" are invalid), and
+    ints and floats are taken as they are. The column is viewed as a matrix of
+    UCS-4 code points and scanned one character position at a time for all
+    values together, so no Python code runs per value. Values that cannot be
+    parsed are reported in the mask instead of raising.
+
+    Args:
+        values (sequence): strings, numbers or None
+
+    Returns:
+        tuple: (float64 array with NaN for invalid values, boolean validity mask)
+    """
+    # Numbers need no parsing (str() would turn the float 1.234 into thousands grouping);
+    # the type check per value only runs for columns that are not all strings
+    values = list(values)
+    numeric = np.zeros(len(values), dtype=bool)
+    strings = values
+    if not set(map(type, values)) <= {str, type(None)}:
+        numeric[:] = [isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_))
+                      for value in values]
+        strings = [value if isinstance(value, str) else None for value in values]
+    text = np.array(["" if value is None else value for value in strings], dtype=str)
+    count = text.size
+    if count == 0:
+        return np.empty(0, dtype=np.float64), np.empty(0, dtype=bool)
+
+    # One row per character position, one column per value
+    width = text.dtype.itemsize // 4
+    positions = text.view(np.uint32).reshape(count, width).T.copy()
+
+    noise = np.zeros(0x10000, dtype=bool)
+    noise[[ord(c) for c in MONETARY_NOISE]] = True
+    noise[0] = True
+
+    mantissa = np.zeros(count, dtype=np.int64)
+    digits = np.zeros(count, dtype=np.int32)
+    commas = np.zeros(count, dtype=np.int32)
+    dots = np.zeros(count, dtype=np.int32)
+    digits_after_comma = np.zeros(count, dtype=np.int32)
+    digits_after_dot = np.zeros(count, dtype=np.int32)
+    comma_last = np.zeros(count, dtype=bool)
+    negative = np.zeros(count, dtype=bool)
+    started = np.zeros(count, dtype=bool)
+    ended = np.zeros(count, dtype=bool)
+    valid = np.ones(count, dtype=bool)
+
+    for codes in positions:
+        value = codes - 48
+        is_digit = value < 10
+        is_comma = codes == 44
+        is_dot = codes == 46
+        is_minus = codes == 45
+
+        np.copyto(mantissa, mantissa * 10 + value, where=is_digit)
+        digits += is_digit
+        digits_after_comma += is_digit
+        digits_after_dot += is_digit
+
+        commas += is_comma
+        digits_after_comma[is_comma] = 0
+        dots += is_dot
+        digits_after_dot[is_dot] = 0
+        comma_last[is_comma] = True
+        comma_last[is_dot] = False
+
+        # A sign is only accepted once and before the first digit
+        valid &= ~(is_minus & ((digits > 0) | negative))
+        negative |= is_minus
+        is_number = is_digit | is_comma | is_dot | is_minus
+        valid &= is_number | noise[np.minimum(codes, 0xFFFF)]
+
+        # Noise after the number has started ends it; nothing numeric may follow
+        valid &= ~(is_number & ended)
+        ended |= started & ~is_number
+        started |= is_number
+
+    # Decide per value which separator (if any) marks the decimals
+    comma_decimal = np.where(dots > 0, (commas > 0) & comma_last, commas == 1)
+    dot_decimal = np.where(commas > 0, (dots > 0) & ~comma_last, (dots == 1) & (digits_after_dot != 3))
+    decimals = np.where(comma_decimal, digits_after_comma, np.where(dot_decimal, digits_after_dot, 0))
+
+    mask = valid & (digits > 0) & (digits <= MAX_MONETARY_DIGITS)
+    result = mantissa / 10.0 ** decimals
+    np.negative(result, out=result, where=negative)
+    if numeric.any():
+        numbers = np.array([value for value, is_number in zip(values, numeric) if is_number], dtype=np.float64)
+        result[numeric] = numbers
+        mask[numeric] = np.isfinite(numbers)
+    result[~mask] = np.nan
+    return result, mask
+
+def receipt_amount_columns(receipts):
+    """
+    Collect and normalize the monetary columns of many receipts.
+
+    Args:
+        receipts (iterable): parsed receipt dicts
+
+    Returns:
+        dict: "total_amount", "vat_percentage" and "item_price" mapped to
+        (values, mask) tuples from normalize_monetary_values(); for every
+        item the column also carries its "item_name", "item_receipt" (receipt
+        index) and "item_position" (index in the receipt's item list).
+        Items that are not dicts are skipped.
+    """
+    totals, vats, prices, names, item_receipts, item_positions = [], [], [], [], [], []
+    for index, receipt in enumerate(receipts):
+        totals.append(receipt.get("total_amount"))
+        vats.append(receipt.get("vat_percentage"))
+        items = receipt.get("items")
+        for position, item in enumerate(items if isinstance(items, list) else ()):
+            if not isinstance(item, dict):
+                continue
+            prices.append(item.get("price"))
+            names.append(item.get("name"))
+            item_receipts.append(index)
+            item_positions.append(position)
+
+    return {
+        "total_amount": normalize_monetary_values(totals),
+        "vat_percentage": normalize_monetary_values(vats),
+        "item_price": normalize_monetary_values(prices),
+        "item_name": names,
+        "item_receipt": np.asarray(item_receipts, dtype=np.int64),
+        "item_position": np.asarray(item_positions, dtype=np.int64),
+    }
+
+###################################################################
+# Extraction Functions
+###################################################################
+
+EXTRACTION_MODE_ONE_SHOT = "one_shot"
+EXTRACTION_MODE_TWO_STEP = "two_step"
+EXTRACTION_MODES = (EXTRACTION_MODE_ONE_SHOT, EXTRACTION_MODE_TWO_STEP)
+
+def build_extraction_prompt(receipt_type):
+    """
+    Build the field extraction prompt for an already determined receipt type.
+
+    Args:
+        receipt_type (str): one of the keys of PROMPTS
+
+    Returns:
+        str: prompt asking for the JSON structure of the given type
+    """
+    return f"""Extract the receipt information based on the determined type ({receipt_type}) 
+    and return ONLY a valid JSON object with the following structure:
+    {PROMPTS[receipt_type]}
+    Return ONLY the JSON object with no additional text or formatting."""
+
+def build_tile_summary_prompt(receipt_type=None):
+    """
+    Build the prompt for the whole image of a tiled receipt: every field except the item list.
+
+    Args:
+        receipt_type (str): known receipt type, None to let the model determine it
+
+    Returns:
+        str: prompt
+    """
+    if receipt_type is None:
+        return TILE_SUMMARY_PROMPT
+    schema = MARKET_HEADER_PROMPT if receipt_type == "MARKET" else PROMPTS[receipt_type]
+    return f"""Extract the receipt information based on the determined type ({receipt_type}) 
+    and return ONLY a valid JSON object with the following structure:
+    {schema}
+    Do not list the purchased items, they are read separately.
+    Return ONLY the JSON object with no additional text or formatting."""
+
+def build_tile_items_prompt(part, count):
+    """
+    Build the prompt asking for the items of one band of a tiled receipt.
+
+    Args:
+        part (int): 1-based number of the band, from the top
+        count (int): number of bands
+
+    Returns:
+        str: prompt
+    """
+    return TILE_ITEMS_PROMPT.format(part=part, count=count)
+
+def _stage(timer, name):
+    """
+    Time a stage on the caller's timer (see metrics.StageTimer), nothing without one.
+    """
+    return timer.stage(name) if timer is not None else contextlib.nullcontext()
+
+def detect_receipt_type(backend, img, timer=None):
+    """
+    Ask the model for the receipt type.
+
+    Args:
+        backend (backends.ModelBackend): model backend
+        img (image): preprocessed image
+        timer (metrics.StageTimer): optional stage timer
+
+    Returns:
+        str: detected receipt type in upper case
+    """
+    with _stage(timer, "type_call"):
+        return backend.generate([img, TYPE_DETERMINATION_PROMPT]).strip().upper()
+
+def parse_receipt_response(text):
+    """
+    Parse the JSON object returned by the model.
+
+    Args:
+        text (str): response from llm models
+
+    Returns:
+        dict: parsed receipt data
+    """
+    if not text:
+        raise ValueError("Empty API response!")
+
+    return json.loads(clean_json_string(text), strict=False)
+
+def generate_text(backend, contents, stream=None):
+    """
+    Call the backend, streaming the response when a stream hook is given.
+
+    Args:
+        backend (backends.ModelBackend): model backend
+        contents (list): images and prompt strings
+        stream (callable): called when the response starts, returns the callable
+            receiving its text chunks (see streaming.event_stream())
+
+    Returns:
+        str: full response text
+    """
+    if stream is None:
+        return backend.generate(contents)
+
+    on_chunk = stream()
+    chunks = []
+    for chunk in backend.generate_stream(contents):
+        chunks.append(chunk)
+        on_chunk(chunk)
+    return "".join(chunks)
+
+def extract_receipt_data(backend, img, mode=EXTRACTION_MODE_ONE_SHOT, timer=None, stream=None,
+                         receipt_type=None):
+    """
+    Extract the receipt information from the preprocessed image.
+
+    In one-shot mode the image is sent once together with the schemas of all
+    receipt types and the returned "type" field decides which one was used.
+    The two-step mode detects the type first and then asks for the matching
+    schema. It is also used as a fallback when the one-shot response does not
+    carry a known type or cannot be parsed. A receipt type that is already known (e.g. from the
+    local classifier) skips type detection in both modes and only the
+    matching schema is sent.
+
+    Args:
+        backend (backends.ModelBackend): model backend
+        img (image): preprocessed image
+        mode (str): one of EXTRACTION_MODES
+        timer (metrics.StageTimer): optional stage timer
+        stream (callable): stream the extraction response through this hook (see
+            generate_text()), the returned data is unchanged
+        receipt_type (str): known receipt type, one of the keys of PROMPTS
+
+    Returns:
+        dict: parsed receipt data, always containing the "type" key
+    """
+    if mode not in EXTRACTION_MODES:
+        raise ValueError(f"Unknown extraction mode: {mode}")
+
+    if receipt_type is None and mode == EXTRACTION_MODE_ONE_SHOT:
+        with _stage(timer, "extract_call"):
+            text = generate_text(backend, [img, ONE_SHOT_PROMPT], stream)
+        with _stage(timer, "parse"):
+            try:
+                receipt_data = parse_receipt_response(text)
+            except ValueError:
+                # Unreadable answer (empty or not JSON), fall back to the two-step calls
+                receipt_data = {}
+        receipt_type = str(receipt_data.get("type", "")).strip().upper() if isinstance(receipt_data, dict) else ""
+        if receipt_type in PROMPTS:
+            receipt_data["type"] = receipt_type
+            return receipt_data
+        receipt_type = None
+
+    if receipt_type is None:
+        receipt_type = detect_receipt_type(backend, img, timer=timer)
+    if receipt_type not in PROMPTS:
+        raise ValueError(f"Unknown receipt type: {receipt_type}")
+
+    with _stage(timer, "extract_call"):
+        text = generate_text(backend, [img, build_extraction_prompt(receipt_type)], stream)
+    with _stage(timer, "parse"):
+        receipt_data = parse_receipt_response(text)
+    # The schema was chosen by the type, so it holds whatever the response says
+    receipt_data["type"] = receipt_type
+    return receipt_data
+
+def build_batch_prompt(count):
+    """
+    Build a prompt asking for the information of several receipt images at once.
+
+    Args:
+        count (int): number of images, labeled "Image 0:" to "Image {count - 1}:" in the contents
+
+    Returns:
+        str: prompt asking for a JSON array with one object per image
+    """
+    return f"""You are given {count} receipt images, each preceded by its label "Image 0:" to "Image {count - 1}:".
+For every image separately, determine the type of receipt and extract its information.
+The type is one of these values:
+"FUEL" for fuel/gas station receipts,
+"MARKET" for grocery/market receipts,
+"RESTAURANT" for food/restaurant receipts.
+Use the structure of the detected type for every image:
+FUEL:
+{PROMPTS["FUEL"]}
+MARKET:
+{PROMPTS["MARKET"]}
+RESTAURANT:
+{PROMPTS["RESTAURANT"]}
+The "type" field must be set to the detected type and an additional "index" field to the number of the image.
+Return ONLY a valid JSON array with exactly {count} objects, one per image in image order.
+Return ONLY the JSON array with no additional text or formatting."""
+
+def build_batch_contents(imgs):
+    """
+    Contents of a multi-image request: every image preceded by its label, then the batch prompt.
+    """
+    contents = []
+    for index, img in enumerate(imgs):
+        contents.extend([f"Image {index}:", img])
+    contents.append(build_batch_prompt(len(imgs)))
+    return contents
+
+def parse_batch_response(text, count):
+    """
+    Parse the JSON array returned for a multi-image request.
+
+    Args:
+        text (str): response from llm models
+        count (int): number of images in the request
+
+    Returns:
+        list: parsed receipt data per image, None where the response has no
+        usable object (missing, duplicated or unknown index, or unknown type)
+    """
+    if not text:
+        raise ValueError("Empty API response!")
+
+    items = json.loads(clean_json_string(text, opening='['), strict=False)
+    if not isinstance(items, list):
+        raise ValueError("Batch response is not a JSON array")
+
+    receipts = [None] * count
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        index = item.pop("index", None)
+        receipt_type = str(item.get("type", "")).strip().upper()
+        if not isinstance(index, int) or not 0 <= index < count or receipts[index] is not None:
+            continue
+        if receipt_type in PROMPTS:
+            item["type"] = receipt_type
+            receipts[index] = item
+    return receipts
+
+def extract_receipt_batch(backend, imgs):
+    """
+    Extract the information of several receipts with a single model request.
+
+    Args:
+        backend (backends.ModelBackend): model backend
+        imgs (list): preprocessed images
+
+    Returns:
+        list: parsed receipt data per image, None where the response was unusable
+    """
+    text = backend.generate(build_batch_contents(imgs))
+    return parse_batch_response(text, len(imgs))
+
+def build_reask_prompt(receipt_type, fields):
+    """
+    Build a prompt asking again for only some fields of an extracted receipt.
+
+    Args:
+        receipt_type (str): one of the keys of PROMPTS
+        fields (list): names of the fields to extract again
+
+    Returns:
+        str: prompt asking for a JSON object with just these fields
+    """
+    return f"""Some fields of the receipt ({receipt_type}) could not be read: {", ".join(fields)}.
+    Extract ONLY these fields, following their description in this structure:
+    {PROMPTS[receipt_type]}
+    Return ONLY a valid JSON object with exactly these keys: {", ".join(fields)}.
+    Return ONLY the JSON object with no additional text or formatting."""
+
+def reask_fields(backend, img, receipt_data, fields, timer=None):
+    """
+    Ask the model again for the failing fields only and merge them into the receipt.
+
+    Args:
+        backend (backends.ModelBackend): model backend
+        img (image): preprocessed image
+        receipt_data (dict): parsed receipt data with a known "type"
+        fields (list): names of the missing or malformed fields
+        timer (metrics.StageTimer): optional stage timer
+
+    Returns:
+        dict: receipt data with the re-extracted fields
+    """
+    with _stage(timer, "reask_call"):
+        text = backend.generate([img, build_reask_prompt(receipt_data["type"], fields)])
+    with _stage(timer, "parse"):
+        answer = parse_receipt_response(text)
+
+    merged = dict(receipt_data)
+    merged.update({name: answer[name] for name in fields if name in answer})
+    return merged
+
 ###################################################################
 # Prompt Configuration
 ###################################################################
@@ -157,4 +998,60 @@ PROMPTS = {
         ]
     }
     """
-}
\ No newline at end of file
+}
+
+ONE_SHOT_PROMPT = f"""Determine the type of receipt from the image and extract its information in a single step.
+The type is one of these values:
+"FUEL" for fuel/gas station receipts,
+"MARKET" for grocery/market receipts,
+"RESTAURANT" for food/restaurant receipts.
+Return ONLY a valid JSON object using the structure of the detected type:
+FUEL:
+{PROMPTS["FUEL"]}
+MARKET:
+{PROMPTS["MARKET"]}
+RESTAURANT:
+{PROMPTS["RESTAURANT"]}
+The "type" field must be set to the detected type.
+Return ONLY the JSON object with no additional text or formatting."""
+
+# Header and footer fields of a market receipt, asked for on the whole image
+# while the items are read from the bands (see tiling.py)
+MARKET_HEADER_PROMPT = """
+    {
+        "type": "MARKET",
+        "business_name": "Name of the market/store",
+        "date": "Date of purchase (DD.MM.YYYY)",
+        "total_amount": "Total amount paid"
+    }
+    """
+
+TILE_SUMMARY_PROMPT = f"""Determine the type of receipt from the image and extract its information in a single step.
+The type is one of these values:
+"FUEL" for fuel/gas station receipts,
+"MARKET" for grocery/market receipts,
+"RESTAURANT" for food/restaurant receipts.
+Return ONLY a valid JSON object using the structure of the detected type:
+FUEL:
+{PROMPTS["FUEL"]}
+MARKET:
+{MARKET_HEADER_PROMPT}
+RESTAURANT:
+{PROMPTS["RESTAURANT"]}
+The "type" field must be set to the detected type. Do not list the purchased items of market receipts, they are read separately.
+Return ONLY the JSON object with no additional text or formatting."""
+
+TILE_ITEMS_PROMPT = """The image is part {part} of {count} of a long grocery receipt cut into horizontal bands; neighbouring parts repeat a few lines at their edges.
+Extract the purchased items printed in this part, from top to bottom, and return ONLY a valid JSON object with the following structure:
+    {{
+        "items": [
+            {{
+                "name": "Item name (item name can not be contains only kg information. It should be concat with next line. It should be like this: 2,078 KG X 24,99 TL MV. Sogan KURU.)",
+                "price": "Item price"
+            }},
+            ...
+        ]
+    }}
+Leave out the store header, the totals and payment lines, and any line cut off at the top or bottom edge.
+Return {{"items": []}} when the part shows no items.
+Return ONLY the JSON object with no additional text or formatting."""
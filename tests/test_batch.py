@@ -0,0 +1,71 @@
+import json
+import pytest
+import batch
+
+def make_inputs(directory, count):
+    paths = []
+    for i in range(count):
+        path = directory / f"receipt-{i:02d}.jpg"
+        path.write_bytes(b"not decoded by the test process")
+        paths.append(str(path))
+    return paths
+
+def extract(image_path, backend, mode, cache):
+    """
+    Stand-in for pipeline.process_receipt.
+    """
+    return {"success": True, "data": {"type": "FUEL", "business_name": image_path}, "processing_time": 0.01}
+
+def output_files(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["file"] for line in f]
+
+def test_resume_after_interruption(tmp_path):
+    paths = make_inputs(tmp_path, 8)
+    output = str(tmp_path / "results.jsonl")
+
+    def interrupted(image_path, backend, mode, cache):
+        if image_path == paths[5]:
+            raise KeyboardInterrupt
+        return extract(image_path, backend, mode, cache)
+
+    with pytest.raises(KeyboardInterrupt):
+        batch.run_batch([str(tmp_path)], None, output, workers=1, process=interrupted)
+    finished = output_files(output)
+    assert sorted(finished) == paths[:5]
+
+    processed = []
+    stats = batch.run_batch([str(tmp_path)], None, output, workers=3,
+                            process=extract, on_result=lambda image_path, result: processed.append(image_path))
+    assert stats["skipped"] == len(finished)
+    assert stats["processed"] == len(paths) - len(finished)
+    assert sorted(processed) == paths[5:]
+    assert sorted(output_files(output)) == paths
+
+def test_checkpointed_inputs_are_skipped(tmp_path):
+    paths = make_inputs(tmp_path, 5)
+    output = str(tmp_path / "results.jsonl")
+    checkpoint = tmp_path / "done.txt"
+    checkpoint.write_text("".join(f"{path}\n" for path in paths[:3]))
+
+    stats = batch.run_batch([str(tmp_path)], None, output, checkpoint_path=str(checkpoint), process=extract)
+    assert (stats["skipped"], stats["processed"]) == (3, 2)
+    assert sorted(output_files(output)) == paths[3:]
+
+    stats = batch.run_batch([str(tmp_path)], None, output, checkpoint_path=str(checkpoint), process=extract)
+    assert (stats["skipped"], stats["processed"]) == (5, 0)
+    assert sorted(output_files(output)) == paths[3:]
+
+def test_failed_receipts_are_retried(tmp_path):
+    paths = make_inputs(tmp_path, 3)
+    output = str(tmp_path / "results.jsonl")
+
+    def failing(image_path, backend, mode, cache):
+        if image_path == paths[1]:
+            return {"success": False, "error": "Analysis error", "processing_time": 0.01}
+        return extract(image_path, backend, mode, cache)
+
+    stats = batch.run_batch([str(tmp_path)], None, output, process=failing)
+    assert (stats["processed"], stats["failed"]) == (3, 1)
+    stats = batch.run_batch([str(tmp_path)], None, output, process=extract)
+    assert (stats["skipped"], stats["processed"], stats["failed"]) == (2, 1, 0)
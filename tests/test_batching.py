@@ -0,0 +1,103 @@
+import json
+import os
+import threading
+import time
+import backends
+import batching
+import pipeline
+import utils
+
+TEST_IMAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test-images")
+
+RECEIPT = {"type": "FUEL", "business_name": "AKPET", "date": "30.04.2025", "license_plate": "16JPS22",
+           "total_amount": "2.500,00", "vat_percentage": "%20"}
+
+class CountingBackend(backends.ModelBackend):
+    """
+    Backend answering every prompt with the same receipt, as an array for batches.
+    """
+
+    name = "counting"
+    model_name = "counting"
+
+    def __init__(self):
+        self.prompts = []
+
+    def generate(self, contents):
+        prompt = contents[-1]
+        self.prompts.append(prompt)
+        images = len(contents) // 2
+        if images > 1:
+            return json.dumps([dict(RECEIPT, index=index) for index in range(images)])
+        if prompt == utils.TYPE_DETERMINATION_PROMPT:
+            return "FUEL"
+        return json.dumps(RECEIPT)
+
+def test_lone_receipt_is_not_delayed():
+    with batching.BatchingScheduler(CountingBackend(), max_batch_size=4, max_wait=5.0) as scheduler:
+        start = time.perf_counter()
+        assert scheduler.extract({"data": b"image"}) is None
+        assert time.perf_counter() - start < 1.0
+        assert scheduler.stats()["single"] == 1
+
+def test_announced_receipts_are_waited_for():
+    backend = CountingBackend()
+    with batching.BatchingScheduler(backend, max_batch_size=2, max_wait=5.0) as scheduler:
+        scheduler.announce()
+        scheduler.announce()
+        results = []
+        first = threading.Thread(target=lambda: results.append(scheduler.extract({"data": b"a"}, announced=True)))
+        first.start()
+        time.sleep(0.1)
+        results.append(scheduler.extract({"data": b"b"}, announced=True))
+        first.join()
+        assert scheduler.stats()["batches"] == 1
+        assert all(result is not None for result in results)
+
+def test_withdrawn_receipt_releases_the_batch():
+    with batching.BatchingScheduler(CountingBackend(), max_batch_size=4, max_wait=5.0) as scheduler:
+        scheduler.announce()
+        scheduler.announce()
+        timer = threading.Timer(0.1, scheduler.withdraw)
+        timer.start()
+        start = time.perf_counter()
+        assert scheduler.extract({"data": b"a"}, announced=True) is None
+        assert time.perf_counter() - start < 1.0
+        timer.join()
+
+def test_pipeline_skips_the_scheduler_outside_one_shot(monkeypatch):
+    monkeypatch.setenv("RECEIPT_CROP", "0")
+    image = os.path.join(TEST_IMAGES, "fuel-5.jpeg")
+    backend = CountingBackend()
+    with batching.BatchingScheduler(backend, max_batch_size=4, max_wait=5.0) as scheduler:
+        result = pipeline.process_receipt(image, backend, mode=utils.EXTRACTION_MODE_TWO_STEP, scheduler=scheduler)
+        assert result["success"], result.get("error")
+        assert "batch_wait" not in result["stages"]
+        assert backend.prompts == [utils.TYPE_DETERMINATION_PROMPT, utils.build_extraction_prompt("FUEL")]
+        assert scheduler.upcoming == 0
+
+        result = pipeline.process_receipt(image, backend, scheduler=scheduler)
+        assert result["success"], result.get("error")
+        assert result["stages"]["batch_wait"] < 1.0
+        assert scheduler.upcoming == 0
+
+class AcceptingClassifier:
+    """
+    Local classifier settling every receipt as FUEL.
+    """
+
+    def classify(self, img):
+        return {"type": "FUEL", "confidence": 1.0, "accepted": True}
+
+def test_classified_receipt_stops_holding_batches(monkeypatch):
+    monkeypatch.setenv("RECEIPT_CROP", "0")
+    backend = CountingBackend()
+    with batching.BatchingScheduler(backend, max_batch_size=4, max_wait=5.0) as scheduler:
+        upcoming = []
+        generate = backend.generate
+        monkeypatch.setattr(backend, "generate", lambda contents: upcoming.append(scheduler.upcoming) or generate(contents))
+        result = pipeline.process_receipt(os.path.join(TEST_IMAGES, "fuel-5.jpeg"), backend, scheduler=scheduler,
+                                          classifier=AcceptingClassifier())
+        assert result["success"], result.get("error")
+        assert upcoming == [0]
+        assert backend.prompts == [utils.build_extraction_prompt("FUEL")]
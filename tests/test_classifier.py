@@ -0,0 +1,87 @@
+import json
+import numpy as np
+import pytest
+import classifier
+
+def receipt(lines, priced, width=300):
+    """
+    White receipt with `lines` black text lines, the first `priced` of them
+    ending in a price at the right edge.
+    """
+    image = np.full((40 + lines * 24, width), 255, np.uint8)
+    for line in range(lines):
+        top = 20 + line * 24
+        image[top:top + 10, 20:width // 3] = 0
+        if line < priced:
+            image[top:top + 10, width - 60:width - 20] = 0
+    return image
+
+def samples():
+    """
+    Short fuel slips, long market slips full of priced lines and restaurant slips in between.
+    """
+    images = ([(receipt(lines, 1), "FUEL") for lines in (6, 7, 8)]
+              + [(receipt(lines, lines - 4), "MARKET") for lines in (60, 70, 80)]
+              + [(receipt(lines, lines // 2), "RESTAURANT") for lines in (20, 24, 28)])
+    features = np.array([classifier.layout_features(image) for image, _ in images])
+    return features, [label for _, label in images]
+
+@pytest.fixture
+def model():
+    features, labels = samples()
+    return classifier.ReceiptTypeClassifier.fit(features, labels, threshold=0.8)
+
+@pytest.mark.parametrize("image, label", [(receipt(7, 1), "FUEL"), (receipt(75, 70), "MARKET"),
+                                          (receipt(22, 11), "RESTAURANT")])
+def test_classifies_layouts(model, image, label):
+    classification = model.classify(image)
+    assert classification["type"] == label
+    assert classification["accepted"]
+    assert 0.8 <= classification["confidence"] <= 1.0
+
+def test_threshold_decides_acceptance(model):
+    image = receipt(22, 11)
+    _, confidence = model.predict(classifier.layout_features(image))
+    model.threshold = confidence
+    assert model.classify(image)["accepted"]
+    model.threshold = np.nextafter(confidence, 2.0)
+    assert not model.classify(image)["accepted"]
+
+def test_ambiguous_receipt_is_not_accepted(model):
+    # Halfway between two centroids the confidence drops to about one half
+    point = (model.centroids["FUEL"] + model.centroids["RESTAURANT"]) / 2 * model.scale + model.mean
+    receipt_type, confidence = model.predict(point)
+    assert receipt_type in ("FUEL", "RESTAURANT")
+    assert confidence < model.threshold
+
+def test_save_and_load_round_trip(model, tmp_path):
+    path = str(tmp_path / "classifier.json")
+    model.save(path)
+    loaded = classifier.ReceiptTypeClassifier.load(path)
+    features, _ = samples()
+    for row in features:
+        assert loaded.predict(row) == pytest.approx(model.predict(row))
+    assert loaded.threshold == 0.8
+    assert classifier.ReceiptTypeClassifier.load(path, threshold=0.95).threshold == 0.95
+
+def test_load_rejects_other_features(model, tmp_path):
+    path = tmp_path / "classifier.json"
+    stored = model.to_dict()
+    stored["features"] = stored["features"][:-1]
+    path.write_text(json.dumps(stored))
+    with pytest.raises(ValueError):
+        classifier.ReceiptTypeClassifier.load(str(path))
+
+def test_classifier_is_opt_in(monkeypatch, model, tmp_path):
+    monkeypatch.delenv("CLASSIFIER_MODEL", raising=False)
+    assert classifier.create_classifier() is None
+    path = str(tmp_path / "classifier.json")
+    model.save(path)
+    monkeypatch.setenv("CLASSIFIER_MODEL", path)
+    monkeypatch.setenv("CLASSIFIER_THRESHOLD", "0.9")
+    assert classifier.create_classifier().threshold == 0.9
+
+def test_labels_from_filenames():
+    assert classifier.label_from_filename("test-images/fuel-5.jpeg") == "FUEL"
+    assert classifier.label_from_filename("meal_9.jpg") == "RESTAURANT"
+    assert classifier.label_from_filename("scan-1.jpg") is None
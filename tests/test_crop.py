@@ -0,0 +1,53 @@
+import cv2
+import numpy as np
+import pytest
+import pipeline
+import utils
+
+def photo(angle, size=(300, 800)):
+    """
+    Light upright receipt of the given (width, height) with a dark mark near its
+    top-left corner, rotated by angle degrees on a dark background.
+    """
+    image = np.full((1200, 1200), 40, np.uint8)
+    width, height = size
+    left, top = 600 - width // 2, 600 - height // 2
+    image[top:top + height, left:left + width] = 230
+    cv2.circle(image, (left + 40, top + 40), 15, 0, -1)
+    matrix = cv2.getRotationMatrix2D((600, 600), angle, 1.0)
+    return cv2.warpAffine(image, matrix, (1200, 1200), flags=cv2.INTER_NEAREST, borderValue=40)
+
+@pytest.mark.parametrize("angle", [0, 5, 20, -20, 29])
+def test_small_tilts_are_straightened_upright(angle):
+    cropped, info = utils.crop_to_receipt(photo(angle))
+    assert info["cropped"]
+    height, width = cropped.shape
+    assert height > 2 * width
+    # The mark stays in the top-left quarter: the receipt is neither flipped nor turned
+    # (the crop keeps a margin of background around the receipt, so look inside it)
+    inner = cropped[height // 20:-height // 20, width // 10:-width // 10]
+    assert inner[:height // 4, :width // 2].min() < 100
+    assert inner[height // 4:, :].min() > 100
+    assert inner[:, width // 2:].min() > 100
+
+@pytest.mark.parametrize("angle", [35, 45, -45])
+def test_steep_tilts_are_left_alone(angle):
+    cropped, info = utils.crop_to_receipt(photo(angle))
+    assert not info["cropped"]
+    assert cropped.shape == (1200, 1200)
+
+@pytest.mark.parametrize("angle", [60, 90, -60])
+def test_sideways_receipts_keep_the_photo_orientation(angle):
+    cropped, info = utils.crop_to_receipt(photo(angle))
+    if info["cropped"]:
+        height, width = cropped.shape
+        assert width > height
+
+def test_cropping_is_opt_in(monkeypatch):
+    monkeypatch.delenv("RECEIPT_CROP", raising=False)
+    assert not pipeline.crop_enabled()
+    _, info = pipeline.prepare_image(photo(10), profile="light")
+    assert "crop" not in info
+    monkeypatch.setenv("RECEIPT_CROP", "1")
+    _, info = pipeline.prepare_image(photo(10), profile="light")
+    assert info["crop"]["cropped"]
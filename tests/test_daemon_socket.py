@@ -0,0 +1,63 @@
+import asyncio
+import os
+import socket
+import stat
+import pytest
+import daemon_socket
+import service
+
+@pytest.fixture
+def path():
+    # Unix socket paths are limited to about 100 bytes, pytest's tmp_path can be longer
+    path = os.path.join("/tmp", f"receipt-extractor-test-{os.getpid()}.sock")
+    yield path
+    if os.path.lexists(path):
+        os.unlink(path)
+
+def listen(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen()
+    return sock
+
+def test_stale_socket_is_removed(path):
+    listen(path).close()
+    assert os.path.exists(path)
+    daemon_socket.remove_stale_socket(path)
+    assert not os.path.exists(path)
+
+def test_live_daemon_is_kept(path):
+    sock = listen(path)
+    try:
+        with pytest.raises(daemon_socket.SocketInUse):
+            daemon_socket.remove_stale_socket(path)
+        assert os.path.exists(path)
+    finally:
+        sock.close()
+
+def test_other_files_are_kept(path):
+    with open(path, "w") as f:
+        f.write("not a socket")
+    with pytest.raises(daemon_socket.SocketInUse):
+        daemon_socket.remove_stale_socket(path)
+    assert os.path.isfile(path)
+
+def test_service_socket_is_private(path):
+    async def start():
+        extraction = service.ExtractionService(backend=None, workers=1)
+        server = await extraction.start(unix_socket=path)
+        mode = os.stat(path).st_mode
+        server.close()
+        for task in extraction.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*extraction.worker_tasks, return_exceptions=True)
+        return mode
+
+    umask = os.umask(0o022)
+    try:
+        mode = asyncio.run(start())
+        assert os.umask(0o022) == 0o022
+    finally:
+        os.umask(umask)
+    assert stat.S_ISSOCK(mode)
+    assert stat.S_IMODE(mode) & 0o077 == 0
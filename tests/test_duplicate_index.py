@@ -0,0 +1,41 @@
+import os
+import backends
+import duplicate_index
+import pipeline
+
+TEST_IMAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test-images")
+
+def test_near_duplicate_is_not_reported_as_cached(tmp_path, monkeypatch):
+    monkeypatch.delenv("RECEIPT_CROP", raising=False)
+    backend = backends.FakeBackend(seed=1)
+    index = duplicate_index.DuplicateIndex(str(tmp_path / "duplicates.sqlite3"), backend.model_name)
+    image = os.path.join(TEST_IMAGES, "fuel-5.jpeg")
+    first = pipeline.process_receipt(image, backend, duplicate_index=index)
+    second = pipeline.process_receipt(image, backend, duplicate_index=index)
+    index.close()
+    assert first["success"] and "duplicate" not in first
+    assert second["success"]
+    assert second["duplicate"]["distance"] == 0
+    assert second["cached"] is False
+    assert second["data"] == first["data"]
+
+def test_hash_distance_counts_bits():
+    masks = duplicate_index.chunk_masks(1)
+    assert masks[0] == 0
+    assert sorted(bin(int(mask)).count("1") for mask in masks) == [0] + [1] * (len(masks) - 1)
+
+def test_other_prompt_versions_survive_reopening(tmp_path, monkeypatch):
+    path = str(tmp_path / "duplicates.sqlite3")
+    index = duplicate_index.DuplicateIndex(path, "model")
+    index.add(0x0F0F, {"type": "FUEL"})
+    index.close()
+
+    monkeypatch.setattr(duplicate_index, "prompt_version", lambda: "newer")
+    index = duplicate_index.DuplicateIndex(path, "model")
+    assert index.lookup(0x0F0F) is None
+    index.close()
+
+    monkeypatch.undo()
+    index = duplicate_index.DuplicateIndex(path, "model")
+    assert index.lookup(0x0F0F)["data"] == {"type": "FUEL"}
+    index.close()
@@ -0,0 +1,64 @@
+import json
+import os
+import pytest
+import backends
+import pipeline
+import utils
+
+TEST_IMAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test-images")
+
+FUEL = {"business_name": "AKPET", "date": "30.04.2025", "license_plate": "16JPS22",
+        "total_amount": "2.500,00", "vat_percentage": "%20"}
+
+class ScriptedBackend(backends.ModelBackend):
+    """
+    Backend answering the type call, the one-shot call and the per-type
+    extraction with fixed texts, recording the prompts it received.
+    """
+
+    name = "scripted"
+    model_name = "scripted"
+
+    def __init__(self, type_text=None, one_shot_text=None, extract_text=None):
+        self.texts = {"type": type_text, "one_shot": one_shot_text, "extract": extract_text}
+        self.prompts = []
+
+    def generate(self, contents):
+        prompt = contents[-1]
+        self.prompts.append(prompt)
+        if prompt == utils.TYPE_DETERMINATION_PROMPT:
+            return self.texts["type"]
+        if prompt == utils.ONE_SHOT_PROMPT:
+            return self.texts["one_shot"]
+        return self.texts["extract"]
+
+@pytest.mark.parametrize("answer", [FUEL, dict(FUEL, type="fuel"), dict(FUEL, type="MARKET")])
+def test_two_step_sets_detected_type(answer):
+    backend = ScriptedBackend(type_text="FUEL", extract_text=json.dumps(answer))
+    data = utils.extract_receipt_data(backend, b"image", mode=utils.EXTRACTION_MODE_TWO_STEP)
+    assert data["type"] == "FUEL"
+
+def test_known_type_sets_type_without_type_call():
+    backend = ScriptedBackend(extract_text=json.dumps(FUEL))
+    data = utils.extract_receipt_data(backend, b"image", receipt_type="FUEL")
+    assert data["type"] == "FUEL"
+    assert backend.prompts == [utils.build_extraction_prompt("FUEL")]
+
+def test_pipeline_two_step_response_without_type(monkeypatch):
+    monkeypatch.setenv("RECEIPT_CROP", "0")
+    backend = ScriptedBackend(type_text="FUEL", extract_text=json.dumps(FUEL))
+    result = pipeline.process_receipt(os.path.join(TEST_IMAGES, "fuel-5.jpeg"), backend,
+                                      mode=utils.EXTRACTION_MODE_TWO_STEP)
+    assert result["success"], result.get("error")
+    assert result["data"]["type"] == "FUEL"
+    assert result["data"]["license_plate"] == "16JPS22"
+
+@pytest.mark.parametrize("one_shot_text", ["", "I cannot read this receipt.", '["not", "an object"]',
+                                           json.dumps(dict(FUEL, type="INVOICE"))])
+def test_unusable_one_shot_falls_back_to_two_step(one_shot_text):
+    backend = ScriptedBackend(type_text="FUEL", one_shot_text=one_shot_text, extract_text=json.dumps(FUEL))
+    data = utils.extract_receipt_data(backend, b"image")
+    assert data["type"] == "FUEL"
+    assert data["license_plate"] == "16JPS22"
+    assert backend.prompts == [utils.ONE_SHOT_PROMPT, utils.TYPE_DETERMINATION_PROMPT,
+                               utils.build_extraction_prompt("FUEL")]
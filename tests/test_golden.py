@@ -0,0 +1,58 @@
+import os
+import sys
+import pytest
+import utils
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks")
+TEST_IMAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test-images")
+sys.path.insert(0, BENCHMARKS)
+
+import bench_golden
+
+# Accuracy of the shipped recordings against the golden files; one more wrong field drops below it
+MIN_ACCURACY = 0.95
+
+@pytest.fixture(autouse=True)
+def pipeline_defaults(monkeypatch):
+    for name in ("RECEIPT_CROP", "RECEIPT_TILING", "PREPROCESS_PROFILE", "UPLOAD_FORMAT", "UPLOAD_MAX_SIDE",
+                 "DECODE_MAX_SIDE"):
+        monkeypatch.delenv(name, raising=False)
+
+def run_golden(*argv):
+    args = bench_golden.parse_args([TEST_IMAGES, "--repeat", "1", "--min-accuracy", str(MIN_ACCURACY), *argv])
+    entries = bench_golden.load_corpus(args.corpus)
+    results, elapsed, peak_mb = bench_golden.run(entries, args)
+    report = bench_golden.build_report(results, elapsed, peak_mb, args)
+    return report, bench_golden.check_regressions(report, None, args)
+
+@pytest.mark.parametrize("mode", utils.EXTRACTION_MODES)
+def test_golden_receipts(mode):
+    report, regressions = run_golden("--mode", mode)
+    assert regressions == []
+    assert report["failed"] == 0
+    assert report["replay"]["missing"] == report["replay"]["stale"] == 0
+    assert report["accuracy"]["scored_receipts"] == report["receipts"]
+    assert report["accuracy"]["items"]["f1"] == 1.0
+
+def test_failed_receipts_are_regressions(monkeypatch):
+    def fail(text):
+        raise ValueError("parser broken")
+    monkeypatch.setattr(utils, "parse_receipt_response", fail)
+    report, regressions = run_golden()
+    assert report["failed"] == report["receipts"]
+    assert any("receipts failed" in regression for regression in regressions)
+
+def test_changed_prompt_is_stale(monkeypatch):
+    monkeypatch.setattr(utils, "ONE_SHOT_PROMPT", utils.ONE_SHOT_PROMPT + "\nBe precise.")
+    report, regressions = run_golden()
+    assert report["replay"]["stale"] == report["receipts"]
+    assert any("stale" in regression for regression in regressions)
+    _, regressions = run_golden("--allow-stale")
+    assert regressions == []
+
+def test_field_normalization():
+    assert bench_golden.field_matches("total_amount", "2500,00 TL", "2.500,00")
+    assert bench_golden.field_matches("date", "30/04/2025", "30.04.2025")
+    assert bench_golden.field_matches("license_plate", "16 jps 22", "16JPS22")
+    assert not bench_golden.field_matches("total_amount", "2.500,01", "2.500,00")
+    assert not bench_golden.field_matches("date", None, "30.04.2025")
@@ -0,0 +1,47 @@
+import math
+import pytest
+import utils
+
+@pytest.mark.parametrize("text, expected", [
+    ("1.234,56 TL", 1234.56),
+    ("24,99", 24.99),
+    ("*805,25", 805.25),
+    ("%20", 20.0),
+    ("20 %", 20.0),
+    ("₺1.234,56", 1234.56),
+    ("TL 12,50", 12.5),
+    ("1,234.56", 1234.56),
+    ("1.234", 1234.0),
+    ("12.5", 12.5),
+    ("-12,00", -12.0),
+    (1.234, 1.234),
+    (5, 5.0),
+])
+def test_valid_values(text, expected):
+    values, valid = utils.normalize_monetary_values([text])
+    assert valid[0]
+    assert values[0] == pytest.approx(expected)
+
+@pytest.mark.parametrize("text", ["1a2", "1 2", "12 TL 5", "12-", "--1", "TL", "", None, "n/a", True, float("nan")])
+def test_invalid_values(text):
+    values, valid = utils.normalize_monetary_values([text])
+    assert not valid[0]
+    assert math.isnan(values[0])
+
+def test_column_mixes_strings_and_numbers():
+    values, valid = utils.normalize_monetary_values(["1.234,56", 2.5, None, "1a2"])
+    assert valid.tolist() == [True, True, False, False]
+    assert values[:2].tolist() == [1234.56, 2.5]
+
+@pytest.mark.parametrize("text", ["1.234,56 TL", "24,99", "1.234", "1a2", "abc", 7.5])
+def test_single_value_agrees_with_column(text):
+    values, valid = utils.normalize_monetary_values([text])
+    single = utils.normalize_monetary_value(text)
+    if valid[0]:
+        assert single == f"{values[0]:.2f}"
+    else:
+        with pytest.raises(ValueError):
+            float(single)
+
+def test_not_available():
+    assert utils.normalize_monetary_value("N/A") == "n/a"
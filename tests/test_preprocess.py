@@ -0,0 +1,38 @@
+import cv2
+import numpy as np
+import pytest
+import utils
+
+def dim_receipt():
+    """
+    Flat, dark page (value 60) with faint text strokes (value 52).
+    """
+    image = np.full((400, 300), 60, np.uint8)
+    for top in range(40, 360, 40):
+        image[top:top + 6, 30:270] = 52
+    return image
+
+def test_full_profile_does_not_stretch():
+    gray = dim_receipt()
+    expected = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 21, 10)
+    assert np.array_equal(np.asarray(utils.preprocess_image(gray, "full")), expected)
+
+def test_contrast_profile_recovers_faint_text():
+    gray = dim_receipt()
+    original = gray.copy()
+    full = np.asarray(utils.preprocess_image(gray, "full"))
+    stretched = np.asarray(utils.preprocess_image(gray, "contrast"))
+    assert np.array_equal(gray, original)
+    # The strokes differ from the page by less than the threshold offset until the stretch
+    assert (full[40:46, 30:270] == 255).all()
+    assert (stretched[40:46, 30:270] == 0).mean() > 0.5
+
+@pytest.mark.parametrize("quality, profile", [
+    ({"binary": 0.9, "contrast": 90, "sharpness": 500, "brightness": 200, "resolution": 2000}, "skip"),
+    ({"binary": 0.1, "contrast": 10, "sharpness": 500, "brightness": 150, "resolution": 2000}, "contrast"),
+    ({"binary": 0.1, "contrast": 40, "sharpness": 500, "brightness": 50, "resolution": 2000}, "contrast"),
+    ({"binary": 0.1, "contrast": 40, "sharpness": 500, "brightness": 150, "resolution": 2000}, "light"),
+    ({"binary": 0.1, "contrast": 40, "sharpness": 100, "brightness": 150, "resolution": 2000}, "full"),
+])
+def test_choose_profile(quality, profile):
+    assert utils.choose_profile(quality) == profile
@@ -0,0 +1,45 @@
+import os
+import pytest
+import pipeline
+import preprocess_pool
+import utils
+
+TEST_IMAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test-images")
+
+class RecordingPreprocess:
+    """
+    Out-of-process stand-in recording what it was given.
+    """
+
+    def __init__(self):
+        self.inputs = []
+
+    def __call__(self, image, profile="full", max_side=utils.DECODE_MAX_SIDE):
+        self.inputs.append(type(image))
+        return utils.preprocess_image(image, profile, max_side)
+
+@pytest.fixture
+def image_bytes(monkeypatch):
+    monkeypatch.delenv("RECEIPT_CROP", raising=False)
+    monkeypatch.delenv("PREPROCESS_PROFILE", raising=False)
+    with open(os.path.join(TEST_IMAGES, "fuel-5.jpeg"), "rb") as f:
+        return f.read()
+
+def test_pool_decodes_when_pixels_are_not_needed(image_bytes):
+    preprocess = RecordingPreprocess()
+    result = pipeline.process_receipt(image_bytes, None, preprocess=preprocess, profile="full")
+    assert preprocess.inputs == [bytes]
+    assert "decode" not in result["stages"]
+    assert result["preprocess"] == {"profile": "full"}
+
+@pytest.mark.parametrize("options", [{"profile": "auto"}, {"profile": "full", "crop": True}])
+def test_pixels_needed_here_are_decoded_here(image_bytes, options):
+    preprocess = RecordingPreprocess()
+    result = pipeline.process_receipt(image_bytes, None, preprocess=preprocess, **options)
+    assert preprocess.inputs and all(kind is not bytes for kind in preprocess.inputs)
+    assert "decode" in result["stages"]
+
+def test_worker_decodes_like_the_caller(image_bytes):
+    with preprocess_pool.PreprocessExecutor(max_workers=1) as executor:
+        pooled = executor.preprocess(image_bytes, "light", max_side=800)
+    assert pooled.tobytes() == utils.preprocess_image(image_bytes, "light", max_side=800).tobytes()
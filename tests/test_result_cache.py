@@ -0,0 +1,24 @@
+import result_cache
+
+def test_other_prompt_versions_survive_reopening(tmp_path, monkeypatch):
+    path = str(tmp_path / "results.sqlite3")
+    cache = result_cache.ResultCache(path)
+    old_key = result_cache.make_key(b"image", "model")
+    cache.put(old_key, {"type": "FUEL"})
+    cache.close()
+
+    monkeypatch.setattr(result_cache, "prompt_version", lambda: "newer")
+    cache = result_cache.ResultCache(path)
+    new_key = result_cache.make_key(b"image", "model")
+    assert new_key != old_key
+    assert cache.get(new_key) is None
+    assert cache.get(old_key) == {"type": "FUEL", "data": {"type": "FUEL"}}
+    cache.close()
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path / "results.sqlite3"), max_entries=2)
+    for name in ("a", "b", "c"):
+        cache.put(name, {"type": "FUEL"})
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 2
+    cache.close()
@@ -0,0 +1,38 @@
+import pytest
+import results_store
+
+def stored_items(store):
+    return store.conn.execute("SELECT receipt_id, position, name, price FROM items ORDER BY receipt_id, position").fetchall()
+
+@pytest.fixture
+def store(tmp_path):
+    store = results_store.ResultsStore(str(tmp_path / "receipts.sqlite3"))
+    yield store
+    store.close()
+
+def test_item_names_stay_with_their_prices(store):
+    ids = store.add_many([
+        {"data": {"type": "MARKET", "total_amount": "10,00",
+                  "items": ["stray text", {"name": "Bread", "price": "4,00"}, None, {"name": "Milk", "price": "6,00"}]},
+         "image_digest": "a"},
+        {"data": {"type": "MARKET", "total_amount": "3,00", "items": {"name": "not a list"}}, "image_digest": "b"},
+        {"data": {"type": "MARKET", "total_amount": "2,50", "items": [{"name": "Tea", "price": "2,50"}]},
+         "image_digest": "c"},
+    ])
+    assert stored_items(store) == [(ids[0], 1, "Bread", 4.0), (ids[0], 3, "Milk", 6.0), (ids[2], 0, "Tea", 2.5)]
+
+def test_duplicates_add_no_items(store):
+    record = {"data": {"type": "MARKET", "items": [{"name": "Tea", "price": "2,50"}]}, "image_digest": "a"}
+    store.add_many([record])
+    assert store.add_many([record]) == [None]
+    assert len(stored_items(store)) == 1
+
+def test_store_is_opt_in(monkeypatch, tmp_path):
+    monkeypatch.delenv("RESULTS_STORE_PATH", raising=False)
+    assert results_store.create_store() is None
+    monkeypatch.setenv("RESULTS_STORE_PATH", "")
+    assert results_store.create_store() is None
+    monkeypatch.setenv("RESULTS_STORE_PATH", str(tmp_path / "receipts.sqlite3"))
+    store = results_store.create_store()
+    assert store is not None
+    store.close()
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import os
+import backends
+import service
+
+TEST_IMAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test-images")
+
+def receipt_bytes():
+    with open(os.path.join(TEST_IMAGES, "fuel-5.jpeg"), "rb") as f:
+        return f.read()
+
+async def request(port, method, path, body=b""):
+    """
+    Send one HTTP request and return (status code, headers, JSON body).
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: test\r\nContent-Length: {len(body)}\r\n"
+                 "Connection: close\r\n\r\n".encode("latin-1") + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode("latin-1").split("\r\n")
+    headers = {name.lower(): value.strip() for name, _, value in (line.partition(":") for line in header_lines)}
+    return int(status_line.split()[1]), headers, json.loads(content)
+
+async def start_service(max_queue):
+    # One slow worker, so accepted receipts are still waiting when the test goes on
+    extraction = service.ExtractionService(backends.FakeBackend(seed=1, latency=0.2), workers=1, max_queue=max_queue)
+    server = await extraction.start(port=0)
+    return extraction, server.sockets[0].getsockname()[1]
+
+def test_full_queue_rejects_with_retry_after():
+    async def run():
+        extraction, port = await start_service(max_queue=2)
+        image = receipt_bytes()
+        accepted = [extraction.submit(image)]
+        while not extraction.running:
+            await asyncio.sleep(0.01)
+        accepted += [extraction.submit(image), extraction.submit(image)]
+        status_code, headers, body = await request(port, "POST", "/jobs", image)
+        health = extraction.health()
+        await extraction.drain(timeout=10)
+        return accepted, status_code, headers, body, health
+
+    accepted, status_code, headers, body, health = asyncio.run(run())
+    assert status_code == 429
+    assert headers["retry-after"] == "1"
+    assert "error" in body
+    assert health["rejected"] == 1
+    assert [job.status for job in accepted] == [service.JOB_DONE] * 3
+
+def test_drain_finishes_accepted_receipts():
+    async def run():
+        extraction, port = await start_service(max_queue=4)
+        image = receipt_bytes()
+        waiting = asyncio.create_task(request(port, "POST", "/extract", image))
+        polled = [extraction.submit(image) for _ in range(2)]
+        while extraction.queue.qsize() + extraction.running < 3:
+            await asyncio.sleep(0.01)
+
+        drain = asyncio.create_task(extraction.drain(timeout=10))
+        await asyncio.sleep(0)
+        try:
+            extraction.submit(image)
+            late = None
+        except service.HTTPError as e:
+            late = e.status_code
+        response = await waiting
+        await drain
+        return response, polled, late
+
+    (status_code, _, body), polled, late = asyncio.run(run())
+    assert late == 503
+    assert status_code == 200
+    assert body["success"]
+    assert all(job.status == service.JOB_DONE and job.result["success"] for job in polled)
@@ -0,0 +1,62 @@
+import json
+import pytest
+import streaming
+
+RESPONSE = (
+    '```json\n{"type": "RESTAURANT", "merchant": "Caf\\u00e9 \\"Zum Bären\\" \\\\ Bar",\n'
+    '  "date": "2024-03-01", "items": [\n'
+    '    {"name": "Soup, {hot}", "quantity": 2, "price": 4.75},\n'
+    '    {"name": "Tea \\"large\\"", "quantity": 1, "price": -0.5e1, "tags": ["a", {"b": 1}]}\n'
+    '  ], "total": 1234.56, "paid": true, "note": null}\n```'
+)
+
+def expected_events(text):
+    """
+    Events a parser has to report for a complete response, in order.
+    """
+    receipt = json.loads(text[text.index("{"):text.rindex("}") + 1])
+    events = []
+    for key, value in receipt.items():
+        if key == "items":
+            events.extend(("item", index, item) for index, item in enumerate(value))
+        else:
+            events.append(("field", key, value))
+    return events
+
+def parse(chunks):
+    parser = streaming.IncrementalReceiptParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return events
+
+@pytest.mark.parametrize("split", range(1, len(RESPONSE)))
+def test_any_split_gives_the_same_events(split):
+    # Covers cuts inside strings, escapes, \u sequences and numbers
+    assert parse([RESPONSE[:split], RESPONSE[split:]]) == expected_events(RESPONSE)
+
+@pytest.mark.parametrize("marker", ['\\"Zum', "\\\\ Bar", "\\u00e9", "1234.56", "-0.5e1", '"Soup, {hot}"'])
+def test_split_inside_token(marker):
+    start = RESPONSE.index(marker)
+    chunks = [RESPONSE[:start + 1], RESPONSE[start + 1:start + len(marker) - 1], RESPONSE[start + len(marker) - 1:]]
+    assert parse(chunks) == expected_events(RESPONSE)
+
+def test_character_by_character():
+    assert parse(list(RESPONSE)) == expected_events(RESPONSE)
+
+def test_events_arrive_as_values_complete():
+    parser = streaming.IncrementalReceiptParser()
+    assert parser.feed('{"type": "FUEL", "total": 12') == [("field", "type", "FUEL")]
+    assert parser.feed('.5') == []
+    assert parser.feed(', "items": [{"name": "Diesel"}') == [("field", "total", 12.5),
+                                                            ("item", 0, {"name": "Diesel"})]
+    assert parser.feed(']}') == []
+
+def test_event_stream_uses_a_parser_per_response():
+    events = []
+    start = streaming.event_stream(events.append)
+    first, second = start(), start()
+    first('{"type": ')
+    second('{"type": "FUEL",')
+    first('"MARKET",')
+    assert events == [("field", "type", "FUEL"), ("field", "type", "MARKET")]
@@ -0,0 +1,100 @@
+import time
+import pytest
+import backends
+import throttle
+
+class FailingBackend(backends.ModelBackend):
+    """
+    Backend raising the given exception on every call, or answering "ok" when it is None.
+    """
+
+    name = "failing"
+    model_name = "failing"
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    def generate(self, contents):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return "ok"
+
+def make_backend(error, threshold=3, cooldown=60.0):
+    inner = FailingBackend(error)
+    breaker = throttle.CircuitBreaker(failure_threshold=threshold, cooldown=cooldown)
+    backend = throttle.ThrottledBackend(inner, breaker=breaker, max_attempts=1, deadline=0.5, seed=0)
+    return inner, breaker, backend
+
+def test_server_errors_open_the_circuit():
+    inner, breaker, backend = make_backend(backends.BackendError("down", status_code=500))
+    for _ in range(3):
+        with pytest.raises(backends.BackendError):
+            backend.generate(["prompt"])
+    assert breaker.state == "open"
+    with pytest.raises(throttle.CircuitOpenError):
+        backend.generate(["prompt"])
+    assert inner.calls == 3
+
+@pytest.mark.parametrize("error", [ValueError("blocked"), backends.BackendError("blocked", status_code=422),
+                                   backends.BackendError("slow down", status_code=429)])
+def test_other_errors_keep_the_circuit_closed(error):
+    inner, breaker, backend = make_backend(error)
+    for _ in range(5):
+        with pytest.raises(type(error)):
+            backend.generate(["prompt"])
+    assert breaker.state == "closed"
+    assert inner.calls == 5
+    assert backend.concurrency.in_flight == 0
+
+def test_probe_success_closes_the_circuit():
+    inner, breaker, backend = make_backend(backends.BackendError("down", status_code=503), threshold=1,
+                                           cooldown=0.05)
+    with pytest.raises(backends.BackendError):
+        backend.generate(["prompt"])
+    assert breaker.state == "open"
+    inner.error = None
+    time.sleep(0.06)
+    assert backend.generate(["prompt"]) == "ok"
+    assert breaker.state == "closed"
+
+def test_probe_failure_reopens_the_circuit():
+    breaker = throttle.CircuitBreaker(failure_threshold=1, cooldown=0.0)
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.acquire() is True
+    breaker.record(False, probe=True)
+    assert breaker.state == "open"
+
+def test_overload_halves_the_limit_once_per_round_trip():
+    limit = throttle.AdaptiveConcurrency(initial=8, minimum=1, maximum=32)
+    for _ in range(4):
+        limit.acquire()
+    for _ in range(4):
+        limit.release(overloaded=True)
+    assert limit.limit == 4
+    assert limit.decreases == 1
+
+def test_saturated_successes_raise_the_limit():
+    limit = throttle.AdaptiveConcurrency(initial=2, minimum=1, maximum=3)
+    for _ in range(20):
+        limit.acquire()
+        limit.acquire()
+        limit.release(latency=0.1)
+        limit.release(latency=0.1)
+    assert limit.limit == 3
+    assert limit.in_flight == 0
+
+def test_unsaturated_successes_keep_the_limit():
+    limit = throttle.AdaptiveConcurrency(initial=4)
+    for _ in range(10):
+        limit.acquire()
+        limit.release(latency=0.1)
+    assert limit.limit == 4
+
+def test_acquire_times_out_at_the_deadline():
+    limit = throttle.AdaptiveConcurrency(initial=1, minimum=1, maximum=1)
+    limit.acquire()
+    with pytest.raises(throttle.DeadlineExceeded):
+        limit.acquire(deadline=time.monotonic() + 0.01)
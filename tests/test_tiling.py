@@ -0,0 +1,66 @@
+import json
+import threading
+import time
+import pytest
+import backends
+import tiling
+import utils
+
+SUMMARY = {"type": "MARKET", "business_name": "BIM", "date": "01.05.2025", "total_amount": "7,50"}
+
+class BandBackend(backends.ModelBackend):
+    """
+    Backend answering the whole-image summary (a dict, or a raw text) at once
+    and every band after band_delay seconds, with the given band texts.
+    """
+
+    name = "bands"
+    model_name = "bands"
+
+    def __init__(self, summary, band_texts, band_delay=0.0):
+        self.summary = summary
+        self.band_texts = band_texts
+        self.band_delay = band_delay
+        self.released = threading.Event()
+
+    def generate(self, contents):
+        img, prompt = contents
+        if img["data"].startswith(b"band"):
+            self.released.wait(self.band_delay)
+            return self.band_texts[int(img["data"][4:])]
+        return self.summary if isinstance(self.summary, str) else json.dumps(self.summary)
+
+def uploads(count):
+    return {"data": b"whole"}, [{"data": f"band{index}".encode()} for index in range(count)]
+
+def test_bands_are_merged():
+    texts = [json.dumps({"items": [{"name": "Milk", "price": "5,00"}, {"name": "Tea", "price": "2,50"}]}),
+             json.dumps({"items": [{"name": "Tea", "price": "2,50"}]})]
+    img, bands = uploads(2)
+    receipt_data, report = tiling.extract_tiled(BandBackend(SUMMARY, texts), img, bands)
+    assert [item["name"] for item in receipt_data["items"]] == ["Milk", "Tea"]
+    assert report["bands"] == 2
+
+def test_other_types_do_not_wait_for_the_bands():
+    backend = BandBackend(dict(SUMMARY, type="FUEL"), ['{"items": []}'] * 2, band_delay=5.0)
+    img, bands = uploads(2)
+    start = time.perf_counter()
+    receipt_data, report = tiling.extract_tiled(backend, img, bands)
+    assert time.perf_counter() - start < 1.0
+    assert receipt_data["type"] == "FUEL"
+    assert report is None
+    backend.released.set()
+
+@pytest.mark.parametrize("band_text", ['{"items": [{"name": "Milk", "price": "5,00"}, {"name": "Te',
+                                       "no items here"])
+def test_unreadable_band_gives_up(band_text):
+    backend = BandBackend(SUMMARY, ['{"items": []}', band_text])
+    img, bands = uploads(2)
+    assert tiling.extract_tiled(backend, img, bands) == (None, None)
+
+@pytest.mark.parametrize("summary", ["", "The receipt is unreadable.", '{"type": "MARKET", "business_name": "BI',
+                                     '["MARKET"]', {"type": "INVOICE"}])
+def test_unusable_summary_gives_up(summary):
+    backend = BandBackend(summary, ['{"items": []}'] * 2)
+    img, bands = uploads(2)
+    assert tiling.extract_tiled(backend, img, bands) == (None, None)
@@ -0,0 +1,12 @@
+import numpy as np
+import pytest
+import utils
+
+@pytest.mark.parametrize("image_format", ["png1", "webp1"])
+@pytest.mark.parametrize("max_side", [None, 50])
+def test_encoding_leaves_the_callers_array_alone(image_format, max_side):
+    gray = np.tile(np.arange(256, dtype=np.uint8), (100, 1))
+    original = gray.copy()
+    payload = utils.encode_for_upload(gray, max_side=max_side, image_format=image_format)
+    assert payload["data"]
+    assert np.array_equal(gray, original)